@@ -0,0 +1,214 @@
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+VOCABULARY = (
+    "the", "index", "returns", "relevant", "chunks", "for", "each", "query", "and", "answer", "uses",
+    "context", "from", "retrieved", "documents", "to", "stay", "grounded", "in", "stored", "sources",
+)
+
+
+class FakeOllama:
+    """
+    Ollama stand-in for load tests: `/api/tags`, `/api/version`,
+    `/api/chat` and `/api/generate`, streamed (NDJSON) or not.
+
+    Each generation waits `first_token_ms` (plus the prompt length at
+    `prefill_tokens_per_second`, if set) and then emits `response_tokens`
+    words at `tokens_per_second`, so latency follows prompt and answer
+    length the way CPU inference does. `jitter` randomizes both delays by
+    up to ±that fraction. With `parallel` > 0 at most that many generations
+    run at once and the rest queue, like OLLAMA_NUM_PARALLEL.
+    """
+
+    def __init__(self, models=('llama3',), tokens_per_second=20.0, first_token_ms=200.0, response_tokens=64,
+                 prefill_tokens_per_second=0.0, jitter=0.0, parallel=0, seed=None):
+        self.models = list(models)
+        self.tokens_per_second = tokens_per_second
+        self.first_token_ms = first_token_ms
+        self.response_tokens = response_tokens
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.jitter = jitter
+        self.slots = threading.BoundedSemaphore(parallel) if parallel > 0 else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.active = 0
+
+    def tags(self):
+        return {'models': [{
+            'name': name if ':' in name else f"{name}:latest",
+            'model': name if ':' in name else f"{name}:latest",
+            'modified_at': datetime.now(timezone.utc).isoformat(),
+            'size': 0,
+            'details': {'family': 'fake', 'parameter_size': '0B'},
+        } for name in self.models]}
+
+    def generate(self, prompt):
+        """Yield response tokens with the configured timing"""
+        with self._lock:
+            self.requests += 1
+            first_token = self._vary(self.first_token_ms / 1000)
+            if self.prefill_tokens_per_second > 0:
+                first_token += self._vary(len(prompt) / 4 / self.prefill_tokens_per_second)
+            interval = self._vary(1 / self.tokens_per_second) if self.tokens_per_second > 0 else 0.0
+        if self.slots is not None:
+            self.slots.acquire()
+        with self._lock:
+            self.active += 1
+        try:
+            time.sleep(first_token)
+            for i in range(self.response_tokens):
+                if i:
+                    time.sleep(interval)
+                yield ('' if i == 0 else ' ') + VOCABULARY[i % len(VOCABULARY)]
+        finally:
+            with self._lock:
+                self.active -= 1
+            if self.slots is not None:
+                self.slots.release()
+
+    def _vary(self, seconds):
+        if not self.jitter:
+            return seconds
+        return max(seconds * (1 + self._random.uniform(-self.jitter, self.jitter)), 0.0)
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeOllama/1.0'
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        if path == '':
+            self._send_text("Ollama is running")
+        elif path == '/api/tags':
+            self._send_json(self.server.fake.tags())
+        elif path == '/api/version':
+            self._send_json({'version': '0.0.0-fake'})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+        if path not in ('/api/chat', '/api/generate'):
+            self._send_json({'error': 'not found'}, status=404)
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json({'error': 'invalid JSON body'}, status=400)
+            return
+
+        model = payload.get('model') or ''
+        if model.split(':')[0] not in {name.split(':')[0] for name in self.server.fake.models}:
+            self._send_json({'error': f"model '{model}' not found"}, status=404)
+            return
+
+        chat = path == '/api/chat'
+        if chat:
+            prompt = ''.join(str(message.get('content', '')) for message in payload.get('messages') or [])
+        else:
+            prompt = str(payload.get('prompt', ''))
+        start = time.perf_counter()
+        if not chat and not prompt:
+            # An empty prompt only loads the model
+            body = self._message(model, chat, '', True, '', 0, start)
+            if payload.get('stream', True):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                self._write_chunk(body)
+                self._write_chunk(b'')
+            else:
+                self._send_bytes(body, 'application/json')
+            return
+        tokens = self.server.fake.generate(prompt)
+
+        if payload.get('stream', True):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            count = 0
+            for token in tokens:
+                count += 1
+                self._write_chunk(self._message(model, chat, token, False))
+            self._write_chunk(self._message(model, chat, '', True, prompt, count, start))
+            self._write_chunk(b'')
+        else:
+            text = ''.join(tokens)
+            body = self._message(model, chat, text, True, prompt, self.server.fake.response_tokens, start)
+            self._send_bytes(body, 'application/json')
+
+    @staticmethod
+    def _message(model, chat, text, done, prompt='', count=0, start=None):
+        message = {'model': model, 'created_at': datetime.now(timezone.utc).isoformat(), 'done': done}
+        if chat:
+            message['message'] = {'role': 'assistant', 'content': text}
+        else:
+            message['response'] = text
+        if done:
+            elapsed_ns = int((time.perf_counter() - start) * 1e9)
+            message.update({
+                'done_reason': 'stop',
+                'total_duration': elapsed_ns,
+                'load_duration': 0,
+                'prompt_eval_count': len(prompt) // 4,
+                'eval_count': count,
+                'eval_duration': elapsed_ns,
+            })
+        return (json.dumps(message) + '\n').encode('utf-8')
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, payload, status=200):
+        self._send_bytes(json.dumps(payload).encode('utf-8'), 'application/json', status)
+
+    def _send_text(self, text):
+        self._send_bytes(text.encode('utf-8'), 'text/plain; charset=utf-8')
+
+    def _send_bytes(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    """Threaded HTTP server for a FakeOllama; one thread per connection"""
+
+    daemon_threads = True
+
+    def __init__(self, address, fake=None):
+        super().__init__(address, FakeOllamaHandler)
+        self.fake = fake or FakeOllama()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve in a background thread (e.g. from a test or CI job) and return self"""
+        threading.Thread(target=self.serve_forever, name='fake-ollama', daemon=True).start()
+        return self
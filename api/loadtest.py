@@ -0,0 +1,213 @@
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERIES = (
+    "What does this project do?",
+    "How do I configure the embedding model?",
+    "Which vector database is used for retrieval?",
+    "How are answers generated from the retrieved context?",
+    "How can I ingest new documents?",
+    "What happens when no relevant context is found?",
+    "How is chat history stored?",
+    "Which environment variables control the LLM?",
+)
+
+
+def percentiles(samples):
+    """Mean, p50/p90/p95/p99 and max of samples in seconds, reported in milliseconds"""
+    if not samples:
+        return None
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    p50, p90, p95, p99 = np.percentile(values, [50, 90, 95, 99])
+    return {
+        'mean_ms': float(values.mean()), 'p50_ms': float(p50), 'p90_ms': float(p90),
+        'p95_ms': float(p95), 'p99_ms': float(p99), 'max_ms': float(values.max()),
+    }
+
+
+class LoadGenerator:
+    """
+    HTTP load generator for the query API.
+
+    Closed loop (default): `concurrency` workers each send their next
+    request as soon as the previous one completes, which measures the
+    throughput a given worker/thread setup sustains. Open loop (`rate`):
+    requests start at Poisson arrival times averaging `rate` per second
+    whether or not earlier ones finished. Latency is measured from the
+    scheduled start, so time spent queued behind a saturated server counts
+    and is not hidden by the generator slowing down.
+
+    With `stream`, the NDJSON stream is read and time to the first token is
+    reported too. `distinct` makes every query text unique so the embedding
+    and answer caches do not short-circuit the pipeline.
+    """
+
+    def __init__(self, url, queries=DEFAULT_QUERIES, concurrency=8, rate=None, duration=30.0, max_requests=None,
+                 stream=False, distinct=False, timeout=120.0, filters=None, max_in_flight=256, seed=0):
+        self.url = url
+        self.queries = list(queries)
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.max_requests = max_requests
+        self.stream = stream
+        self.distinct = distinct
+        self.timeout = timeout
+        self.filters = filters
+        self.max_in_flight = max_in_flight
+        self._random = random.Random(seed)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sent = 0
+        self.records = []
+
+    def warm_up(self, count=1):
+        """Send `count` requests outside the measurement (e.g. to build the engine)"""
+        for i in range(count):
+            record = self._request(-1 - i, time.perf_counter())
+            if record['error']:
+                logger.warning(f"Warm-up request failed: {record['error']}")
+
+    def run(self):
+        """Run the load and return the report"""
+        self.records = []
+        self._sent = 0
+        start = time.perf_counter()
+        if self.rate:
+            self._run_open_loop(start)
+        else:
+            self._run_closed_loop(start)
+        return self.report(time.perf_counter() - start)
+
+    def report(self, elapsed):
+        ok = [record for record in self.records if not record['error']]
+        statuses = {}
+        errors = {}
+        for record in self.records:
+            statuses[str(record['status'])] = statuses.get(str(record['status']), 0) + 1
+            if record['error']:
+                errors[record['error']] = errors.get(record['error'], 0) + 1
+        return {
+            'url': self.url,
+            'mode': 'open' if self.rate else 'closed',
+            'concurrency': None if self.rate else self.concurrency,
+            'rate': self.rate,
+            'stream': self.stream,
+            'elapsed_s': elapsed,
+            'requests': len(self.records),
+            'succeeded': len(ok),
+            'failed': len(self.records) - len(ok),
+            'throughput_rps': len(ok) / elapsed if elapsed else 0.0,
+            'status_codes': statuses,
+            'errors': errors,
+            'latency': percentiles([record['latency'] for record in ok]),
+            'first_token': percentiles([record['first_token'] for record in ok if record['first_token'] is not None]),
+        }
+
+    def _next_index(self):
+        with self._lock:
+            if self.max_requests is not None and self._sent >= self.max_requests:
+                return None
+            self._sent += 1
+            return self._sent - 1
+
+    def _run_closed_loop(self, start):
+        deadline = start + self.duration
+
+        def worker():
+            while time.perf_counter() < deadline:
+                i = self._next_index()
+                if i is None:
+                    return
+                self._record(self._request(i, time.perf_counter()))
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _run_open_loop(self, start):
+        deadline = start + self.duration
+        scheduled = start
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='load') as pool:
+            while True:
+                scheduled += self._random.expovariate(self.rate)
+                if scheduled >= deadline:
+                    break
+                i = self._next_index()
+                if i is None:
+                    break
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(lambda i=i, at=scheduled: self._record(self._request(i, at)))
+
+    def _record(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _payload(self, i):
+        query = self.queries[i % len(self.queries)]
+        if self.distinct:
+            query = f"{query} (request {i})"
+        payload = {'query': [query], 'session_id': f"load-test-{i % max(self.concurrency, 1)}"}
+        if self.stream:
+            payload['stream'] = True
+        if self.filters:
+            payload['filters'] = self.filters
+        return payload
+
+    def _request(self, i, scheduled):
+        record = {'status': None, 'error': None, 'latency': None, 'first_token': None}
+        try:
+            if self.stream:
+                self._stream_request(i, scheduled, record)
+            else:
+                response = self._session().post(self.url, json=self._payload(i), timeout=self.timeout)
+                record['status'] = response.status_code
+                if response.status_code != 200:
+                    record['error'] = f"HTTP {response.status_code}"
+                elif 'response' not in response.json():
+                    record['error'] = 'malformed response'
+        except requests.RequestException as e:
+            record['error'] = type(e).__name__
+        record['latency'] = time.perf_counter() - scheduled
+        return record
+
+    def _stream_request(self, i, scheduled, record):
+        with self._session().post(self.url, json=self._payload(i), timeout=self.timeout, stream=True,
+                                  headers={'Accept': 'application/x-ndjson'}) as response:
+            record['status'] = response.status_code
+            if response.status_code != 200:
+                record['error'] = f"HTTP {response.status_code}"
+                return
+            finished = False
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event['event'] == 'token' and record['first_token'] is None:
+                    record['first_token'] = time.perf_counter() - scheduled
+                elif event['event'] == 'done':
+                    finished = True
+                elif event['event'] == 'error':
+                    record['error'] = 'stream error'
+                    finished = True
+            if not finished:
+                record['error'] = 'stream truncated'
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from api.fake_ollama import FakeOllama, FakeOllamaServer
+
+
+class Command(BaseCommand):
+    help = "Serve a fake Ollama API (/api/tags, /api/chat, /api/generate) with configurable generation timing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=11435)
+        parser.add_argument('--models', default='llama3', help="Comma-separated model names to advertise")
+        parser.add_argument('--tokens-per-second', type=float, default=20.0, help="Generation speed")
+        parser.add_argument('--first-token-ms', type=float, default=200.0, help="Fixed delay before the first token")
+        parser.add_argument('--prefill-tokens-per-second', type=float, default=0.0,
+                            help="Add prompt length / this rate to the first-token delay (0 = off)")
+        parser.add_argument('--response-tokens', type=int, default=64, help="Tokens per answer")
+        parser.add_argument('--jitter', type=float, default=0.0,
+                            help="Randomize delays by up to this fraction (e.g. 0.2)")
+        parser.add_argument('--parallel', type=int, default=0,
+                            help="Generations served at once, the rest queue (0 = unlimited)")
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        fake = FakeOllama(
+            models=options['models'].split(','),
+            tokens_per_second=options['tokens_per_second'],
+            first_token_ms=options['first_token_ms'],
+            response_tokens=options['response_tokens'],
+            prefill_tokens_per_second=options['prefill_tokens_per_second'],
+            jitter=options['jitter'],
+            parallel=options['parallel'],
+            seed=options['seed'],
+        )
+        server = FakeOllamaServer((options['host'], options['port']), fake)
+        self.stdout.write(self.style.SUCCESS(
+            f"Fake Ollama serving {', '.join(fake.models)} on {server.base_url} "
+            f"({fake.first_token_ms:.0f}ms to first token, {fake.tokens_per_second:g} tokens/s, "
+            f"{fake.response_tokens} tokens per answer)"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served {fake.requests} generations")
@@ -0,0 +1,73 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.loadtest import DEFAULT_QUERIES, LoadGenerator
+
+
+class Command(BaseCommand):
+    help = "Drive the query API at fixed concurrency or an open-loop arrival rate and report latency percentiles"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/api/query/', help="Query endpoint to load")
+        parser.add_argument('--concurrency', type=int, default=8, help="Closed-loop workers")
+        parser.add_argument('--rate', type=float, default=None,
+                            help="Open-loop arrivals per second (overrides --concurrency)")
+        parser.add_argument('--duration', type=float, default=30.0, help="Seconds to generate load")
+        parser.add_argument('--requests', type=int, default=None, help="Stop after this many requests")
+        parser.add_argument('--warmup', type=int, default=1, help="Unmeasured requests sent first")
+        parser.add_argument('--queries-file', default=None, help="File with one query per line")
+        parser.add_argument('--stream', action='store_true', help="Request streamed answers and time the first token")
+        parser.add_argument('--distinct', action='store_true',
+                            help="Make every query unique so caches do not answer it")
+        parser.add_argument('--filters', default=None, help="JSON metadata filter sent with every query")
+        parser.add_argument('--timeout', type=float, default=120.0, help="Per-request timeout in seconds")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_path', default=None, help="Also write the report to this file")
+
+    def handle(self, *args, **options):
+        queries = DEFAULT_QUERIES
+        if options['queries_file']:
+            with open(options['queries_file']) as f:
+                queries = [line.strip() for line in f if line.strip()]
+            if not queries:
+                raise CommandError(f"No queries in {options['queries_file']}")
+        try:
+            filters = json.loads(options['filters']) if options['filters'] else None
+        except ValueError as e:
+            raise CommandError(f"--filters is not valid JSON: {str(e)}")
+
+        generator = LoadGenerator(
+            options['url'],
+            queries=queries,
+            concurrency=options['concurrency'],
+            rate=options['rate'],
+            duration=options['duration'],
+            max_requests=options['requests'],
+            stream=options['stream'],
+            distinct=options['distinct'],
+            timeout=options['timeout'],
+            filters=filters,
+            seed=options['seed'],
+        )
+        generator.warm_up(options['warmup'])
+        report = generator.run()
+
+        load = f"rate={report['rate']}/s" if report['rate'] else f"concurrency={report['concurrency']}"
+        self.stdout.write(
+            f"{report['mode']} loop, {load}: {report['requests']} requests in {report['elapsed_s']:.1f}s, "
+            f"{report['succeeded']} ok, {report['failed']} failed, {report['throughput_rps']:.2f} req/s"
+        )
+        for name in ('latency', 'first_token'):
+            stats = report[name]
+            if stats:
+                self.stdout.write(
+                    f"{name:>12}: mean={stats['mean_ms']:.1f}ms p50={stats['p50_ms']:.1f}ms "
+                    f"p90={stats['p90_ms']:.1f}ms p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms "
+                    f"max={stats['max_ms']:.1f}ms"
+                )
+        if report['errors']:
+            self.stdout.write(self.style.WARNING(f"errors: {report['errors']}"))
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
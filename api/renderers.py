@@ -0,0 +1,17 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class EventStreamRenderer(JSONRenderer):
+    """
+    Lets clients send `Accept: text/event-stream` for streamed queries.
+    The stream itself is written by the view; anything else (validation
+    errors) is rendered as plain JSON.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+
+class NDJSONRenderer(JSONRenderer):
+    """Same as EventStreamRenderer for `Accept: application/x-ndjson`"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
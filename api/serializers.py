@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from vector_db.filters import normalize_filters
 
 class QuerySerializer(serializers.Serializer):
     query = serializers.ListField(
@@ -10,6 +11,16 @@ class QuerySerializer(serializers.Serializer):
         }
     )
     session_id = serializers.CharField(required=False)
+    stream = serializers.BooleanField(required=False, default=False)
+    batch = serializers.BooleanField(required=False, default=False)
+    filters = serializers.DictField(required=False)
+    model_config = serializers.CharField(required=False)
+
+    def validate_filters(self, value):
+        try:
+            return normalize_filters(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
 
     def to_internal_value(self, data):
         try:
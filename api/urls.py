@@ -1,6 +1,9 @@
 from django.urls import path
-from .views import QueryView
+from .views import AsyncQueryView, HealthView, QueryView, ReadinessView
 
 urlpatterns = [
     path('query/', QueryView.as_view(), name='query-api'),
+    path('query/async/', AsyncQueryView.as_view(), name='async-query-api'),
+    path('health/', HealthView.as_view(), name='health-api'),
+    path('ready/', ReadinessView.as_view(), name='ready-api'),
 ]
\ No newline at end of file
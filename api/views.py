@@ -1,24 +1,91 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from .renderers import EventStreamRenderer, NDJSONRenderer
 from .serializers import QuerySerializer
-from rag_engine.chain import RAGChain
-from chat_history.models import ChatHistory
+from rag_engine.answer_cache import answer_cache
+from rag_engine.cache import embedding_cache
+from rag_engine.coalesce import coalescer
+from rag_engine.context import context_packer
+from rag_engine.embedding import embedding_service
+from rag_engine.engine import engine, get_rag_chain
+from rag_engine.registry import UnknownModelConfig, embedding_models, model_registry
+from rag_engine.scheduler import LLMOverloaded, llm_scheduler
+from chat_history.writer import chat_writer
+from vector_db.shards import shard_pool
+from core.metrics import metrics, stage, track_request
+import asyncio
+import json
 import logging
 import time
 
 logger = logging.getLogger(__name__)
 
+
+def history_metadata(sources, filters):
+    """ChatHistory metadata for an answer; filtered answers record their filter"""
+    metadata = {'sources': sources}
+    if filters:
+        metadata['filters'] = filters
+    return metadata
+
+
+def overloaded_response(e, trace, response_class=Response):
+    """429/503 with Retry-After for a request the LLM scheduler turned away"""
+    logger.warning(f"Rejected request: {str(e)}")
+    trace.status = e.status
+    response = response_class({'error': 'LLM overloaded', 'details': str(e), 'retry_after': e.retry_after},
+                              status=e.status)
+    response['Retry-After'] = str(e.retry_after)
+    return response
+
+
+def event_stream_response(request, events):
+    """
+    Streaming response for `events(encode)`, a sync or async generator that
+    yields `encode(event)` for each event: Server-Sent Events when the client
+    accepts text/event-stream, otherwise newline-delimited JSON.
+    """
+    use_sse = 'text/event-stream' in request.headers.get('Accept', '')
+
+    def encode(event):
+        payload = json.dumps(event, cls=DjangoJSONEncoder)
+        if use_sse:
+            return f"event: {event['event']}\ndata: {payload}\n\n"
+        return payload + "\n"
+
+    response = StreamingHttpResponse(
+        events(encode),
+        content_type='text/event-stream' if use_sse else 'application/x-ndjson'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 class QueryView(APIView):
     # Add this to disable CSRF for this view (use with caution)
     authentication_classes = []
     permission_classes = []
+    renderer_classes = [JSONRenderer, EventStreamRenderer, NDJSONRenderer]
     
     def post(self, request):
+        with track_request('query') as trace:
+            return self.handle(request, trace)
+
+    def handle(self, request, trace):
         start_time = time.time()
-        serializer = QuerySerializer(data=request.data)
+        with stage('validate'):
+            serializer = QuerySerializer(data=request.data)
+            valid = serializer.is_valid()
         
-        if not serializer.is_valid():
+        if not valid:
+            trace.status = status.HTTP_400_BAD_REQUEST
             return Response({
                 'error': 'Validation failed',
                 'details': serializer.errors
@@ -27,29 +94,356 @@ class QueryView(APIView):
         query_list = serializer.validated_data['query']
         query = " ".join(query_list)
         session_id = serializer.validated_data.get('session_id', 'global-session')
+        filters = serializer.validated_data.get('filters')
+        config = serializer.validated_data.get('model_config')
+        if config:
+            try:
+                model_registry.lookup(config)
+            except UnknownModelConfig as e:
+                trace.status = status.HTTP_400_BAD_REQUEST
+                return Response({'error': 'Validation failed', 'details': {'model_config': [str(e)]}},
+                                status=status.HTTP_400_BAD_REQUEST)
+        
+        if serializer.validated_data.get('batch'):
+            trace.endpoint = 'query_batch'
+            return self.batch_response(query_list, session_id, start_time, filters, trace, config)
+        if serializer.validated_data.get('stream'):
+            # The status line goes out before generation starts, so reject now
+            try:
+                llm_scheduler.check()
+            except LLMOverloaded as e:
+                return overloaded_response(e, trace)
+            trace.detach()
+            return self.stream_response(request, query, session_id, start_time, filters, trace, config)
         
         try:
-            rag = RAGChain()
-            response, sources = rag.generate(query)
+            rag = get_rag_chain(config)
+            response, sources = rag.generate(query, filters=filters)
             
-            ChatHistory.objects.create(
-                session_id=session_id,
-                query=query,
-                response=response,
-                metadata={'sources': sources}
-            )
+            with stage('history'):
+                chat_writer.log(session_id, query, response, history_metadata(sources, filters))
             
             return Response({
                 'query': [query],
                 'response': [response],
                 'sources': sources
             })
+        except LLMOverloaded as e:
+            return overloaded_response(e, trace)
+        except Exception as e:
+            logger.error(f"API Error: {str(e)}")
+            trace.status = status.HTTP_500_INTERNAL_SERVER_ERROR
+            return Response(
+                {'error': 'Internal server error'}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        finally:
+            elapsed = (time.time() - start_time) * 1000
+            logger.info(f"Request processed in {elapsed:.2f}ms")
+
+    def batch_response(self, query_list, session_id, start_time, filters=None, trace=None, config=None):
+        """Answer every element of `query` as an independent question"""
+        try:
+            rag = get_rag_chain(config)
+            results = rag.generate_batch(query_list, filters=filters)
+            
+            with stage('history'):
+                chat_writer.log_many(
+                    (session_id, query, response, history_metadata(sources, filters))
+                    for query, (response, sources) in zip(query_list, results)
+                )
+            
+            return Response({
+                'query': query_list,
+                'response': [response for response, _ in results],
+                'sources': [sources for _, sources in results]
+            })
+        except LLMOverloaded as e:
+            return overloaded_response(e, trace)
         except Exception as e:
             logger.error(f"API Error: {str(e)}")
+            if trace is not None:
+                trace.status = status.HTTP_500_INTERNAL_SERVER_ERROR
             return Response(
                 {'error': 'Internal server error'}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         finally:
             elapsed = (time.time() - start_time) * 1000
-            logger.info(f"Request processed in {elapsed:.2f}ms")
\ No newline at end of file
+            logger.info(f"Batch of {len(query_list)} processed in {elapsed:.2f}ms")
+
+    def stream_response(self, request, query, session_id, start_time, filters=None, trace=None, config=None):
+        """
+        Stream sources and then answer tokens as Server-Sent Events (when the
+        client accepts text/event-stream) or as newline-delimited JSON.
+        """
+        def events(encode):
+            sources = []
+            with track_request('query_stream', trace) as stream_trace:
+                try:
+                    rag = get_rag_chain(config)
+                    for event in rag.stream(query, filters=filters):
+                        if event['event'] == 'sources':
+                            sources = event['sources']
+                        elif event['event'] in ('done', 'error'):
+                            response = event.get('response', event.get('error'))
+                            with stage('history'):
+                                chat_writer.log(session_id, query, response, history_metadata(sources, filters))
+                        yield encode(event)
+                except Exception as e:
+                    logger.error(f"API Error: {str(e)}")
+                    stream_trace.status = status.HTTP_500_INTERNAL_SERVER_ERROR
+                    yield encode({'event': 'error', 'error': 'Internal server error'})
+                finally:
+                    elapsed = (time.time() - start_time) * 1000
+                    logger.info(f"Stream processed in {elapsed:.2f}ms")
+
+        return event_stream_response(request, events)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncQueryView(View):
+    """
+    Async variant of QueryView for ASGI deployments (e.g. uvicorn).
+
+    Embedding, MongoDB and the chat history write are offloaded or awaited,
+    and the LLM is called through its async interface, so a slow generation
+    does not hold a worker thread.
+    """
+
+    async def post(self, request):
+        with track_request('query_async') as trace:
+            return await self.handle(request, trace)
+
+    async def handle(self, request, trace):
+        start_time = time.time()
+        with stage('validate'):
+            try:
+                data = json.loads(request.body or b'{}')
+            except ValueError:
+                data = None
+            serializer = QuerySerializer(data=data) if data is not None else None
+            valid = serializer is not None and serializer.is_valid()
+
+        if serializer is None:
+            trace.status = 400
+            return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+        if not valid:
+            trace.status = 400
+            return JsonResponse({
+                'error': 'Validation failed',
+                'details': serializer.errors
+            }, status=400)
+
+        query_list = serializer.validated_data['query']
+        query = " ".join(query_list)
+        session_id = serializer.validated_data.get('session_id', 'global-session')
+        filters = serializer.validated_data.get('filters')
+        config = serializer.validated_data.get('model_config')
+        if config:
+            try:
+                await asyncio.to_thread(model_registry.lookup, config)
+            except UnknownModelConfig as e:
+                trace.status = 400
+                return JsonResponse({'error': 'Validation failed', 'details': {'model_config': [str(e)]}},
+                                    status=400)
+
+        if serializer.validated_data.get('batch'):
+            trace.endpoint = 'query_async_batch'
+            return await self.batch_response(query_list, session_id, start_time, filters, trace, config)
+        if serializer.validated_data.get('stream'):
+            try:
+                llm_scheduler.check()
+            except LLMOverloaded as e:
+                return overloaded_response(e, trace, JsonResponse)
+            trace.detach()
+            return self.stream_response(request, query, session_id, start_time, filters, trace, config)
+
+        try:
+            rag = await self.chain(config)
+            response, sources = await rag.agenerate(query, filters=filters)
+
+            with stage('history'):
+                await chat_writer.alog(session_id, query, response, history_metadata(sources, filters))
+
+            return JsonResponse({
+                'query': [query],
+                'response': [response],
+                'sources': sources
+            }, encoder=DjangoJSONEncoder)
+        except LLMOverloaded as e:
+            return overloaded_response(e, trace, JsonResponse)
+        except Exception as e:
+            logger.error(f"API Error: {str(e)}")
+            trace.status = 500
+            return JsonResponse({'error': 'Internal server error'}, status=500)
+        finally:
+            elapsed = (time.time() - start_time) * 1000
+            logger.info(f"Async request processed in {elapsed:.2f}ms")
+
+    async def batch_response(self, query_list, session_id, start_time, filters=None, trace=None, config=None):
+        """QueryView.batch_response with the batch generated in a worker thread"""
+        try:
+            rag = await self.chain(config)
+            results = await asyncio.to_thread(rag.generate_batch, query_list, filters=filters)
+
+            with stage('history'):
+                for query, (response, sources) in zip(query_list, results):
+                    await chat_writer.alog(session_id, query, response, history_metadata(sources, filters))
+
+            return JsonResponse({
+                'query': query_list,
+                'response': [response for response, _ in results],
+                'sources': [sources for _, sources in results]
+            }, encoder=DjangoJSONEncoder)
+        except LLMOverloaded as e:
+            return overloaded_response(e, trace, JsonResponse)
+        except Exception as e:
+            logger.error(f"API Error: {str(e)}")
+            trace.status = 500
+            return JsonResponse({'error': 'Internal server error'}, status=500)
+        finally:
+            elapsed = (time.time() - start_time) * 1000
+            logger.info(f"Async batch of {len(query_list)} processed in {elapsed:.2f}ms")
+
+    @staticmethod
+    async def chain(config=None):
+        """The warm chain without blocking the event loop (building it in a thread if needed)"""
+        if config is None:
+            rag = engine.current()
+            if rag is not None:
+                return rag
+        return await asyncio.to_thread(get_rag_chain, config)
+
+    def stream_response(self, request, query, session_id, start_time, filters=None, trace=None, config=None):
+        """Same wire format as QueryView.stream_response, from an async generator"""
+        async def events(encode):
+            sources = []
+            with track_request('query_async_stream', trace) as stream_trace:
+                try:
+                    rag = await self.chain(config)
+                    async for event in rag.astream(query, filters=filters):
+                        if event['event'] == 'sources':
+                            sources = event['sources']
+                        elif event['event'] in ('done', 'error'):
+                            with stage('history'):
+                                await chat_writer.alog(
+                                    session_id, query, event.get('response', event.get('error')),
+                                    history_metadata(sources, filters)
+                                )
+                        yield encode(event)
+                except Exception as e:
+                    logger.error(f"API Error: {str(e)}")
+                    stream_trace.status = 500
+                    yield encode({'event': 'error', 'error': 'Internal server error'})
+                finally:
+                    elapsed = (time.time() - start_time) * 1000
+                    logger.info(f"Async stream processed in {elapsed:.2f}ms")
+
+        return event_stream_response(request, events)
+
+
+class HealthView(APIView):
+    """Liveness probe: reports engine state without building it"""
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        health = engine.health()
+        health['embedding_cache'] = embedding_cache.stats()
+        health['answer_cache'] = answer_cache.stats()
+        health['chat_history_writer'] = chat_writer.stats()
+        health['context'] = context_packer.stats()
+        health['coalescing'] = coalescer.stats()
+        health['embedding_models'] = embedding_models.stats()
+        health['embedding_batching'] = embedding_service.stats()
+        health['llm_scheduler'] = llm_scheduler.stats()
+        health['vector_shards'] = shard_pool.stats()
+        health['latency'] = metrics.summary()
+        return Response(health)
+
+
+class ReadinessView(APIView):
+    """Readiness probe: warms the engine and reports whether it can serve"""
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        try:
+            get_rag_chain()
+        except Exception as e:
+            logger.error(f"Readiness check failed: {str(e)}")
+        health = engine.health()
+        code = status.HTTP_200_OK if health['ready'] else status.HTTP_503_SERVICE_UNAVAILABLE
+        return Response(health, status=code)
+
+
+def stats_families():
+    """Counters and gauges from the caches and writers, as Metrics.render families"""
+    embedding = embedding_cache.stats()
+    answers = answer_cache.stats()
+    writer = chat_writer.stats()
+    context = context_packer.stats()
+    scheduler = llm_scheduler.stats()
+    batching = embedding_service.stats()
+    shards = shard_pool.stats()
+    return [
+        ('rag_cache_hits_total', 'Cache hits', 'counter', {
+            (('cache', 'embedding'),): embedding['hits'],
+            (('cache', 'embedding_persistent'),): embedding['persistent_hits'],
+            (('cache', 'answer'),): answers['hits'],
+        }),
+        ('rag_cache_misses_total', 'Cache misses', 'counter', {
+            (('cache', 'embedding'),): embedding['misses'],
+            (('cache', 'answer'),): answers['misses'],
+        }),
+        ('rag_embedding_batches_total', 'Batched query embedding calls', 'counter', {
+            (): batching['batches'],
+        }),
+        ('rag_embedding_batched_queries_total', 'Queries embedded through the batching service', 'counter', {
+            (): batching['encoded'],
+        }),
+        ('rag_coalesced_requests_total', 'Requests served by an identical in-flight computation', 'counter', {
+            (): coalescer.stats()['coalesced'],
+        }),
+        ('rag_llm_queue_depth', 'Requests waiting for an LLM slot', 'gauge', {
+            (('priority', priority),): count for priority, count in scheduler['queued'].items()
+        }),
+        ('rag_llm_in_flight', 'Generations running per Ollama backend', 'gauge', {
+            (('backend', backend['url']),): backend['active'] for backend in scheduler['backends']
+        }),
+        ('rag_llm_rejected_total', 'Requests turned away by the LLM scheduler', 'counter', {
+            (('reason', reason),): count for reason, count in scheduler['rejected'].items()
+        }),
+        ('rag_llm_service_seconds', 'Moving average time a generation holds an LLM slot', 'gauge', {
+            (): scheduler['service_seconds'],
+        }),
+        ('rag_vector_shard_searches_total', 'Searches fanned out to the shard workers', 'counter', {
+            (): shards['searches'],
+        }),
+        ('rag_vector_shard_live_rows', 'Live snapshot rows per shard', 'gauge', {
+            (('shard', str(i)),): rows for i, rows in enumerate(shards['live_rows'])
+        }),
+        ('rag_chat_history_entries_total', 'Chat history entries by outcome', 'counter', {
+            (('outcome', outcome),): writer[outcome] for outcome in ('written', 'dropped', 'failed')
+        }),
+        ('rag_chat_history_queued', 'Chat history entries waiting to be written', 'gauge', {
+            (): writer['queued'],
+        }),
+        ('rag_context_chunks_total', 'Retrieved chunks left out of prompts', 'counter', {
+            (('reason', 'duplicate'),): context['duplicates'],
+            (('reason', 'over_budget'),): context['over_budget'],
+        }),
+        ('rag_prompt_tokens_max', 'Largest estimated prompt so far', 'gauge', {
+            (): context['max_prompt_tokens'],
+        }),
+    ]
+
+
+class MetricsView(View):
+    """Prometheus scrape endpoint with per-stage latency histograms and cache counters"""
+
+    def get(self, request):
+        return HttpResponse(
+            metrics.render(stats_families()),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
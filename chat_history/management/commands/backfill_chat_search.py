@@ -0,0 +1,81 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from chat_history.search import FTS_TABLE, TABLE, fts_table_exists
+
+POSTGRES_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(query, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(response, '')), 'B')"
+)
+
+
+class Command(BaseCommand):
+    help = "Index chat history rows written before the full-text index existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help="Rows indexed per transaction")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="SQLite: rebuild the whole FTS5 index in one pass instead")
+        parser.add_argument('--optimize', action='store_true',
+                            help="SQLite: merge the FTS5 index segments afterwards for faster searches")
+        parser.add_argument('--database', default='default', help="Database alias")
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        start = time.time()
+        if connection.vendor == 'sqlite':
+            if not fts_table_exists(connection):
+                raise CommandError(f"{FTS_TABLE} does not exist; run migrate with an FTS5-enabled SQLite")
+            indexed = self._backfill_sqlite(connection, options)
+        elif connection.vendor == 'postgresql':
+            indexed = self._backfill(
+                connection, options['batch_size'],
+                f"UPDATE {TABLE} SET search_vector = {POSTGRES_VECTOR} "
+                "WHERE id >= %s AND id < %s AND search_vector IS NULL",
+            )
+        elif connection.vendor == 'mysql':
+            self.stdout.write("MySQL builds its FULLTEXT index itself; nothing to backfill")
+            return
+        else:
+            raise CommandError(f"No chat history full-text index for {connection.vendor}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} chat history rows in {time.time() - start:.1f}s"
+        ))
+
+    def _backfill_sqlite(self, connection, options):
+        if options['rebuild']:
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+                cursor.execute(f"SELECT count(*) FROM {TABLE}")
+                indexed = cursor.fetchone()[0]
+        else:
+            # Rows already in the index (written through the triggers) have a docsize entry
+            indexed = self._backfill(
+                connection, options['batch_size'],
+                f"INSERT INTO {FTS_TABLE}(rowid, query, response) SELECT id, query, response FROM {TABLE} "
+                f"WHERE id >= %s AND id < %s "
+                f"AND NOT EXISTS (SELECT 1 FROM {FTS_TABLE}_docsize d WHERE d.id = {TABLE}.id)",
+            )
+        if options['optimize']:
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        return indexed
+
+    def _backfill(self, connection, batch_size, sql):
+        """Run `sql` over consecutive id ranges, committing after each one"""
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT min(id), max(id) FROM {TABLE}")
+            first, last = cursor.fetchone()
+        if first is None:
+            return 0
+        indexed = 0
+        for low in range(first, last + 1, batch_size):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [low, low + batch_size])
+                indexed += max(cursor.rowcount, 0)
+            if indexed and (low - first) // batch_size % 10 == 9:
+                self.stdout.write(f"  {indexed} rows indexed, up to id {low + batch_size - 1}")
+        return indexed
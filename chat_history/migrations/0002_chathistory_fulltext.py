@@ -0,0 +1,106 @@
+import logging
+
+from django.db import migrations
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'chat_history_chathistory'
+FTS_TABLE = f'{TABLE}_fts'
+
+SQLITE_CREATE = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        query, response, content='{TABLE}', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, query, response) VALUES (new.id, new.query, new.response);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, query, response)
+        VALUES ('delete', old.id, old.query, old.response);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF query, response ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, query, response)
+        VALUES ('delete', old.id, old.query, old.response);
+        INSERT INTO {FTS_TABLE}(rowid, query, response) VALUES (new.id, new.query, new.response);
+    END""",
+    # Index the existing rows; the delete and update triggers remove index
+    # entries of old rows, which would corrupt an index lacking them
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+SQLITE_DROP = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+# The column starts out NULL so adding it does not rewrite the table;
+# backfill_chat_search fills in existing rows in batches
+POSTGRES_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(NEW.query, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(NEW.response, '')), 'B')"
+)
+POSTGRES_CREATE = [
+    f"ALTER TABLE {TABLE} ADD COLUMN search_vector tsvector",
+    f"""CREATE FUNCTION {TABLE}_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := {POSTGRES_VECTOR};
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""",
+    f"""CREATE TRIGGER {TABLE}_search_vector BEFORE INSERT OR UPDATE OF query, response ON {TABLE}
+        FOR EACH ROW EXECUTE FUNCTION {TABLE}_search_vector()""",
+    f"CREATE INDEX {TABLE}_search_vector_idx ON {TABLE} USING GIN (search_vector)",
+]
+POSTGRES_DROP = [
+    f"DROP TRIGGER IF EXISTS {TABLE}_search_vector ON {TABLE}",
+    f"DROP FUNCTION IF EXISTS {TABLE}_search_vector()",
+    f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS search_vector",
+]
+
+MYSQL_CREATE = [f"CREATE FULLTEXT INDEX {TABLE}_fulltext ON {TABLE} (query, response)"]
+MYSQL_DROP = [f"DROP INDEX {TABLE}_fulltext ON {TABLE}"]
+
+
+def fts5_available(schema_editor):
+    try:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            return bool(cursor.fetchone()[0])
+    except Exception:
+        return False
+
+
+def create_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        if not fts5_available(schema_editor):
+            logger.warning("SQLite was built without FTS5; chat history search will scan the table")
+            return
+        statements = SQLITE_CREATE
+    elif vendor == 'postgresql':
+        statements = POSTGRES_CREATE
+    elif vendor == 'mysql':
+        statements = MYSQL_CREATE
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP, 'mysql': MYSQL_DROP}
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_history", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
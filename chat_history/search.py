@@ -0,0 +1,173 @@
+import logging
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+from .models import ChatHistory
+
+logger = logging.getLogger(__name__)
+
+TABLE = ChatHistory._meta.db_table
+FTS_TABLE = f"{TABLE}_fts"
+ORDERS = ('rank', 'recent')
+# bm25 weights of the query and response columns; a match in the question counts double
+FTS_WEIGHTS = (2.0, 1.0)
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def search_terms(text):
+    """Words of a user query, without any search operator syntax"""
+    return _WORD.findall(text or '')
+
+
+class FallbackSearch:
+    """Unindexed substring search for backends without a full-text index"""
+
+    indexed = False
+
+    def search(self, connection, text, session_id, limit, offset, order):
+        queryset = ChatHistory.objects.using(connection.alias).filter(
+            Q(query__icontains=text) | Q(response__icontains=text)
+        )
+        if session_id:
+            queryset = queryset.filter(session_id=session_id)
+        entries = list(queryset.order_by('-created_at')[offset:offset + limit])
+        return [(entry.id, None) for entry in entries], entries
+
+
+class SQLiteFTS5Search:
+    """
+    FTS5 external-content table over query and response, kept in sync by
+    triggers (migration 0002). Ranked by bm25, matching every word.
+    """
+
+    indexed = True
+
+    def search(self, connection, text, session_id, limit, offset, order):
+        terms = search_terms(text)
+        if not terms:
+            return [], None
+        match = ' '.join(f'"{term}"' for term in terms)
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        sql = (
+            f"SELECT {FTS_TABLE}.rowid, bm25({FTS_TABLE}, {weights}) AS score FROM {FTS_TABLE}"
+            + (f" JOIN {TABLE} h ON h.id = {FTS_TABLE}.rowid" if session_id else "")
+            + f" WHERE {FTS_TABLE} MATCH %s"
+            + (" AND h.session_id = %s" if session_id else "")
+            + (" ORDER BY score" if order == 'rank' else f" ORDER BY {FTS_TABLE}.rowid DESC")
+            + " LIMIT %s OFFSET %s"
+        )
+        params = [match] + ([session_id] if session_id else []) + [limit, offset]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            # bm25 is lower for better matches
+            return [(row_id, -score) for row_id, score in cursor.fetchall()], None
+
+
+class PostgresSearch:
+    """GIN-indexed `search_vector` tsvector column kept current by a trigger (migration 0002)"""
+
+    indexed = True
+
+    def search(self, connection, text, session_id, limit, offset, order):
+        terms = search_terms(text)
+        if not terms:
+            return [], None
+        sql = (
+            f"SELECT id, ts_rank_cd(search_vector, q) AS score FROM {TABLE}, "
+            "plainto_tsquery('english', %s) q WHERE search_vector @@ q"
+            + (" AND session_id = %s" if session_id else "")
+            + (" ORDER BY score DESC, id DESC" if order == 'rank' else " ORDER BY created_at DESC")
+            + " LIMIT %s OFFSET %s"
+        )
+        params = [' '.join(terms)] + ([session_id] if session_id else []) + [limit, offset]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall(), None
+
+
+class MySQLSearch:
+    """InnoDB FULLTEXT index over query and response (migration 0002)"""
+
+    indexed = True
+
+    def search(self, connection, text, session_id, limit, offset, order):
+        terms = search_terms(text)
+        if not terms:
+            return [], None
+        sql = (
+            f"SELECT id, MATCH(query, response) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score FROM {TABLE} "
+            "WHERE MATCH(query, response) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+            + (" AND session_id = %s" if session_id else "")
+            + (" ORDER BY score DESC, id DESC" if order == 'rank' else " ORDER BY created_at DESC")
+            + " LIMIT %s OFFSET %s"
+        )
+        query = ' '.join(terms)
+        params = [query, query] + ([session_id] if session_id else []) + [limit, offset]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall(), None
+
+
+_backends = {}
+_warned = set()
+
+
+def fts_table_exists(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def search_backend(connection):
+    """
+    The full-text search implementation for a database connection, chosen
+    once per alias. A SQLite fallback is not remembered, so searches pick up
+    the FTS5 table as soon as migration 0002 has created it.
+    """
+    backend = _backends.get(connection.alias)
+    if backend is not None:
+        return backend
+    vendor = connection.vendor
+    if vendor == 'sqlite' and fts_table_exists(connection):
+        backend = SQLiteFTS5Search()
+    elif vendor == 'postgresql':
+        backend = PostgresSearch()
+    elif vendor == 'mysql':
+        backend = MySQLSearch()
+    else:
+        if connection.alias not in _warned:
+            _warned.add(connection.alias)
+            logger.warning(f"No full-text index for chat history on '{connection.alias}'; searches scan the table")
+        backend = FallbackSearch()
+        if vendor == 'sqlite':
+            return backend
+    _backends[connection.alias] = backend
+    return backend
+
+
+def reset_search_backends():
+    """Forget the chosen backends, e.g. after migrating or backfilling"""
+    _backends.clear()
+    _warned.clear()
+
+
+def search(text, session_id=None, limit=20, offset=0, order='rank', using='default'):
+    """
+    One page of ChatHistory entries matching `text`, best first (order='rank')
+    or newest first (order='recent'). Each entry carries its relevance as
+    `search_rank` (None from the unindexed fallback).
+    """
+    if order not in ORDERS:
+        raise ValueError(f"Unknown order '{order}'; expected one of {', '.join(ORDERS)}")
+    connection = connections[using]
+    hits, entries = search_backend(connection).search(connection, text, session_id, limit, offset, order)
+    if entries is None:
+        by_id = ChatHistory.objects.using(using).in_bulk([row_id for row_id, _ in hits])
+        entries = [by_id[row_id] for row_id, _ in hits if row_id in by_id]
+    scores = dict(hits)
+    for entry in entries:
+        entry.search_rank = scores.get(entry.id)
+    return entries
@@ -0,0 +1,96 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.query import QuerySet
+from django.test import TestCase, TransactionTestCase
+
+from .models import ChatHistory
+from .search import FallbackSearch, SQLiteFTS5Search, fts_table_exists, reset_search_backends, search_backend
+from .utils import search_chat_history
+
+
+def ids(entries):
+    return [entry.id for entry in entries]
+
+
+class ChatHistorySearchTests(TestCase):
+    def setUp(self):
+        reset_search_backends()
+        self.addCleanup(reset_search_backends)
+        entry = ChatHistory.objects.create
+        self.vacuum = entry(session_id='s1', query="How do I vacuum a sqlite database?", response="Use the VACUUM statement.")
+        self.index = entry(session_id='s1', query="What is an index?",
+                           response="An index speeds up lookups; a sqlite index is a b-tree.")
+        self.other = entry(session_id='s2', query="Tell me about vacuum cleaners", response="They clean floors.")
+        self.running = entry(session_id='s2', query="Is the server running?", response="Yes.")
+
+    def test_uses_fts5_on_sqlite(self):
+        self.assertIsInstance(search_backend(connection), SQLiteFTS5Search)
+
+    def test_returns_ranked_queryset(self):
+        results = search_chat_history("sqlite")
+        self.assertIsInstance(results, QuerySet)
+        # A match in the question counts more than one in the response
+        self.assertEqual(ids(results), [self.vacuum.id, self.index.id])
+        self.assertGreater(results[0].search_rank, results[1].search_rank)
+        self.assertEqual(ids(results.filter(session_id='s1').exclude(id=self.vacuum.id)), [self.index.id])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(ids(search_chat_history("sqlite vacuum")), [self.vacuum.id])
+        self.assertEqual(ids(search_chat_history("sqlite floors")), [])
+
+    def test_words_are_stemmed(self):
+        self.assertEqual(ids(search_chat_history("run")), [self.running.id])
+
+    def test_session_order_and_paging(self):
+        self.assertEqual(ids(search_chat_history("vacuum", session_id='s2')), [self.other.id])
+        self.assertEqual(ids(search_chat_history("vacuum", order='recent')), [self.other.id, self.vacuum.id])
+        page = search_chat_history("vacuum", order='recent', limit=1, offset=1)
+        self.assertEqual(ids(page), [self.vacuum.id])
+
+    def test_operator_syntax_is_not_interpreted(self):
+        self.assertEqual(ids(search_chat_history('"vacuum" floors*')), [self.other.id])
+        # OR is a word to match, not an operator
+        self.assertEqual(ids(search_chat_history("vacuum OR index")), [])
+        self.assertEqual(ids(search_chat_history("NEAR(")), [])
+        self.assertEqual(search_chat_history("?!").count(), 0)
+
+    def test_index_follows_updates_and_deletes(self):
+        self.running.response = "The sqlite server restarted."
+        self.running.save()
+        self.assertIn(self.running.id, ids(search_chat_history("sqlite")))
+        self.vacuum.delete()
+        self.assertEqual(ids(search_chat_history("vacuum")), [self.other.id])
+
+    def test_invalid_order_returns_nothing(self):
+        with self.assertLogs('chat_history.utils', 'ERROR'):
+            self.assertEqual(search_chat_history("vacuum", order='oldest').count(), 0)
+
+
+class FullTextMigrationTests(TransactionTestCase):
+    def setUp(self):
+        reset_search_backends()
+        self.addCleanup(reset_search_backends)
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate([('chat_history', '0001_initial')])
+        self.addCleanup(self.migrate_to_latest)
+
+    def migrate_to_latest(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_migration_indexes_existing_rows(self):
+        self.assertFalse(fts_table_exists(connection))
+        old = ChatHistory.objects.create(session_id='s1', query="Where are the backups?", response="In /var/backups.")
+        with self.assertLogs('chat_history.search', 'WARNING'):
+            self.assertIsInstance(search_backend(connection), FallbackSearch)
+        fallback = search_chat_history("backups")
+        self.assertEqual(ids(fallback), [old.id])
+        self.assertIsNone(fallback[0].search_rank)
+
+        self.migrate_to_latest()
+        # The fallback was not remembered, so searches switch to the new index
+        self.assertIsInstance(search_backend(connection), SQLiteFTS5Search)
+        self.assertEqual(ids(search_chat_history("backups")), [old.id])
+        old.delete()
+        new = ChatHistory.objects.create(session_id='s1', query="Backups again", response="Same place.")
+        self.assertEqual(ids(search_chat_history("backups")), [new.id])
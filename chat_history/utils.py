@@ -1,21 +1,27 @@
 import logging
 from datetime import datetime, timedelta
+from django.db.models import Case, FloatField, IntegerField, Value, When
 from .models import ChatHistory
-from django.db.models import Q
+from .search import search
+from .writer import chat_writer
 
 logger = logging.getLogger(__name__)
 
-def log_chat_entry(session_id, query, response, metadata=None):
+def log_chat_entry(session_id, query, response, metadata=None, sync=True):
     """
     Creates a new chat history entry in the database
+    With sync=False it is queued for the write-behind writer instead and the
+    returned entry is not saved yet (its id is None); None if it was dropped
     """
     try:
-        return ChatHistory.objects.create(
-            session_id=session_id,
-            query=query,
-            response=response,
-            metadata=metadata or {}
-        )
+        if sync:
+            return ChatHistory.objects.create(
+                session_id=session_id,
+                query=query,
+                response=response,
+                metadata=metadata or {}
+            )
+        return chat_writer.log(session_id, query, response, metadata)
     except Exception as e:
         logger.error(f"Failed to log chat entry: {str(e)}")
         return None
@@ -65,15 +71,23 @@ def clear_old_history(days=30):
         logger.error(f"Failed to clear old history: {str(e)}")
         return 0
 
-def search_chat_history(query, session_id=None):
+def search_chat_history(query, session_id=None, limit=20, offset=0, order='rank'):
     """
-    Searches through chat history content
+    Full-text search through chat history content
+    Returns a QuerySet of one page of entries, best match first (or newest
+    first with order='recent'), each annotated with its `search_rank`
     """
     try:
-        search_query = Q(query__icontains=query) | Q(response__icontains=query)
-        if session_id:
-            search_query &= Q(session_id=session_id)
-        return ChatHistory.objects.filter(search_query).order_by('-created_at')
+        entries = search(query, session_id=session_id, limit=limit, offset=offset, order=order)
+        if not entries:
+            return ChatHistory.objects.none()
+        position = Case(*[When(id=entry.id, then=Value(i)) for i, entry in enumerate(entries)],
+                        output_field=IntegerField())
+        rank = Case(*[When(id=entry.id, then=Value(entry.search_rank)) for entry in entries],
+                    output_field=FloatField())
+        return (ChatHistory.objects.filter(id__in=[entry.id for entry in entries])
+                .annotate(search_rank=rank, search_position=position)
+                .order_by('search_position'))
     except Exception as e:
         logger.error(f"Chat history search failed: {str(e)}")
-        return ChatHistory.objects.none()
\ No newline at end of file
+        return ChatHistory.objects.none()
@@ -0,0 +1,200 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.db import connections
+from django.utils import timezone
+
+from .models import ChatHistory
+
+logger = logging.getLogger(__name__)
+
+
+class ChatHistoryWriter:
+    """
+    Write-behind persistence for ChatHistory.
+
+    Request handlers enqueue unsaved entries on a bounded in-process queue,
+    and one background thread saves them with `bulk_create` once
+    `batch_size` entries are waiting or `flush_interval` seconds have passed
+    since the first of them. Entries are timestamped when enqueued, so
+    history order is request order.
+
+    When the queue is full, `log` blocks for up to `block_timeout` seconds
+    (backpressure) before dropping the entry; with block=False it drops
+    immediately. Dropped, written and failed entries are counted in `stats`.
+    Remaining entries are flushed at interpreter exit. Disabled
+    (CHAT_HISTORY_WRITE_BEHIND=false), every entry is saved synchronously.
+    """
+
+    def __init__(self, max_queue=None, batch_size=None, flush_interval=None, block_timeout=None, enabled=None):
+        self.max_queue = max_queue or int(os.getenv('CHAT_HISTORY_QUEUE_SIZE', 10000))
+        self.batch_size = batch_size or int(os.getenv('CHAT_HISTORY_BATCH_SIZE', 100))
+        if flush_interval is None:
+            flush_interval = float(os.getenv('CHAT_HISTORY_FLUSH_SECONDS', 1.0))
+        self.flush_interval = flush_interval
+        if block_timeout is None:
+            block_timeout = float(os.getenv('CHAT_HISTORY_BLOCK_SECONDS', 0.5))
+        self.block_timeout = block_timeout
+        if enabled is None:
+            enabled = os.getenv('CHAT_HISTORY_WRITE_BEHIND', 'true').lower() in ('1', 'true', 'yes')
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._pid = None
+        self._atexit = False
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def log(self, session_id, query, response, metadata=None, block=True):
+        """Queue one entry; returns the unsaved ChatHistory, or None when it was dropped"""
+        entry = self._entry(session_id, query, response, metadata)
+        if not self.enabled:
+            entry.save()
+            self._count('written', 1)
+            return entry
+        return entry if self._put(entry, block) else None
+
+    async def alog(self, session_id, query, response, metadata=None):
+        """`log` for async views: never waits on a full queue or a synchronous save"""
+        if self.enabled:
+            return self.log(session_id, query, response, metadata, block=False)
+        entry = self._entry(session_id, query, response, metadata)
+        await entry.asave()
+        self._count('written', 1)
+        return entry
+
+    def log_many(self, entries, block=True):
+        """Queue (session_id, query, response, metadata) tuples; returns how many were accepted"""
+        return sum(self.log(*entry, block=block) is not None for entry in entries)
+
+    def flush(self):
+        """Save everything queued so far in the calling thread"""
+        if self._queue is None:
+            return 0
+        saved = 0
+        while True:
+            batch = self._take(self.batch_size)
+            if not batch:
+                return saved
+            saved += self._write(batch)
+
+    def close(self):
+        """Stop the flusher and save whatever is still queued"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout=max(self.flush_interval * 2, 5))
+        self.flush()
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'max_queue': self.max_queue,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batches': self.batches,
+        }
+
+    @staticmethod
+    def _entry(session_id, query, response, metadata):
+        return ChatHistory(
+            session_id=session_id,
+            query=query,
+            response=response,
+            metadata=metadata or {},
+            created_at=timezone.now(),
+        )
+
+    def _count(self, name, amount):
+        with self._lock:
+            value = getattr(self, name) + amount
+            setattr(self, name, value)
+        return value
+
+    def _put(self, entry, block):
+        self._ensure_started()
+        try:
+            if block and self.block_timeout > 0:
+                self._queue.put(entry, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(entry)
+        except queue.Full:
+            dropped = self._count('dropped', 1)
+            if dropped == 1 or dropped % 1000 == 0:
+                logger.warning(f"Chat history queue full, dropped {dropped} entries so far")
+            return False
+        self._count('enqueued', 1)
+        return True
+
+    def _ensure_started(self):
+        # A forked worker inherits the queue but not the flusher thread
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='chat-history-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            if not self._atexit:
+                atexit.register(self.close)
+                self._atexit = True
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    first = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    continue
+                batch = [first]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                self._write(batch)
+        finally:
+            connections.close_all()
+
+    def _take(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            ChatHistory.objects.bulk_create(batch)
+        except Exception as e:
+            self._count('failed', len(batch))
+            logger.error(f"Failed to save {len(batch)} chat history entries: {str(e)}")
+            return 0
+        self._count('written', len(batch))
+        self._count('batches', 1)
+        return len(batch)
+
+
+chat_writer = ChatHistoryWriter()
@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
 application = get_asgi_application()
+
+# Warm the shared RAG engine before the first request reaches this process.
+if os.getenv("RAG_ENGINE_PRELOAD", "").lower() in ("1", "true", "yes"):
+    from rag_engine.engine import engine
+
+    engine.preload()
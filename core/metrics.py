@@ -0,0 +1,243 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_current_trace = contextvars.ContextVar('request_trace', default=None)
+
+
+class Histogram:
+    """
+    Latency distribution of one series: cumulative buckets for Prometheus
+    plus a window of the most recent samples for exact recent percentiles.
+    """
+
+    def __init__(self, window):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+    def quantiles(self):
+        if not self.recent:
+            return {q: 0.0 for q in QUANTILES}
+        values = np.percentile(np.fromiter(self.recent, dtype=np.float64), [q * 100 for q in QUANTILES])
+        return dict(zip(QUANTILES, values.tolist()))
+
+
+class RequestTrace:
+    """Per-request stage timings, collected by `stage` blocks run within `track_request`"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.status = 200
+        self.stages = {}
+        self.start = time.perf_counter()
+        self.detached = False
+
+    def detach(self):
+        """Leave the trace open when the handler returns (see `track_request`)"""
+        self.detached = True
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def breakdown(self):
+        return " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.stages.items())
+
+
+class Metrics:
+    """
+    In-process request metrics: latency histograms per pipeline stage and
+    per endpoint, request counters by status and error counters by stage.
+
+    Values are per process; with several workers, scrape each one or sum
+    them in Prometheus. Requests slower than `slow_request_ms`
+    (SLOW_REQUEST_MS, 0 disables) are logged with their stage breakdown.
+    """
+
+    def __init__(self, window=None, slow_request_ms=None):
+        self.window = window or int(os.getenv('METRICS_WINDOW', 1024))
+        if slow_request_ms is None:
+            slow_request_ms = float(os.getenv('SLOW_REQUEST_MS', 0))
+        self.slow_request_ms = slow_request_ms
+
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.requests = {}
+        self.request_counts = {}
+        self.errors = {}
+
+    def observe_stage(self, name, seconds):
+        with self._lock:
+            histogram = self.stages.get(name)
+            if histogram is None:
+                histogram = self.stages[name] = Histogram(self.window)
+            histogram.observe(seconds)
+
+    def observe_request(self, trace):
+        elapsed = time.perf_counter() - trace.start
+        with self._lock:
+            histogram = self.requests.get(trace.endpoint)
+            if histogram is None:
+                histogram = self.requests[trace.endpoint] = Histogram(self.window)
+            histogram.observe(elapsed)
+            key = (trace.endpoint, str(trace.status))
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+        if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+            logger.warning(
+                f"Slow request {trace.endpoint} ({trace.status}) took {elapsed * 1000:.1f}ms: {trace.breakdown()}"
+            )
+        return elapsed
+
+    def error(self, name):
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self):
+        """{stage: {count, p50_ms, p95_ms, p99_ms}} for stages and endpoints"""
+        with self._lock:
+            series = [('stage', self.stages), ('endpoint', self.requests)]
+            return {
+                kind: {
+                    name: {'count': histogram.count, **{
+                        f"p{int(q * 100)}_ms": value * 1000 for q, value in histogram.quantiles().items()
+                    }}
+                    for name, histogram in histograms.items()
+                }
+                for kind, histograms in series
+            }
+
+    def render(self, counters=()):
+        """
+        Prometheus text exposition. `counters` adds (name, help, type,
+        {label tuple: value}) families, e.g. cache statistics.
+        """
+        lines = []
+        with self._lock:
+            self._render_histograms(lines, 'rag_stage_duration_seconds', 'Pipeline stage latency', 'stage',
+                                    self.stages)
+            self._render_histograms(lines, 'rag_request_duration_seconds', 'Request latency', 'endpoint',
+                                    self.requests)
+            families = [
+                ('rag_requests_total', 'Requests by endpoint and status', 'counter',
+                 {(('endpoint', endpoint), ('status', code)): value
+                  for (endpoint, code), value in self.request_counts.items()}),
+                ('rag_stage_errors_total', 'Exceptions raised by pipeline stages', 'counter',
+                 {(('stage', name),): value for name, value in self.errors.items()}),
+            ]
+        for name, help_text, kind, samples in list(families) + list(counters):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples.items():
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histograms(lines, name, help_text, label, histograms):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for series, histogram in histograms.items():
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{name}_bucket{_labels(((label, series), ('le', le)))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(((label, series),))} {_number(histogram.sum)}")
+            lines.append(f"{name}_count{_labels(((label, series),))} {histogram.count}")
+        quantile_name = f"{name.replace('_seconds', '')}_recent_seconds"
+        lines.append(f"# HELP {quantile_name} {help_text} percentiles over the last samples")
+        lines.append(f"# TYPE {quantile_name} gauge")
+        for series, histogram in histograms.items():
+            for q, value in histogram.quantiles().items():
+                lines.append(f"{quantile_name}{_labels(((label, series), ('quantile', str(q))))} {_number(value)}")
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+metrics = Metrics()
+
+
+def current_trace():
+    """Trace of the request being handled in this context, or None"""
+    return _current_trace.get()
+
+
+def record_stage(name, seconds):
+    """Record a stage duration measured by the caller (e.g. time to first token)"""
+    metrics.observe_stage(name, seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as pipeline stage `name`, counting exceptions as stage errors"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        metrics.error(name)
+        raise
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+@contextmanager
+def track_request(endpoint, trace=None):
+    """
+    Collect the stages run while handling one request. Set `status` on the
+    yielded trace; an escaping exception is recorded as 500. A view that
+    returns a streaming response calls `trace.detach()` and continues the
+    same trace with `track_request(endpoint, trace)` inside its generator.
+    """
+    if trace is None:
+        trace = RequestTrace(endpoint)
+    else:
+        trace.endpoint = endpoint
+        trace.detached = False
+    previous = _current_trace.get()
+    _current_trace.set(trace)
+    try:
+        yield trace
+    except Exception:
+        trace.status = 500
+        raise
+    finally:
+        # set() rather than reset(): generators may finish in another context
+        _current_trace.set(previous)
+        if not trace.detached:
+            metrics.observe_request(trace)
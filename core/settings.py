@@ -37,6 +37,8 @@ INSTALLED_APPS = [
     "api",
     "chat_history",
     "model_config",
+    "rag_engine",
+    "vector_db",
 ]
 
 MIDDLEWARE = [
@@ -1,7 +1,9 @@
 from django.urls import path, include
 from django.conf import settings
 from django.contrib.staticfiles.urls import static
+from api.views import MetricsView
 
 urlpatterns = [
     path('api/', include('api.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
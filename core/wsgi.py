@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
 application = get_wsgi_application()
+
+# Build the shared RAG engine at import time so that `gunicorn --preload`
+# loads the models once in the master and workers start warm.
+if os.getenv("RAG_ENGINE_PRELOAD", "").lower() in ("1", "true", "yes"):
+    from rag_engine.engine import engine
+
+    engine.preload()
@@ -0,0 +1,180 @@
+import hashlib
+import itertools
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from vector_db.index import normalize
+
+logger = logging.getLogger(__name__)
+
+
+def template_fingerprint(template):
+    """Short stable hash of a prompt template, used in cache scopes"""
+    return hashlib.sha256(template.encode('utf-8')).hexdigest()[:16]
+
+
+def model_scope(spec, template, retrieval_mode):
+    """
+    Leading part of the cache scopes of a chain: its llm and embedding
+    models, temperature, prompt template and retrieval mode. Query
+    embeddings of different embedding models are not comparable, so each
+    model gets its own scope.
+    """
+    return (spec.llm_model, spec.embedding_model, spec.temperature, template_fingerprint(template), retrieval_mode)
+
+
+class _Scope:
+    """Cached answers sharing one model / prompt / corpus version"""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self._keys = None
+        self._matrix = None
+
+    def add(self, key, entry):
+        self.entries[key] = entry
+        self._matrix = None
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+        self._matrix = None
+
+    def nearest(self, query):
+        """(key, similarity) of the most similar cached query"""
+        if self._matrix is None:
+            self._keys = list(self.entries)
+            self._matrix = np.vstack([self.entries[key]['embedding'] for key in self._keys])
+        scores = self._matrix @ query
+        best = int(np.argmax(scores))
+        return self._keys[best], float(scores[best])
+
+
+class AnswerCache:
+    """
+    Semantic cache of generated answers.
+
+    A lookup compares the query embedding with the embeddings of previously
+    answered queries in the same scope and returns the stored answer when
+    the cosine similarity reaches `threshold`, so paraphrased questions skip
+    retrieval and the LLM entirely. A scope is (llm model, embedding model,
+    temperature, prompt template fingerprint, retrieval mode, metadata
+    filter, corpus version); storing under a new corpus version drops every
+    scope built on an older one. The total number of
+    entries is bounded with LRU eviction.
+    """
+
+    def __init__(self, max_entries=None, threshold=None):
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv('ANSWER_CACHE_SIZE', 1000))
+        self.threshold = threshold if threshold is not None else float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+
+        self._lock = threading.Lock()
+        self._scopes = {}
+        self._lru = OrderedDict()
+        self._ids = itertools.count()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def lookup(self, scope, query_embedding):
+        """Return {'query', 'answer', 'sources', 'similarity'} or None"""
+        if not self.enabled:
+            return None
+        query = normalize(query_embedding)
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries is None or not entries.entries:
+                self.misses += 1
+                return None
+            key, similarity = entries.nearest(query)
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+            self._lru.move_to_end(key)
+            self.hits += 1
+            entry = entries.entries[key]
+            return {
+                'query': entry['query'],
+                'answer': entry['answer'],
+                'sources': entry['sources'],
+                'similarity': similarity,
+            }
+
+    def store(self, scope, query, query_embedding, answer, sources):
+        if not self.enabled:
+            return
+        entry = {
+            'query': query,
+            'embedding': normalize(query_embedding),
+            'answer': answer,
+            'sources': sources,
+        }
+        with self._lock:
+            self._drop_stale(scope)
+            key = next(self._ids)
+            self._scopes.setdefault(scope, _Scope()).add(key, entry)
+            self._lru[key] = scope
+            while len(self._lru) > self.max_entries:
+                old_key, old_scope = self._lru.popitem(last=False)
+                self._scopes[old_scope].remove(old_key)
+                self.evictions += 1
+
+    def invalidate(self):
+        """Drop every cached answer, e.g. after the corpus was rewritten"""
+        with self._lock:
+            self._scopes.clear()
+            self._lru.clear()
+        logger.info("Answer cache invalidated")
+
+    def warm_start(self, chain, scope, limit=500, batch_size=64):
+        """
+        Seed the cache from recent ChatHistory rows.
+
+        History rows do not record the model or corpus they were produced
+        with, so this assumes they match the current `scope`; only use it
+        when that holds (e.g. right after a restart).
+        """
+        from chat_history.models import ChatHistory
+
+        rows = list(
+            ChatHistory.objects.order_by('-created_at')
+            .values_list('query', 'response', 'metadata')[:limit]
+        )
+        # Filtered answers belong to their filter's scope, not the default one
+        rows = [row for row in rows if row[2].get('sources') and not row[2].get('filters')]
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            embeddings = chain.embedding_model.encode([query for query, _, _ in batch])
+            for (query, response, metadata), embedding in zip(batch, embeddings):
+                self.store(scope, query, embedding, response, metadata['sources'])
+        logger.info(f"Answer cache warmed with {len(rows)} entries from chat history")
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._lru),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _drop_stale(self, scope):
+        corpus_version = scope[-1]
+        for other in [other for other in self._scopes if other[-1] != corpus_version]:
+            for key in self._scopes.pop(other).entries:
+                self._lru.pop(key, None)
+
+
+answer_cache = AnswerCache()
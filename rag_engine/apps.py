@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class RagEngineConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "rag_engine"
+
+    def ready(self):
+        from rag_engine import signals  # noqa: F401
@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text):
+    """Canonical form of a query used as cache key (NFC, collapsed whitespace)"""
+    return " ".join(unicodedata.normalize('NFC', text).split())
+
+
+def cache_key(model_name, text):
+    digest = hashlib.sha256(f"{model_name}\x00{normalize_query(text)}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of query embeddings keyed by embedding model and
+    normalized query text.
+
+    The in-process tier is a bounded LRU with an optional TTL. The optional
+    persistent tier stores vectors in the Django database (QueryEmbedding) so
+    they survive restarts and are shared by workers. Several embedding
+    models can be served at once (see rag_engine.registry); entries of a
+    model no longer in use are never matched and age out of the LRU. At
+    most every EMBEDDING_CACHE_PRUNE_SECONDS, a write to the persistent
+    tier deletes its expired rows and those of models no active config
+    uses.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, persistent=None):
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv('EMBEDDING_CACHE_SIZE', 10000))
+        self.ttl = ttl if ttl is not None else float(os.getenv('EMBEDDING_CACHE_TTL', 86400))
+        if persistent is None:
+            persistent = os.getenv('EMBEDDING_CACHE_PERSISTENT', 'false').lower() in ('1', 'true', 'yes')
+        self.persistent = persistent
+        self.prune_interval = float(os.getenv('EMBEDDING_CACHE_PRUNE_SECONDS', 3600))
+
+        self._next_prune = 0.0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, model_name, text):
+        """Cached embedding (list of floats) or None"""
+        if self.max_entries <= 0:
+            return None
+        key = cache_key(model_name, text)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                embedding, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return embedding
+                del self._entries[key]
+
+        embedding = self._load_persistent(key) if self.persistent else None
+        with self._lock:
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.persistent_hits += 1
+            self._store(key, embedding)
+        return embedding
+
+    def put(self, model_name, text, embedding):
+        if self.max_entries <= 0:
+            return
+        key = cache_key(model_name, text)
+        with self._lock:
+            self._store(key, embedding)
+        if self.persistent:
+            self._save_persistent(key, model_name, embedding)
+
+    def clear(self, persistent=True):
+        """Drop all entries (including the persistent tier when enabled)"""
+        with self._lock:
+            self._entries.clear()
+        if persistent and self.persistent:
+            from rag_engine.models import QueryEmbedding
+            try:
+                QueryEmbedding.objects.all().delete()
+            except Exception as e:
+                logger.error(f"Failed to clear persistent embedding cache: {str(e)}")
+        logger.info("Embedding cache cleared")
+
+    def prune(self, models=None):
+        """
+        Delete persistent rows past the TTL or of embedding models not in
+        `models` (default: those in use, see ModelRegistry); returns the count
+        """
+        from django.db.models import Q
+        from django.utils import timezone
+
+        from rag_engine.models import QueryEmbedding
+        try:
+            if models is None:
+                from rag_engine.registry import model_registry
+
+                models = model_registry.embedding_models_in_use()
+            stale = ~Q(model_name__in=list(models))
+            if self.ttl > 0:
+                stale |= Q(created_at__lt=timezone.now() - timedelta(seconds=self.ttl))
+            deleted, _ = QueryEmbedding.objects.filter(stale).delete()
+        except Exception as e:
+            logger.error(f"Failed to prune persistent embedding cache: {str(e)}")
+            return 0
+        if deleted:
+            logger.info(f"Pruned {deleted} persistent query embeddings")
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits + self.persistent_hits) / lookups if lookups else 0.0,
+            }
+
+    def _store(self, key, embedding):
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+        self._entries[key] = (embedding, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load_persistent(self, key):
+        from rag_engine.models import QueryEmbedding
+        try:
+            row = QueryEmbedding.objects.filter(key=key).values_list('embedding', 'created_at').first()
+        except Exception as e:
+            logger.error(f"Embedding cache lookup failed: {str(e)}")
+            return None
+        if row is None:
+            return None
+        data, created_at = row
+        if self.ttl > 0 and (time.time() - created_at.timestamp()) > self.ttl:
+            return None
+        return np.frombuffer(bytes(data), dtype='<f4').tolist()
+
+    def _save_persistent(self, key, model_name, embedding):
+        from rag_engine.models import QueryEmbedding
+        try:
+            QueryEmbedding.objects.update_or_create(
+                key=key,
+                defaults={
+                    'model_name': model_name,
+                    'embedding': np.asarray(embedding, dtype='<f4').tobytes(),
+                },
+            )
+        except Exception as e:
+            logger.error(f"Failed to persist query embedding: {str(e)}")
+            return
+        now = time.monotonic()
+        with self._lock:
+            due = self.prune_interval > 0 and now >= self._next_prune
+            if due:
+                self._next_prune = now + self.prune_interval
+        if due:
+            self.prune()
+
+
+embedding_cache = EmbeddingCache()
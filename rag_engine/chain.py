@@ -2,9 +2,19 @@ from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
 from langchain_community.chat_models import ChatOllama
 from vector_db.mongodb_manager import MongoDBManager
-from sentence_transformers import SentenceTransformer
-from rag_engine.prompts import RAG_PROMPT_TEMPLATE 
-import numpy as np
+from rag_engine.prompts import ERROR_ANSWER, RAG_PROMPT_TEMPLATE
+from rag_engine.answer_cache import answer_cache, model_scope
+from rag_engine.cache import embedding_cache, normalize_query
+from rag_engine.coalesce import coalescer
+from rag_engine.context import context_packer
+from rag_engine.embedding import embedding_service
+from rag_engine.registry import embedding_models, model_registry
+from rag_engine.scheduler import BATCH, INTERACTIVE, LLMOverloaded, llm_scheduler
+from vector_db.filters import filters_key, normalize_filters
+from core.metrics import metrics, record_stage, stage
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
 import logging
 import os
 import requests
@@ -12,35 +22,120 @@ import time
 
 logger = logging.getLogger(__name__)
 
+NO_CONTEXT_ANSWER = "I couldn't find relevant information to answer this question."
+
+
+class EmbeddingModelMismatch(Exception):
+    """Queries are embedded with another model than the chunks they would be compared with"""
+
+
 class RAGChain:
-    def __init__(self):
-        logger.info("Initializing RAGChain...")
+    def __init__(self, spec=None, vector_db=None):
+        """
+        Build the chain for a ModelSpec (default: the active ModelConfig).
+        A chain built next to another one can share its `vector_db`.
+        """
+        self.spec = spec or model_registry.active()
+        logger.info(f"Initializing RAGChain for model config '{self.spec.name}'...")
         
-        # Load embedding model
-        self.embedding_model = SentenceTransformer(
-            os.getenv('EMBEDDING_MODEL_NAME'),
-            device='cpu'
-        )
+        # Load embedding model, reusing an instance already loaded by another chain
+        self.embedding_model_name = self.spec.embedding_model
+        self.embedding_model = embedding_models.get(self.embedding_model_name)
         logger.info(f"Loaded embedding model: {self.embedding_model.__class__.__name__}")
         
         # Initialize vector DB
-        self.vector_db = MongoDBManager()
+        self.vector_db = vector_db or MongoDBManager()
+        self._check_corpus_model()
         
-        # Initialize LLM with retries and validation
-        self.llm = self._initialize_llm()
+        # Initialize one LLM per Ollama backend with retries and validation
+        self.llms = self._initialize_llms()
+        self.llm = next(iter(self.llms.values()))
         
-        # Create the processing chain
+        # Create the processing chains; the scheduler picks the backend per generation
         self.prompt = PromptTemplate(
             template=RAG_PROMPT_TEMPLATE,
             input_variables=["context", "question"]
         )
-        self.chain = self.prompt | self.llm | StrOutputParser()
+        self.chains = {url: self.prompt | llm | StrOutputParser() for url, llm in self.llms.items()}
+        self.chain = next(iter(self.chains.values()))
+        llm_scheduler.configure(list(self.chains))
+        # 'dense' scores every chunk, 'hybrid' fuses BM25 candidates with vector scores
+        self.retrieval_mode = os.getenv('RETRIEVAL_MODE', 'dense')
+        self._answer_scope = model_scope(self.spec, RAG_PROMPT_TEMPLATE, self.retrieval_mode)
         logger.info("RAGChain initialized successfully")
 
-    def _initialize_llm(self, retries=3, delay=2):
+    def reconnect(self):
+        """Reopen connections that must not be shared across forked processes"""
+        self.vector_db.reconnect()
+
+    def warm_up(self):
+        """
+        Take the first-call cost before serving: run the embedding model once
+        and have every Ollama backend load the LLM (an empty prompt loads
+        the model without generating).
+        """
+        start = time.time()
+        self.embedding_model.encode("warm up")
+        for base_url in self.llms:
+            try:
+                response = requests.post(
+                    f"{base_url}/api/generate",
+                    json={'model': self.spec.llm_model, 'prompt': '', 'stream': False},
+                    timeout=180
+                )
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Could not preload {self.spec.llm_model} on {base_url}: {str(e)}")
+        logger.info(f"Warmed up model config '{self.spec.name}' in {time.time() - start:.2f}s")
+
+    def _check_corpus_model(self):
+        """Warn when stored chunks were embedded with a different model than queries will be"""
+        try:
+            corpus_model = self.vector_db.corpus_embedding_model()
+        except Exception as e:
+            logger.warning(f"Could not read the corpus embedding model: {str(e)}")
+            return
+        if corpus_model is not None and corpus_model != self.embedding_model_name:
+            logger.warning(
+                f"document_chunks was embedded with {corpus_model} but queries use "
+                f"{self.embedding_model_name}; run 'manage.py reembed_documents' or switch models"
+            )
+
+    def _require_corpus_model(self):
+        """
+        Refuse to retrieve while the searched chunks come from another embedding
+        model, e.g. between a re-embedding cutover and the ModelConfig switch
+        (or the index reload) reaching this worker
+        """
+        corpus_model = self.vector_db.serving_embedding_model()
+        if corpus_model is not None and corpus_model != self.embedding_model_name:
+            raise EmbeddingModelMismatch(
+                f"chunks are embedded with {corpus_model}, queries with {self.embedding_model_name}"
+            )
+
+    def _initialize_llms(self):
+        """
+        One LLM per entry of OLLAMA_BASE_URLS (comma-separated, defaulting to
+        OLLAMA_BASE_URL). With several backends an unreachable one is skipped.
+        """
+        urls = os.getenv('OLLAMA_BASE_URLS') or os.getenv('OLLAMA_BASE_URL')
+        urls = [url.strip().strip('"\'') for url in urls.split(',') if url.strip()]
+        llms = {}
+        for base_url in urls:
+            try:
+                llms[base_url] = self._initialize_llm(base_url)
+            except (ConnectionError, ValueError) as e:
+                if len(urls) == 1:
+                    raise
+                logger.error(f"Skipping LLM backend {base_url}: {str(e)}")
+        if not llms:
+            raise ConnectionError(f"None of the Ollama backends is available: {', '.join(urls)}")
+        return llms
+
+    def _initialize_llm(self, base_url=None, retries=3, delay=2):
         """Initialize Ollama LLM with connection retries and model validation"""
-        base_url = os.getenv('OLLAMA_BASE_URL').strip('"\'')
-        model_name = os.getenv('LLM_MODEL_NAME')
+        base_url = base_url or os.getenv('OLLAMA_BASE_URL').strip('"\'')
+        model_name = self.spec.llm_model
         
         logger.info(f"Initializing LLM: model={model_name}, base_url={base_url}")
         
@@ -52,7 +147,7 @@ class RAGChain:
                 # Initialize ChatOllama
                 return ChatOllama(
                     model=model_name,
-                    temperature=float(os.getenv('LLM_TEMPERATURE')),
+                    temperature=self.spec.temperature,
                     base_url=base_url,
                     timeout=180  # 3-minute timeout
                 )
@@ -103,46 +198,399 @@ class RAGChain:
             ) from e
 
     def embed_query(self, query):
-        """Convert query text to embedding vector"""
-        return self.embedding_model.encode(query).tolist()
+        """
+        Convert query text to embedding vector, reusing cached vectors. Misses
+        are encoded together with concurrent requests (see
+        rag_engine.embedding.EmbeddingService).
+        """
+        with stage('embed'):
+            embedding = embedding_cache.get(self.embedding_model_name, query)
+            if embedding is None:
+                embedding = embedding_service.encode(self.embedding_model, query)
+                embedding_cache.put(self.embedding_model_name, query, embedding)
+        return embedding
 
-    def retrieve_context(self, query_embedding, top_k=5):
-        """Retrieve top_k most relevant document chunks"""
-        return self.vector_db.cosine_similarity_search(query_embedding, top_k=top_k)
+    async def aembed_query(self, query):
+        """Async `embed_query`; the persistent cache tier is read and written in a worker thread"""
+        with stage('embed'):
+            if embedding_cache.persistent:
+                embedding = await asyncio.to_thread(embedding_cache.get, self.embedding_model_name, query)
+            else:
+                embedding = embedding_cache.get(self.embedding_model_name, query)
+            if embedding is None:
+                embedding = await embedding_service.aencode(self.embedding_model, query)
+                if embedding_cache.persistent:
+                    await asyncio.to_thread(embedding_cache.put, self.embedding_model_name, query, embedding)
+                else:
+                    embedding_cache.put(self.embedding_model_name, query, embedding)
+        return embedding
 
-    def format_context(self, context_results):
-        """Format context for the prompt"""
-        return "\n\n".join([f"• {res['text']}" for i, res in enumerate(context_results)])
+    def embed_queries(self, queries):
+        """Embed many queries, encoding all cache misses in a single batch"""
+        with stage('embed'):
+            embeddings = [embedding_cache.get(self.embedding_model_name, query) for query in queries]
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            if missing:
+                encoded = self.embedding_model.encode([queries[i] for i in missing])
+                for i, vector in zip(missing, encoded):
+                    embeddings[i] = vector.tolist()
+                    embedding_cache.put(self.embedding_model_name, queries[i], embeddings[i])
+        return embeddings
 
-    def generate(self, query, top_k=3):
-        """Generate response to user query"""
+    def answer_scope(self, filters=None):
+        """Answer cache scope for the current model, prompt, metadata filter and corpus, or None"""
+        if not answer_cache.enabled:
+            return None
+        corpus_version = self.vector_db.corpus_version()
+        if corpus_version is None:
+            return None
+        return self._answer_scope + (filters_key(normalize_filters(filters)), corpus_version)
+
+    def coalesce_key(self, query, top_k=3, filters=None):
+        """
+        Single-flight key for a query: its normalized text plus everything
+        that shapes the answer (models, prompt, retrieval mode, top_k,
+        filter and corpus version). None disables coalescing for the call.
+        """
+        if not coalescer.enabled:
+            return None
         try:
-            logger.info(f"Processing query: {query[:50]}...")
-            
-            # Embed query
+            corpus_version = self.vector_db.corpus_version()
+            filters = filters_key(normalize_filters(filters))
+        except Exception as e:
+            logger.warning(f"Not coalescing query: {str(e)}")
+            return None
+        return self._answer_scope + (normalize_query(query), top_k, filters, corpus_version)
+
+    def retrieve_context(self, query_embedding, top_k=5, filters=None, query=None, mode=None):
+        """
+        Retrieve top_k most relevant document chunks matching the metadata
+        filters. In 'hybrid' mode (RETRIEVAL_MODE) the query text selects BM25
+        candidates that are fused with their vector scores.
+        """
+        self._require_corpus_model()
+        if (mode or self.retrieval_mode) == 'hybrid' and query:
+            return self.vector_db.hybrid_search(query, query_embedding, top_k=top_k, filters=filters)
+        return self.vector_db.cosine_similarity_search(query_embedding, top_k=top_k, filters=filters)
+
+    def retrieve_context_batch(self, query_embeddings, top_k=5, filters=None, queries=None, mode=None):
+        """Retrieve top_k chunks for each of several query embeddings"""
+        self._require_corpus_model()
+        if (mode or self.retrieval_mode) == 'hybrid' and queries:
+            return [
+                self.vector_db.hybrid_search(query, query_embedding, top_k=top_k, filters=filters)
+                for query, query_embedding in zip(queries, query_embeddings)
+            ]
+        return self.vector_db.batch_similarity_search(query_embeddings, top_k=top_k, filters=filters)
+
+    def pack_context(self, context_results, query=''):
+        """
+        Build the prompt context within the token budget (see
+        rag_engine.context.ContextPacker), dropping near-duplicate chunks by
+        their stored embeddings. Returns {'text', 'chunks', 'report'}.
+        """
+        with stage('prompt'):
+            vectors = None
+            ids = [res['id'] for res in context_results if 'id' in res]
+            if context_packer.dedup and len(ids) > 1:
+                try:
+                    vectors = self.vector_db.chunk_vectors(ids)
+                except Exception as e:
+                    logger.warning(f"Could not load chunk embeddings for deduplication: {str(e)}")
+            packed = context_packer.pack(context_results, query, vectors=vectors)
+        report = packed['report']
+        logger.info(
+            f"Packed {report['used']}/{report['retrieved']} chunks into ~{report['prompt_tokens']} prompt tokens "
+            f"({report['duplicates']} duplicates, {report['over_budget']} over budget"
+            f"{', truncated' if report['truncated'] else ''})"
+        )
+        return packed
+
+    def format_context(self, context_results, query=''):
+        """Format context for the prompt"""
+        return self.pack_context(context_results, query)['text']
+
+    def prepare(self, query, top_k=3, query_embedding=None, filters=None):
+        """
+        Run everything up to the LLM call: embed the query (unless an
+        embedding is given), consult the answer cache and retrieve context
+        from the chunks matching the metadata `filters`.
+
+        Returns a dict with 'sources' and either a final 'answer' (cache hit
+        or no context) or the prompt 'inputs' still to be sent to the LLM.
+        """
+        logger.info(f"Processing query: {query[:50]}...")
+        
+        # Embed query
+        if query_embedding is None:
             query_embedding = self.embed_query(query)
             logger.debug("Query embedded successfully")
+        
+        # Answer previously seen paraphrases without calling the LLM
+        scope = self.answer_scope(filters)
+        if scope is not None:
+            with stage('answer_cache'):
+                cached = answer_cache.lookup(scope, query_embedding)
+            if cached is not None:
+                logger.info(f"Answer cache hit (similarity={cached['similarity']:.3f})")
+                return {'answer': cached['answer'], 'sources': cached['sources']}
+        
+        # Retrieve context
+        context_results = self.retrieve_context(query_embedding, top_k=top_k, filters=filters, query=query)
+        logger.info(f"Retrieved {len(context_results)} context chunks")
+        
+        if not context_results:
+            logger.warning("No context retrieved for query")
+            return {'answer': NO_CONTEXT_ANSWER, 'sources': []}
+        
+        packed = self.pack_context(context_results, query)
+        logger.debug(f"Formatted context: {packed['text'][:100]}...")
+        
+        return {
+            'answer': None,
+            'sources': [res.get('metadata', {}) for res in packed['chunks']],
+            'inputs': {"context": packed['text'], "question": query},
+            'context': packed['report'],
+            'scope': scope,
+            'query_embedding': query_embedding,
+        }
+
+    def remember(self, prepared, query, response):
+        """Store a freshly generated answer in the answer cache"""
+        if prepared.get('scope') is not None:
+            answer_cache.store(prepared['scope'], query, prepared['query_embedding'], response, prepared['sources'])
+
+    def invoke_llm(self, inputs, priority=INTERACTIVE):
+        """Run the prompt through the LLM once the scheduler grants a slot (may raise LLMOverloaded)"""
+        with llm_scheduler.slot(priority) as backend:
+            with stage('llm'):
+                return self.chains.get(backend, self.chain).invoke(inputs)
+
+    async def ainvoke_llm(self, inputs, priority=INTERACTIVE):
+        """Async `invoke_llm`"""
+        async with llm_scheduler.aslot(priority) as backend:
+            with stage('llm'):
+                return await self.chains.get(backend, self.chain).ainvoke(inputs)
+
+    def generate(self, query, top_k=3, filters=None):
+        """Generate response to user query, sharing the work with identical queries in flight"""
+        return coalescer.call(
+            self.coalesce_key(query, top_k, filters), lambda: self._generate(query, top_k, filters)
+        )
+
+    def _generate(self, query, top_k=3, filters=None):
+        try:
+            prepared = self.prepare(query, top_k=top_k, filters=filters)
+            if prepared['answer'] is not None:
+                return prepared['answer'], prepared['sources']
             
-            # Retrieve context
-            context_results = self.retrieve_context(query_embedding, top_k=top_k)
-            logger.info(f"Retrieved {len(context_results)} context chunks")
+            # Generate response
+            response = self.invoke_llm(prepared['inputs'])
+            logger.info("Generated LLM response successfully")
             
-            if not context_results:
-                logger.warning("No context retrieved for query")
-                return "I couldn't find relevant information to answer this question.", []
+            self.remember(prepared, query, response)
+            return response, prepared['sources']
+        
+        except LLMOverloaded:
+            raise
+        except Exception:
+            logger.exception("RAG generation failed")
+            return ERROR_ANSWER, []
+
+    def generate_batch(self, queries, top_k=3, max_concurrency=None, filters=None):
+        """
+        Answer independent queries together: one batched embedding pass, one
+        batched retrieval, and LLM calls with at most `max_concurrency`
+        (LLM_BATCH_CONCURRENCY) in flight at batch priority. Returns
+        [(response, sources)]; raises LLMOverloaded if the scheduler would
+        not admit them.
+        """
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv('LLM_BATCH_CONCURRENCY', 4))
+        try:
+            logger.info(f"Processing batch of {len(queries)} queries")
+            embeddings = self.embed_queries(queries)
             
-            formatted_context = self.format_context(context_results)
-            logger.debug(f"Formatted context: {formatted_context[:100]}...")
+            results = [None] * len(queries)
+            scope = self.answer_scope(filters)
+            pending = []
+            for i, embedding in enumerate(embeddings):
+                cached = answer_cache.lookup(scope, embedding) if scope is not None else None
+                if cached is not None:
+                    results[i] = (cached['answer'], cached['sources'])
+                else:
+                    pending.append(i)
             
-            # Generate response
-            response = self.chain.invoke({
-                "context": formatted_context,
-                "question": query
-            })
+            contexts = self.retrieve_context_batch(
+                [embeddings[i] for i in pending], top_k=top_k, filters=filters,
+                queries=[queries[i] for i in pending]
+            ) if pending else []
+            jobs = []
+            for i, context_results in zip(pending, contexts):
+                if not context_results:
+                    results[i] = (NO_CONTEXT_ANSWER, [])
+                    continue
+                packed = self.pack_context(context_results, queries[i])
+                sources = [res.get('metadata', {}) for res in packed['chunks']]
+                jobs.append((i, {"context": packed['text'], "question": queries[i]}, sources))
+            logger.info(f"Batch: {len(queries) - len(pending)} cached, {len(jobs)} sent to the LLM")
+            
+            responses = []
+            if jobs:
+                llm_scheduler.check(BATCH, count=min(len(jobs), max_concurrency))
+                with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='llm-batch') as pool:
+                    # One context copy per job so each LLM call is timed into the request trace
+                    futures = [
+                        pool.submit(contextvars.copy_context().run, self.invoke_llm, inputs, BATCH)
+                        for _, inputs, _ in jobs
+                    ]
+                responses = [future.exception() or future.result() for future in futures]
+            for (i, _, sources), response in zip(jobs, responses):
+                if isinstance(response, Exception):
+                    logger.error(f"Batch generation failed for query {i}: {str(response)}")
+                    results[i] = (ERROR_ANSWER, [])
+                    continue
+                results[i] = (response, sources)
+                if scope is not None:
+                    answer_cache.store(scope, queries[i], embeddings[i], response, sources)
+            return results
+        
+        except LLMOverloaded:
+            raise
+        except Exception:
+            logger.exception("RAG batch generation failed")
+            return [(ERROR_ANSWER, []) for _ in queries]
+
+    def stream(self, query, top_k=3, filters=None):
+        """
+        Generate a response incrementally.
+
+        Yields event dicts: one {'event': 'sources'} as soon as retrieval is
+        done, then {'event': 'token'} per LLM chunk, and finally either
+        {'event': 'done', 'response': <full text>} or {'event': 'error'}.
+        Concurrent identical queries share one generation and all receive
+        every event.
+        """
+        yield from coalescer.stream(
+            self.coalesce_key(query, top_k, filters), lambda: self._stream(query, top_k, filters)
+        )
+
+    def _stream(self, query, top_k=3, filters=None):
+        try:
+            prepared = self.prepare(query, top_k=top_k, filters=filters)
+        except Exception:
+            logger.exception("RAG retrieval failed")
+            yield {'event': 'error', 'error': ERROR_ANSWER}
+            return
+        
+        yield {'event': 'sources', 'sources': prepared['sources']}
+        if prepared['answer'] is not None:
+            yield {'event': 'token', 'text': prepared['answer']}
+            yield {'event': 'done', 'response': prepared['answer']}
+            return
+        
+        parts = []
+        start = time.perf_counter()
+        try:
+            with llm_scheduler.slot() as backend:
+                start = time.perf_counter()
+                for chunk in self.chains.get(backend, self.chain).stream(prepared['inputs']):
+                    if not parts:
+                        record_stage('llm_first_token', time.perf_counter() - start)
+                    parts.append(chunk)
+                    yield {'event': 'token', 'text': chunk}
+        except LLMOverloaded as e:
+            logger.warning(f"LLM overloaded: {str(e)}")
+            yield {'event': 'error', 'error': str(e), 'retry_after': e.retry_after}
+            return
+        except Exception:
+            record_stage('llm', time.perf_counter() - start)
+            metrics.error('llm')
+            logger.exception("RAG streaming generation failed")
+            yield {'event': 'error', 'error': ERROR_ANSWER}
+            return
+        
+        record_stage('llm', time.perf_counter() - start)
+        response = "".join(parts)
+        logger.info("Streamed LLM response successfully")
+        self.remember(prepared, query, response)
+        yield {'event': 'done', 'response': response}
+
+    async def aprepare(self, query, top_k=3, filters=None):
+        """
+        Async variant of `prepare`: the embedding is awaited from the shared
+        batching service and the blocking MongoDB work runs in a worker
+        thread, so the event loop is never blocked.
+        """
+        query_embedding = await self.aembed_query(query)
+        return await asyncio.to_thread(self.prepare, query, top_k, query_embedding, filters)
+
+    async def agenerate(self, query, top_k=3, filters=None):
+        """Async variant of `generate` using the LLM's async interface"""
+        key = await asyncio.to_thread(self.coalesce_key, query, top_k, filters)
+        return await coalescer.acall(key, lambda: self._agenerate(query, top_k, filters))
+
+    async def _agenerate(self, query, top_k=3, filters=None):
+        try:
+            prepared = await self.aprepare(query, top_k=top_k, filters=filters)
+            if prepared['answer'] is not None:
+                return prepared['answer'], prepared['sources']
+            
+            response = await self.ainvoke_llm(prepared['inputs'])
             logger.info("Generated LLM response successfully")
             
-            return response, [res.get('metadata', {}) for res in context_results]
+            self.remember(prepared, query, response)
+            return response, prepared['sources']
         
-        except Exception as e:
+        except LLMOverloaded:
+            raise
+        except Exception:
             logger.exception("RAG generation failed")
-            return "I encountered an error processing your request. Please try again later.", []
\ No newline at end of file
+            return ERROR_ANSWER, []
+
+    async def astream(self, query, top_k=3, filters=None):
+        """Async variant of `stream`, yielding the same events"""
+        key = await asyncio.to_thread(self.coalesce_key, query, top_k, filters)
+        async for event in coalescer.astream(key, lambda: self._astream(query, top_k, filters)):
+            yield event
+
+    async def _astream(self, query, top_k=3, filters=None):
+        try:
+            prepared = await self.aprepare(query, top_k=top_k, filters=filters)
+        except Exception:
+            logger.exception("RAG retrieval failed")
+            yield {'event': 'error', 'error': ERROR_ANSWER}
+            return
+        
+        yield {'event': 'sources', 'sources': prepared['sources']}
+        if prepared['answer'] is not None:
+            yield {'event': 'token', 'text': prepared['answer']}
+            yield {'event': 'done', 'response': prepared['answer']}
+            return
+        
+        parts = []
+        start = time.perf_counter()
+        try:
+            async with llm_scheduler.aslot() as backend:
+                start = time.perf_counter()
+                async for chunk in self.chains.get(backend, self.chain).astream(prepared['inputs']):
+                    if not parts:
+                        record_stage('llm_first_token', time.perf_counter() - start)
+                    parts.append(chunk)
+                    yield {'event': 'token', 'text': chunk}
+        except LLMOverloaded as e:
+            logger.warning(f"LLM overloaded: {str(e)}")
+            yield {'event': 'error', 'error': str(e), 'retry_after': e.retry_after}
+            return
+        except Exception:
+            record_stage('llm', time.perf_counter() - start)
+            metrics.error('llm')
+            logger.exception("RAG streaming generation failed")
+            yield {'event': 'error', 'error': ERROR_ANSWER}
+            return
+        
+        record_stage('llm', time.perf_counter() - start)
+        response = "".join(parts)
+        logger.info("Streamed LLM response successfully")
+        self.remember(prepared, query, response)
+        yield {'event': 'done', 'response': response}
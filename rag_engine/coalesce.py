@@ -0,0 +1,282 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+
+from rag_engine.prompts import ERROR_ANSWER
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Broadcast:
+    """Append-only event log that any number of threads can replay and follow"""
+
+    def __init__(self):
+        self.events = []
+        self.finished = False
+        self.condition = threading.Condition()
+        # Both guarded by SingleFlight._lock
+        self.subscribers = 0
+        self.abandoned = False
+
+    def publish(self, event):
+        with self.condition:
+            self.events.append(event)
+            self.condition.notify_all()
+
+    def finish(self):
+        with self.condition:
+            self.finished = True
+            self.condition.notify_all()
+
+    def subscribe(self):
+        seen = 0
+        while True:
+            with self.condition:
+                while seen >= len(self.events) and not self.finished:
+                    self.condition.wait()
+                if seen >= len(self.events):
+                    return
+                pending = self.events[seen:]
+                seen = len(self.events)
+            yield from pending
+
+
+class _AsyncBroadcast:
+    """_Broadcast for coroutines on one event loop"""
+
+    def __init__(self):
+        self.events = []
+        self.finished = False
+        self._changed = asyncio.Event()
+        self.subscribers = 0
+        self.abandoned = False
+        self.task = None
+
+    def publish(self, event):
+        self.events.append(event)
+        self._notify()
+
+    def finish(self):
+        self.finished = True
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self):
+        seen = 0
+        while True:
+            while seen < len(self.events):
+                yield self.events[seen]
+                seen += 1
+            if self.finished:
+                return
+            await self._changed.wait()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical requests onto one computation.
+
+    The first caller for a key runs the work; callers arriving with the same
+    key while it is in flight wait for it and receive the same result (or
+    exception). Streams are pumped by a background thread (or task) into a
+    shared event log that every caller replays from the start and then
+    follows, so late joiners get every token and a disconnecting client does
+    not cut the stream short for the others. When the last client of a
+    stream disconnects, the generation is cancelled, which releases its LLM
+    slot. A key is released as soon as its computation finishes; later
+    requests start a new one (and are then usually served by the answer
+    cache).
+
+    Disabled with REQUEST_COALESCING=false. A None key is never coalesced.
+    """
+
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = os.getenv('REQUEST_COALESCING', 'true').lower() in ('1', 'true', 'yes')
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self._async_calls = {}
+        self._async_streams = {}
+        self.leaders = 0
+        self.followers = 0
+        self.cancelled = 0
+
+    def call(self, key, func):
+        """Return func(), shared with concurrent callers of the same key"""
+        if not self.enabled or key is None:
+            return func()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            self._count(leader)
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    def stream(self, key, source):
+        """Yield the events of source(), shared with concurrent callers of the same key"""
+        if not self.enabled or key is None:
+            yield from source()
+            return
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._streams[key] = _Broadcast()
+            broadcast.subscribers += 1
+            self._count(leader)
+        if leader:
+            # Run in the leader's context so its request trace records the stages
+            context = contextvars.copy_context()
+            threading.Thread(
+                target=context.run, args=(self._pump, key, broadcast, source),
+                name='coalesced-stream', daemon=True
+            ).start()
+        try:
+            yield from broadcast.subscribe()
+        finally:
+            # The pump notices at its next event and closes the source
+            self._leave(self._streams, key, broadcast)
+
+    async def acall(self, key, func):
+        """Async `call`: await func(), shared with concurrent callers on this event loop"""
+        if not self.enabled or key is None:
+            return await func()
+        loop = asyncio.get_running_loop()
+        full_key = (id(loop), key)
+        with self._lock:
+            task = self._async_calls.get(full_key)
+            leader = task is None
+            if leader:
+                task = self._async_calls[full_key] = loop.create_task(func())
+                task.add_done_callback(lambda _: self._release(self._async_calls, full_key, task))
+            self._count(leader)
+        # A cancelled caller must not cancel the work the others wait for
+        return await asyncio.shield(task)
+
+    async def astream(self, key, source):
+        """Async `stream` over an async generator factory"""
+        if not self.enabled or key is None:
+            async for event in source():
+                yield event
+            return
+        loop = asyncio.get_running_loop()
+        full_key = (id(loop), key)
+        with self._lock:
+            broadcast = self._async_streams.get(full_key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._async_streams[full_key] = _AsyncBroadcast()
+                broadcast.task = loop.create_task(self._apump(full_key, broadcast, source))
+            broadcast.subscribers += 1
+            self._count(leader)
+        try:
+            async for event in broadcast.subscribe():
+                yield event
+        finally:
+            if self._leave(self._async_streams, full_key, broadcast):
+                broadcast.task.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'in_flight': len(self._calls) + len(self._streams) + len(self._async_calls) + len(self._async_streams),
+                'leaders': self.leaders,
+                'coalesced': self.followers,
+                'cancelled': self.cancelled,
+            }
+
+    def _count(self, leader):
+        if leader:
+            self.leaders += 1
+        else:
+            self.followers += 1
+
+    def _release(self, flights, key, flight):
+        with self._lock:
+            if flights.get(key) is flight:
+                del flights[key]
+
+    def _leave(self, flights, key, broadcast):
+        """Drop a subscriber; True when it was the last one and the stream is now abandoned"""
+        with self._lock:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers or broadcast.finished:
+                return False
+            broadcast.abandoned = True
+            self.cancelled += 1
+            # Later callers start a new stream instead of joining a cancelled one
+            if flights.get(key) is broadcast:
+                del flights[key]
+        logger.info("Every client left a coalesced stream; cancelling its generation")
+        return True
+
+    def _pump(self, key, broadcast, source):
+        events = None
+        try:
+            events = source()
+            for event in events:
+                broadcast.publish(event)
+                if broadcast.abandoned:
+                    break
+        except Exception:
+            logger.exception("Coalesced stream failed")
+            # Followers still get a terminal event, and the history row it carries
+            broadcast.publish({'event': 'error', 'error': ERROR_ANSWER})
+        finally:
+            self._release(self._streams, key, broadcast)
+            broadcast.finish()
+            # Closing an unfinished generator runs its cleanup, which gives back the LLM slot
+            close = getattr(events, 'close', None)
+            if close is not None:
+                close()
+            from django.db import connection
+
+            connection.close()
+
+    async def _apump(self, full_key, broadcast, source):
+        try:
+            async for event in source():
+                broadcast.publish(event)
+        except Exception:
+            logger.exception("Coalesced stream failed")
+            # Followers still get a terminal event, and the history row it carries
+            broadcast.publish({'event': 'error', 'error': ERROR_ANSWER})
+        finally:
+            self._release(self._async_streams, full_key, broadcast)
+            broadcast.finish()
+
+
+coalescer = SingleFlight()
@@ -0,0 +1,240 @@
+import logging
+import math
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from rag_engine.prompts import RAG_PROMPT_TEMPLATE
+
+logger = logging.getLogger(__name__)
+
+# Tokens taken by the bullet and blank line around each chunk
+CHUNK_OVERHEAD_TOKENS = 3
+
+
+class TokenEstimator:
+    """
+    Approximate LLM token counts for prompt text.
+
+    With CONTEXT_TOKENIZER set to a Hugging Face tokenizer name (ideally the
+    one matching LLM_MODEL_NAME), text is tokenized exactly; otherwise the
+    count is estimated as characters / CONTEXT_CHARS_PER_TOKEN. Counts for
+    chunks are cached by chunk id and text checksum in a bounded LRU, so
+    each chunk is tokenized once rather than on every query that retrieves it.
+    """
+
+    def __init__(self, tokenizer=None, chars_per_token=None, max_entries=None):
+        self.tokenizer_name = tokenizer if tokenizer is not None else os.getenv('CONTEXT_TOKENIZER', '')
+        if chars_per_token is None:
+            chars_per_token = float(os.getenv('CONTEXT_CHARS_PER_TOKEN', 4.0))
+        self.chars_per_token = chars_per_token
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv('CONTEXT_TOKEN_CACHE_SIZE', 50000))
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tokenizer = None
+        self._tokenizer_loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, text, key=None):
+        """Estimated tokens in `text`; with a `key` (e.g. the chunk id) the count is cached"""
+        if key is None or self.max_entries <= 0:
+            return self._estimate(text)
+        cache_key = (key, zlib.crc32(text.encode('utf-8')))
+        with self._lock:
+            tokens = self._entries.get(cache_key)
+            if tokens is not None:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return tokens
+            self.misses += 1
+        tokens = self._estimate(text)
+        with self._lock:
+            self._entries[cache_key] = tokens
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return tokens
+
+    def truncate(self, text, max_tokens):
+        """Longest prefix of `text`, cut at a word boundary, estimated to fit in max_tokens"""
+        tokens = self._estimate(text)
+        while tokens > max_tokens and text:
+            cut = int(len(text) * max_tokens / tokens * 0.95)
+            space = text.rfind(' ', 0, cut)
+            text = text[:space if space > 0 else cut].rstrip()
+            tokens = self._estimate(text)
+        return text, tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tokenizer': self.tokenizer_name or None,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def _estimate(self, text):
+        if not text:
+            return 0
+        tokenizer = self._load_tokenizer()
+        if tokenizer is not None:
+            return len(tokenizer.encode(text, add_special_tokens=False))
+        return max(1, math.ceil(len(text) / self.chars_per_token))
+
+    def _load_tokenizer(self):
+        if self._tokenizer_loaded:
+            return self._tokenizer
+        with self._lock:
+            if not self._tokenizer_loaded and self.tokenizer_name:
+                try:
+                    from transformers import AutoTokenizer
+
+                    tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+                    # Counting only: chunks longer than the model window are expected
+                    tokenizer.model_max_length = 1 << 30
+                    self._tokenizer = tokenizer
+                    logger.info(f"Counting prompt tokens with tokenizer {self.tokenizer_name}")
+                except Exception as e:
+                    logger.warning(
+                        f"Could not load tokenizer {self.tokenizer_name}, estimating tokens from length: {str(e)}"
+                    )
+            self._tokenizer_loaded = True
+        return self._tokenizer
+
+
+class ContextPacker:
+    """
+    Assembles the prompt context from retrieved chunks under a token budget.
+
+    Chunks are taken in score order. A chunk whose embedding has cosine
+    similarity of at least `dedup_threshold` with an already selected chunk
+    (or whose text is identical) is dropped as a near-duplicate. Chunks are
+    added while they fit in `budget` tokens. The first chunk that does not
+    fit is cut to the remaining budget if at least `min_chunk_tokens` are
+    left, and everything after it is dropped. The highest-scoring chunk is
+    always kept (truncated if needed), so the context is never empty.
+
+    Every call reports the context and whole-prompt token estimates, which
+    bounds LLM prefill time independently of chunk sizes and top_k.
+    """
+
+    def __init__(self, budget=None, dedup_threshold=None, min_chunk_tokens=None, estimator=None,
+                 template=RAG_PROMPT_TEMPLATE):
+        self.budget = budget if budget is not None else int(os.getenv('CONTEXT_TOKEN_BUDGET', 1500))
+        if dedup_threshold is None:
+            dedup_threshold = float(os.getenv('CONTEXT_DEDUP_THRESHOLD', 0.95))
+        self.dedup_threshold = dedup_threshold
+        if min_chunk_tokens is None:
+            min_chunk_tokens = int(os.getenv('CONTEXT_MIN_CHUNK_TOKENS', 64))
+        self.min_chunk_tokens = min_chunk_tokens
+        self.estimator = estimator or TokenEstimator()
+        self.template = template
+
+        self._lock = threading.Lock()
+        self._template_tokens = None
+        self.packed = 0
+        self.duplicates = 0
+        self.over_budget = 0
+        self.truncated = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+
+    @property
+    def dedup(self):
+        """True when near-duplicates are detected by embedding similarity"""
+        return self.dedup_threshold < 1.0
+
+    def pack(self, results, question='', vectors=None):
+        """
+        Select and format chunks from `results` (dicts with 'text', 'score'
+        and optionally 'id'). `vectors` maps chunk ids to unit embeddings for
+        near-duplicate detection.
+
+        Returns {'text', 'chunks' (the selected results, in prompt order),
+        'report'}.
+        """
+        ranked = sorted(results, key=lambda res: -res.get('score', 0.0))
+        selected, parts, kept_vectors, seen_texts = [], [], [], set()
+        used = duplicates = dropped = 0
+        truncated = False
+
+        for i, res in enumerate(ranked):
+            text = res.get('text') or ''
+            normalized = ' '.join(text.split())
+            vector = vectors.get(res.get('id')) if vectors and self.dedup else None
+            if normalized in seen_texts or (
+                vector is not None and kept_vectors and
+                float(np.max(np.vstack(kept_vectors) @ vector)) >= self.dedup_threshold
+            ):
+                duplicates += 1
+                continue
+
+            tokens = self.estimator.count(text, key=res.get('id')) + CHUNK_OVERHEAD_TOKENS
+            remaining = self.budget - used
+            if self.budget > 0 and tokens > remaining:
+                if selected and remaining < self.min_chunk_tokens + CHUNK_OVERHEAD_TOKENS:
+                    dropped = len(ranked) - i
+                    break
+                text, tokens = self.estimator.truncate(text, max(remaining - CHUNK_OVERHEAD_TOKENS, 1))
+                tokens += CHUNK_OVERHEAD_TOKENS
+                truncated = True
+
+            seen_texts.add(normalized)
+            if vector is not None:
+                kept_vectors.append(vector)
+            selected.append(res)
+            parts.append(f"• {text}")
+            used += tokens
+            if truncated:
+                dropped = len(ranked) - i - 1
+                break
+
+        report = {
+            'retrieved': len(results),
+            'used': len(selected),
+            'duplicates': duplicates,
+            'over_budget': dropped,
+            'truncated': truncated,
+            'context_tokens': used,
+            'prompt_tokens': used + self._fixed_tokens(question),
+            'budget': self.budget,
+        }
+        self._record(report)
+        return {'text': "\n\n".join(parts), 'chunks': selected, 'report': report}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'budget': self.budget,
+                'dedup_threshold': self.dedup_threshold,
+                'packed': self.packed,
+                'duplicates': self.duplicates,
+                'over_budget': self.over_budget,
+                'truncated': self.truncated,
+                'mean_prompt_tokens': self.prompt_tokens / self.packed if self.packed else 0.0,
+                'max_prompt_tokens': self.max_prompt_tokens,
+                'token_cache': self.estimator.stats(),
+            }
+
+    def _fixed_tokens(self, question):
+        """Tokens of the prompt template and question, i.e. everything but the context"""
+        if self._template_tokens is None:
+            self._template_tokens = self.estimator.count(self.template.format(context='', question=''))
+        return self._template_tokens + self.estimator.count(question)
+
+    def _record(self, report):
+        with self._lock:
+            self.packed += 1
+            self.duplicates += report['duplicates']
+            self.over_budget += report['over_budget']
+            self.truncated += report['truncated']
+            self.prompt_tokens += report['prompt_tokens']
+            self.max_prompt_tokens = max(self.max_prompt_tokens, report['prompt_tokens'])
+
+
+context_packer = ContextPacker()
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class _Lane:
+    """Pending texts for one model, served by one worker thread"""
+
+    def __init__(self, model, lock):
+        self.model = model
+        self.pending = []
+        self.ready = threading.Condition(lock)
+        self.last_batch = 0
+
+
+class EmbeddingService:
+    """
+    Micro-batches query embeddings across concurrent requests.
+
+    Callers submit one text and get a future. A worker thread per model
+    takes the pending texts and encodes them in one call of up to
+    `max_batch` (EMBEDDING_BATCH_SIZE). While a batch is encoding the next
+    one fills up, so batches grow with load. Once requests overlap (the
+    previous batch held more than one text) the worker also waits up to
+    `max_wait_ms` (EMBEDDING_BATCH_WAIT_MS) for a batch to fill; a lone
+    client is never delayed. Workers exit after `idle_seconds` without work
+    and are restarted on demand (also after a fork).
+
+    Disabled with EMBEDDING_BATCHING=false: every text is then encoded on
+    the caller's thread.
+    """
+
+    def __init__(self, max_batch=None, max_wait_ms=None, enabled=None, idle_seconds=60.0):
+        self.max_batch = max_batch or int(os.getenv('EMBEDDING_BATCH_SIZE', 32))
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv('EMBEDDING_BATCH_WAIT_MS', 2))
+        self.max_wait = max_wait_ms / 1000
+        if enabled is None:
+            enabled = os.getenv('EMBEDDING_BATCHING', 'true').lower() in ('1', 'true', 'yes')
+        self.enabled = enabled and self.max_batch > 1
+        self.idle_seconds = idle_seconds
+
+        self._lock = threading.Lock()
+        self._lanes = {}
+        self._pid = os.getpid()
+        self.batches = 0
+        self.encoded = 0
+        self.largest_batch = 0
+        self.encode_seconds = 0.0
+
+    def submit(self, model, text):
+        """Future of the embedding (list of floats) of `text`"""
+        future = Future()
+        if not self.enabled:
+            try:
+                future.set_result(model.encode(text).tolist())
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        with self._lock:
+            if self._pid != os.getpid():
+                # Worker threads do not survive a fork
+                self._lanes = {}
+                self._pid = os.getpid()
+            lane = self._lanes.get(id(model))
+            if lane is None or lane.model is not model:
+                lane = self._lanes[id(model)] = _Lane(model, self._lock)
+                threading.Thread(target=self._run, args=(lane,), name='embed-batch', daemon=True).start()
+            lane.pending.append((text, future))
+            lane.ready.notify()
+        return future
+
+    def encode(self, model, text):
+        """Embedding of `text`, encoded in a batch with concurrent callers"""
+        return self.submit(model, text).result()
+
+    async def aencode(self, model, text):
+        """Async `encode`; the event loop is not blocked while the batch runs"""
+        if not self.enabled:
+            return await asyncio.to_thread(self.encode, model, text)
+        return await asyncio.wrap_future(self.submit(model, text))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'max_batch': self.max_batch,
+                'max_wait_ms': self.max_wait * 1000,
+                'queued': sum(len(lane.pending) for lane in self._lanes.values()),
+                'batches': self.batches,
+                'encoded': self.encoded,
+                'mean_batch': self.encoded / self.batches if self.batches else 0.0,
+                'largest_batch': self.largest_batch,
+                'encode_seconds': self.encode_seconds,
+            }
+
+    def _next_batch(self, lane):
+        with self._lock:
+            if not lane.pending:
+                lane.ready.wait(self.idle_seconds)
+                if not lane.pending:
+                    if self._lanes.get(id(lane.model)) is lane:
+                        del self._lanes[id(lane.model)]
+                    return None
+            deadline = time.monotonic() + self.max_wait
+            while (lane.last_batch > 1 or len(lane.pending) > 1) and len(lane.pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                lane.ready.wait(remaining)
+            batch = lane.pending[:self.max_batch]
+            del lane.pending[:self.max_batch]
+            lane.last_batch = len(batch)
+            return batch
+
+    def _run(self, lane):
+        while True:
+            batch = self._next_batch(lane)
+            if batch is None:
+                return
+            start = time.perf_counter()
+            try:
+                vectors = lane.model.encode([text for text, _ in batch], batch_size=len(batch))
+            except Exception as e:
+                logger.error(f"Batched embedding of {len(batch)} queries failed: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - start
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector.tolist())
+            with self._lock:
+                self.batches += 1
+                self.encoded += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+                self.encode_seconds += elapsed
+
+
+embedding_service = EmbeddingService()
@@ -0,0 +1,287 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from rag_engine.answer_cache import answer_cache
+from rag_engine.chain import RAGChain
+from rag_engine.registry import embedding_models, model_registry
+
+logger = logging.getLogger(__name__)
+
+# Environment variables that RAGChain reads at construction time. A change to
+# any of them means the warm chain no longer matches the configuration.
+CONFIG_ENV_VARS = (
+    'EMBEDDING_MODEL_NAME',
+    'MONGODB_URI',
+    'MONGODB_DB_NAME',
+    'OLLAMA_BASE_URL',
+    'OLLAMA_BASE_URLS',
+    'LLM_MODEL_NAME',
+    'LLM_TEMPERATURE',
+    'RETRIEVAL_MODE',
+)
+
+
+def config_fingerprint():
+    """Snapshot of the configuration a RAGChain is built from"""
+    return tuple(os.getenv(name) for name in CONFIG_ENV_VARS)
+
+
+class RAGEngine:
+    """
+    Process-wide owner of a warm RAGChain.
+
+    The chain is built once and shared by every request handled by this
+    worker. It is rebuilt only when the configuration fingerprint changes
+    or an explicit reload is requested. When the chain was built in a parent
+    process (gunicorn --preload) the MongoDB client is reopened in the child,
+    since pymongo clients are not fork-safe.
+
+    The chain follows the active ModelConfig (see rag_engine.registry). When
+    it changes, the new chain is built and warmed in a background thread
+    while the old one keeps serving, then swapped in. Requests naming
+    another active config get a chain of their own; the last
+    MODEL_CONFIG_CHAINS of those are kept warm and share the vector index.
+    """
+
+    STARTING = 'starting'
+    READY = 'ready'
+    FAILED = 'failed'
+
+    def __init__(self, factory=RAGChain):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._chain = None
+        self._fingerprint = None
+        self._pid = None
+        self._state = self.STARTING
+        self._error = None
+        self._built_at = None
+        self._build_seconds = None
+        self._builds = 0
+        self._preloading = False
+        self._pending = None
+        self._failed = None
+        self._cutover_error = None
+        self._named = OrderedDict()
+        self._named_specs = ()
+        self._named_loading = {}
+        self._named_lock = threading.Lock()
+        self.max_named = int(os.getenv('MODEL_CONFIG_CHAINS', 2))
+
+    def get(self, config=None):
+        """
+        Return the warm chain, building or rebuilding it if needed. `config`
+        names an active ModelConfig to use instead of the default one.
+        """
+        chain = self._chain
+        if chain is not None and self._is_current():
+            if config is None or config == chain.spec.name:
+                return chain
+            return self._named_chain(config, chain)
+
+        with self._lock:
+            if self._chain is None or self._fingerprint != config_fingerprint():
+                self._build()
+            elif self._pid != os.getpid():
+                self._after_fork()
+            chain = self._chain
+        if config is not None and config != chain.spec.name:
+            return self._named_chain(config, chain)
+        return chain
+
+    def current(self):
+        """The warm chain if it is usable right now without building, else None"""
+        chain = self._chain
+        if chain is not None and self._is_current():
+            return chain
+        return None
+
+    def preload(self):
+        """Build the chain eagerly, e.g. in the gunicorn master before forking"""
+        self._preloading = True
+        try:
+            self.get()
+        except Exception:
+            logger.exception("RAG engine preload failed")
+        finally:
+            self._preloading = False
+            # Database connections must not be inherited by forked workers
+            from django.db import connections
+            connections.close_all()
+
+    def reload(self):
+        """Force a rebuild on the next call, dropping the current chain"""
+        with self._lock:
+            self._chain = None
+            self._fingerprint = None
+            self._state = self.STARTING
+            self._failed = None
+        with self._named_lock:
+            self._named.clear()
+            self._named_specs = ()
+
+    def health(self):
+        """Liveness/readiness report for the engine"""
+        named = [spec.name for spec in self._named_specs]
+        return {
+            'state': self._state,
+            'ready': self._state == self.READY and self._is_current(),
+            'error': self._error,
+            'built_at': self._built_at,
+            'build_seconds': self._build_seconds,
+            'builds': self._builds,
+            'pid': os.getpid(),
+            'model_config': self._chain.spec.describe() if self._chain is not None else None,
+            'pending_model_config': self._pending.name if self._pending is not None else None,
+            'cutover_error': self._cutover_error,
+            'named_model_configs': named,
+        }
+
+    def _is_current(self):
+        return self._fingerprint == config_fingerprint() and self._pid == os.getpid()
+
+    def _build(self):
+        fingerprint = config_fingerprint()
+        if self._chain is not None:
+            logger.info("RAG configuration changed, rebuilding engine")
+        start = time.time()
+        try:
+            chain = self._factory(spec=model_registry.refresh(notify=False))
+            chain.warm_up()
+        except Exception as e:
+            self._state = self.FAILED
+            self._error = str(e)
+            logger.error(f"RAG engine build failed: {str(e)}")
+            raise
+
+        self._chain = chain
+        self._fingerprint = fingerprint
+        self._pid = os.getpid()
+        with self._named_lock:
+            # Named chains share the vector index of the chain they were built beside
+            self._named.clear()
+            self._named_specs = ()
+        self._state = self.READY
+        self._error = None
+        self._built_at = time.time()
+        self._build_seconds = self._built_at - start
+        self._builds += 1
+        self._pending = None
+        logger.info(f"RAG engine ready in {self._build_seconds:.2f}s")
+        self._warm_answer_cache(chain)
+        self._pin_models()
+        if not self._preloading:
+            model_registry.watch(self._on_model_config_change)
+
+    def _on_model_config_change(self, spec):
+        """Build and warm a chain for the new active config, then cut over to it"""
+        with self._lock:
+            chain = self._chain
+            if chain is None:
+                return
+            if spec == chain.spec:
+                # Switched back before a pending cutover finished
+                self._pending = self._failed = None
+                return
+            if spec in (self._pending, self._failed):
+                return
+            self._pending = spec
+        threading.Thread(target=self._cutover, args=(spec, chain), name='model-cutover', daemon=True).start()
+
+    def _cutover(self, spec, previous):
+        logger.info(f"Preloading model config '{spec.name}' before cutover")
+        start = time.time()
+        try:
+            chain = self._factory(spec=spec, vector_db=previous.vector_db)
+            chain.warm_up()
+        except Exception as e:
+            logger.error(f"Preloading model config '{spec.name}' failed, keeping '{previous.spec.name}': {str(e)}")
+            with self._lock:
+                if self._pending == spec:
+                    self._pending = None
+                    self._failed = spec
+                    self._cutover_error = str(e)
+            return
+
+        with self._lock:
+            if self._pending != spec or self._chain is not previous:
+                logger.info(f"Discarding preloaded model config '{spec.name}', superseded")
+                return
+            self._chain = chain
+            self._pending = None
+            self._failed = None
+            self._cutover_error = None
+            self._built_at = time.time()
+            self._build_seconds = self._built_at - start
+            self._builds += 1
+        logger.info(f"Switched to model config '{spec.name}' after {self._build_seconds:.2f}s of preloading")
+        self._warm_answer_cache(chain)
+        self._pin_models()
+
+    def _named_chain(self, name, default):
+        spec = model_registry.lookup(name)
+        if spec == default.spec:
+            return default
+        with self._named_lock:
+            chain = self._named.get(spec)
+            if chain is not None:
+                self._named.move_to_end(spec)
+                return chain
+            build_lock = self._named_loading.setdefault(spec, threading.Lock())
+
+        # Built outside _named_lock so other configs and health() are not held up
+        with build_lock:
+            with self._named_lock:
+                chain = self._named.get(spec)
+            if chain is not None:
+                return chain
+            try:
+                logger.info(f"Building chain for model config '{name}'")
+                chain = self._factory(spec=spec, vector_db=default.vector_db)
+                chain.warm_up()
+                with self._named_lock:
+                    current = self._chain
+                    # Not kept if a rebuild replaced the vector index meanwhile
+                    if current is not None and current.vector_db is default.vector_db:
+                        self._named[spec] = chain
+                        while len(self._named) > self.max_named:
+                            self._named.popitem(last=False)
+                        self._named_specs = tuple(self._named)
+            finally:
+                with self._named_lock:
+                    self._named_loading.pop(spec, None)
+        self._pin_models()
+        return chain
+
+    def _pin_models(self):
+        with self._named_lock:
+            chains = [self._chain] + list(self._named.values())
+        embedding_models.pin(chain.embedding_model_name for chain in chains if chain is not None)
+
+    def _warm_answer_cache(self, chain):
+        limit = int(os.getenv('ANSWER_CACHE_WARM_START', 0))
+        if not limit:
+            return
+        try:
+            scope = chain.answer_scope()
+            if scope is not None:
+                answer_cache.warm_start(chain, scope, limit=limit)
+        except Exception as e:
+            logger.error(f"Answer cache warm start failed: {str(e)}")
+
+    def _after_fork(self):
+        logger.info(f"Reconnecting RAG engine in worker pid={os.getpid()}")
+        self._chain.reconnect()
+        self._pid = os.getpid()
+        model_registry.watch(self._on_model_config_change)
+
+
+engine = RAGEngine()
+
+
+def get_rag_chain(config=None):
+    """Shared RAGChain for the current worker process, optionally for a named model config"""
+    return engine.get(config)
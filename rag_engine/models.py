@@ -0,0 +1,12 @@
+from django.db import models
+from django.utils import timezone
+
+class QueryEmbedding(models.Model):
+    """Persistent tier of the query embedding cache (see rag_engine.cache)"""
+    key = models.CharField(max_length=64, unique=True)
+    model_name = models.CharField(max_length=255, db_index=True)
+    embedding = models.BinaryField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.model_name} - {self.key[:12]}"
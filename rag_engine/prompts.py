@@ -8,4 +8,7 @@ Context:
 Question: {question}
 
 Answer:
-"""
\ No newline at end of file
+"""
+
+# Returned in place of an answer when generation fails
+ERROR_ANSWER = "I encountered an error processing your request. Please try again later."
@@ -0,0 +1,308 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownModelConfig(LookupError):
+    """No active ModelConfig has the requested name"""
+
+
+class ModelSpec(namedtuple('ModelSpec', ('name', 'llm_model', 'embedding_model', 'temperature'))):
+    """The models a RAGChain is built from, taken from a ModelConfig or the environment"""
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            name='env',
+            llm_model=os.getenv('LLM_MODEL_NAME'),
+            embedding_model=os.getenv('EMBEDDING_MODEL_NAME'),
+            temperature=float(os.getenv('LLM_TEMPERATURE', 0.7)),
+        )
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            name=config.name,
+            llm_model=config.llm_model,
+            embedding_model=config.embedding_model,
+            temperature=float(config.temperature),
+        )
+
+    def describe(self):
+        return dict(self._asdict())
+
+
+def model_bytes(model):
+    """
+    Weight memory of an embedding model, or 0 if it cannot be measured: the
+    constants of an OpenVINO model, the model files of an ONNX Runtime
+    session, or else the tensors of the torch module, including the packed
+    weights of dynamically quantized (qint8) layers.
+    """
+    try:
+        runtime_model = _runtime_model(model)
+        if hasattr(runtime_model, 'model_path'):
+            path = Path(runtime_model.model_path)
+            # External weights live beside the graph, e.g. model.onnx_data
+            return sum(f.stat().st_size for f in path.parent.glob(f"{path.name}*") if f.is_file())
+        if runtime_model is not None:
+            return sum(op.get_byte_size() for op in runtime_model.model.get_ops() if op.get_type_name() == 'Constant')
+        seen = set()
+        return sum(_tensor_bytes(value, seen) for value in model.state_dict().values())
+    except Exception:
+        return 0
+
+
+def _runtime_model(model):
+    """The ONNX Runtime or OpenVINO model behind a SentenceTransformer, if any"""
+    try:
+        auto_model = model[0].auto_model
+    except Exception:
+        return None
+    return None if hasattr(auto_model, 'state_dict') else auto_model
+
+
+def _tensor_bytes(value, seen):
+    """Bytes of the tensors in a state_dict value; packed params are tuples of tensors"""
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(item, seen) for item in value)
+    if not hasattr(value, 'element_size'):
+        return 0
+    key = (value.data_ptr(), value.numel())
+    if key in seen:
+        return 0
+    seen.add(key)
+    return value.numel() * value.element_size()
+
+
+EMBEDDING_BACKENDS = ('torch', 'qint8', 'onnx', 'openvino')
+
+
+def load_sentence_transformer(name, backend=None):
+    """
+    Load an embedding model for CPU inference. EMBEDDING_BACKEND selects
+    plain PyTorch ('torch'), PyTorch with int8 dynamically quantized linear
+    layers ('qint8'), or an ONNX Runtime / OpenVINO export ('onnx',
+    'openvino'; EMBEDDING_MODEL_FILE picks a file such as a quantized
+    'onnx/model_qint8_avx512.onnx'). EMBEDDING_THREADS sets PyTorch's
+    intra-op thread count.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or os.getenv('EMBEDDING_BACKEND', 'torch')
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}'; expected one of {', '.join(EMBEDDING_BACKENDS)}")
+    threads = os.getenv('EMBEDDING_THREADS')
+    if threads:
+        import torch
+
+        torch.set_num_threads(int(threads))
+
+    if backend in ('onnx', 'openvino'):
+        model_file = os.getenv('EMBEDDING_MODEL_FILE')
+        model_kwargs = {'file_name': model_file} if model_file else None
+        return SentenceTransformer(name, device='cpu', backend=backend, model_kwargs=model_kwargs)
+    model = SentenceTransformer(name, device='cpu')
+    if backend == 'qint8':
+        import torch
+
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+class EmbeddingModelPool:
+    """
+    Process-wide LRU of loaded SentenceTransformer models keyed by name.
+
+    Chains built for different model configs share one instance per model.
+    At most `max_models` (EMBEDDING_MODEL_CACHE_SIZE) models and
+    `max_bytes` (EMBEDDING_MODEL_CACHE_MB) of weights are kept; the least
+    recently used model is dropped first, except pinned models, i.e. those
+    of live chains. Concurrent requests for a model that is still loading
+    wait for the one load.
+    """
+
+    def __init__(self, max_models=None, max_bytes=None, loader=load_sentence_transformer):
+        self.max_models = max_models or int(os.getenv('EMBEDDING_MODEL_CACHE_SIZE', 4))
+        if max_bytes is None:
+            max_bytes = float(os.getenv('EMBEDDING_MODEL_CACHE_MB', 2048)) * 2 ** 20
+        self.max_bytes = max_bytes
+        self._loader = loader
+
+        self._lock = threading.Lock()
+        self._models = OrderedDict()
+        self._loading = {}
+        self._pinned = frozenset()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, name):
+        """The loaded model `name`, loading it if needed"""
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is not None:
+                self._models.move_to_end(name)
+                self.hits += 1
+                return entry[0]
+            load_lock = self._loading.setdefault(name, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                entry = self._models.get(name)
+                if entry is not None:
+                    self.hits += 1
+                    return entry[0]
+            start = time.time()
+            try:
+                model = self._loader(name)
+                size = model_bytes(model)
+                with self._lock:
+                    self._models[name] = (model, size)
+                    self.loads += 1
+                    self._evict(keep=name)
+            finally:
+                with self._lock:
+                    self._loading.pop(name, None)
+        logger.info(f"Loaded embedding model {name} ({size / 2 ** 20:.0f} MiB) in {time.time() - start:.1f}s")
+        return model
+
+    def pin(self, names):
+        """Protect the models of live chains from eviction"""
+        with self._lock:
+            self._pinned = frozenset(names)
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'models': {name: size for name, (_, size) in self._models.items()},
+                'bytes': sum(size for _, size in self._models.values()),
+                'max_models': self.max_models,
+                'max_bytes': self.max_bytes,
+                'pinned': sorted(self._pinned),
+                'hits': self.hits,
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
+
+    def _evict(self, keep=None):
+        while len(self._models) > self.max_models or self._bytes() > self.max_bytes:
+            victim = next((name for name in self._models if name != keep and name not in self._pinned), None)
+            if victim is None:
+                return
+            del self._models[victim]
+            self.evictions += 1
+            logger.info(f"Evicted embedding model {victim}")
+
+    def _bytes(self):
+        return sum(size for _, size in self._models.values())
+
+
+class ModelRegistry:
+    """
+    Resolves ModelConfig rows to ModelSpecs.
+
+    The active spec is the most recently updated ModelConfig with
+    `is_active`, or the environment (EMBEDDING_MODEL_NAME, LLM_MODEL_NAME,
+    LLM_TEMPERATURE) when there is none. Once `watch` is called, a
+    background thread re-reads it every MODEL_CONFIG_REFRESH_SECONDS (0
+    disables polling) and passes a changed spec to the watchers, which lets
+    the engine preload the new models before cutting over. Saving a
+    ModelConfig refreshes this process immediately.
+    """
+
+    def __init__(self, refresh_seconds=None):
+        if refresh_seconds is None:
+            refresh_seconds = float(os.getenv('MODEL_CONFIG_REFRESH_SECONDS', 10))
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._active = None
+        self._named = {}
+        self._watchers = []
+        self._poller_pid = None
+
+    def active(self):
+        """Spec of the active ModelConfig (read once, then kept current by `refresh`)"""
+        spec = self._active
+        if spec is None:
+            spec = self.refresh(notify=False)
+        return spec
+
+    def embedding_models_in_use(self):
+        """Embedding models of the active spec and of every active ModelConfig"""
+        from model_config.models import ModelConfig
+
+        models = set(ModelConfig.objects.filter(is_active=True).values_list('embedding_model', flat=True))
+        models.add(self.active().embedding_model)
+        return models
+
+    def lookup(self, name):
+        """Spec of the active ModelConfig called `name`; raises UnknownModelConfig"""
+        now = time.monotonic()
+        entry = self._named.get(name)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        from model_config.models import ModelConfig
+
+        config = ModelConfig.objects.filter(name=name, is_active=True).first()
+        if config is None:
+            raise UnknownModelConfig(f"No active model config named '{name}'")
+        spec = ModelSpec.from_config(config)
+        self._named[name] = (spec, now + max(self.refresh_seconds, 1.0))
+        return spec
+
+    def refresh(self, notify=True):
+        """Re-read the active spec, telling the watchers if it changed"""
+        try:
+            spec = self._read_active()
+        except Exception as e:
+            logger.warning(f"Could not read the active model config: {str(e)}")
+            return self._active or ModelSpec.from_env()
+        with self._lock:
+            changed = self._active is not None and spec != self._active
+            self._active = spec
+            self._named.clear()
+            watchers = list(self._watchers) if notify and changed else []
+        if changed:
+            logger.info(f"Active model config is now '{spec.name}' ({spec.llm_model}, {spec.embedding_model})")
+        for callback in watchers:
+            try:
+                callback(spec)
+            except Exception:
+                logger.exception("Model config watcher failed")
+        return spec
+
+    def watch(self, callback):
+        """Call `callback(spec)` when the active spec changes, polling in this process"""
+        with self._lock:
+            if callback not in self._watchers:
+                self._watchers.append(callback)
+            if self.refresh_seconds <= 0 or self._poller_pid == os.getpid():
+                return
+            # Threads do not survive a fork, so every worker starts its own poller
+            self._poller_pid = os.getpid()
+        threading.Thread(target=self._poll, name='model-config-poller', daemon=True).start()
+
+    @staticmethod
+    def _read_active():
+        from model_config.models import ModelConfig
+
+        config = ModelConfig.objects.filter(is_active=True).order_by('-updated_at').first()
+        return ModelSpec.from_config(config) if config is not None else ModelSpec.from_env()
+
+    def _poll(self):
+        while True:
+            time.sleep(self.refresh_seconds)
+            self.refresh()
+            from django.db import connection
+            connection.close()
+
+
+embedding_models = EmbeddingModelPool()
+model_registry = ModelRegistry()
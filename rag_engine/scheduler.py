@@ -0,0 +1,337 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from core.metrics import record_stage
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+# Lower runs first
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+
+
+class LLMOverloaded(Exception):
+    """
+    The LLM cannot start this generation in time. `status` is 429 when the
+    wait queue is full and 503 when the wait would exceed the deadline;
+    `retry_after` is the suggested delay in whole seconds.
+    """
+
+    def __init__(self, message, retry_after, status=503, reason='deadline'):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+        self.reason = reason
+
+
+class _Backend:
+    __slots__ = ('url', 'limit', 'active', 'served', 'failures', 'down_until')
+
+    def __init__(self, url, limit):
+        self.url = url
+        self.limit = limit
+        self.active = 0
+        self.served = 0
+        self.failures = 0
+        self.down_until = 0.0
+
+
+class _Waiter:
+    __slots__ = ('priority', 'event', 'loop', 'future', 'backend', 'cancelled')
+
+    def __init__(self, priority, loop=None):
+        self.priority = priority
+        self.event = threading.Event() if loop is None else None
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.backend = None
+        self.cancelled = False
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class LLMScheduler:
+    """
+    Admission control and priority scheduling for LLM generations.
+
+    Each Ollama backend runs at most `max_concurrency` generations from this
+    process (LLM_MAX_CONCURRENCY); further requests wait in a bounded queue
+    (LLM_QUEUE_SIZE) where interactive requests go before batch ones and
+    each class is first come, first served. A slot is granted to the least
+    loaded backend; one whose generation raised is skipped for
+    LLM_BACKEND_COOLDOWN seconds while another backend is available.
+
+    Requests fail fast instead of piling up behind a saturated model: a full
+    queue is rejected with 429, and a request whose estimated wait (queue
+    position × the moving average generation time / total slots) exceeds
+    its class deadline (LLM_QUEUE_DEADLINE_SECONDS, or
+    LLM_BATCH_QUEUE_DEADLINE_SECONDS for batch) with 503. A request that
+    was admitted but still waits past the deadline is rejected with 503 too.
+    The time spent waiting is recorded as the `llm_queue` stage.
+    """
+
+    def __init__(self, max_concurrency=None, queue_size=None, deadline=None, batch_deadline=None,
+                 cooldown=None, initial_service_seconds=None):
+        self.max_concurrency = max_concurrency or int(os.getenv('LLM_MAX_CONCURRENCY', 2))
+        self.queue_size = int(os.getenv('LLM_QUEUE_SIZE', 32)) if queue_size is None else queue_size
+        self.deadlines = {
+            INTERACTIVE: deadline or float(os.getenv('LLM_QUEUE_DEADLINE_SECONDS', 30)),
+            BATCH: batch_deadline or float(os.getenv('LLM_BATCH_QUEUE_DEADLINE_SECONDS', 120)),
+        }
+        self.cooldown = float(os.getenv('LLM_BACKEND_COOLDOWN', 30)) if cooldown is None else cooldown
+        # Moving average of slot hold time, seeded until real generations are seen
+        self.service_seconds = initial_service_seconds or float(os.getenv('LLM_EXPECTED_SECONDS', 10))
+
+        self._lock = threading.Lock()
+        self._backends = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self.queued = {name: 0 for name in PRIORITIES}
+        self.admitted = 0
+        self.rejected = {'queue_full': 0, 'deadline': 0, 'timeout': 0}
+
+    def configure(self, urls):
+        """Set the backends to schedule onto, keeping the counters of those that remain"""
+        with self._lock:
+            self._backends = {
+                url: self._backends.get(url) or _Backend(url, self.max_concurrency) for url in urls
+            }
+            self._dispatch()
+
+    @property
+    def backends(self):
+        return list(self._backends)
+
+    def check(self, priority=INTERACTIVE, count=1):
+        """
+        Raise LLMOverloaded if `count` more requests of this class would be
+        rejected right now, e.g. before starting a response that cannot
+        report an error status later.
+        """
+        with self._lock:
+            self._admit(priority, count)
+
+    @contextmanager
+    def slot(self, priority=INTERACTIVE):
+        """Hold a generation slot for the enclosed block; yields the backend URL to call"""
+        backend = self.acquire(priority)
+        start = time.perf_counter()
+        failed = cancelled = False
+        try:
+            yield backend
+        except Exception:
+            failed = True
+            raise
+        except (GeneratorExit, asyncio.CancelledError):
+            # A client that disconnected mid-generation says nothing about generation time
+            cancelled = True
+            raise
+        finally:
+            self.release(backend, None if cancelled else time.perf_counter() - start, failed)
+
+    @asynccontextmanager
+    async def aslot(self, priority=INTERACTIVE):
+        """Async `slot`: waits on the event loop instead of blocking a thread"""
+        backend = await self.aacquire(priority)
+        start = time.perf_counter()
+        failed = cancelled = False
+        try:
+            yield backend
+        except Exception:
+            failed = True
+            raise
+        except (GeneratorExit, asyncio.CancelledError):
+            # A client that disconnected mid-generation says nothing about generation time
+            cancelled = True
+            raise
+        finally:
+            self.release(backend, None if cancelled else time.perf_counter() - start, failed)
+
+    def acquire(self, priority=INTERACTIVE):
+        start = time.perf_counter()
+        with self._lock:
+            backend = self._grant_now(priority)
+            if backend is None:
+                waiter = self._enqueue(priority)
+        if backend is None:
+            granted = waiter.event.wait(self.deadlines[priority])
+            backend = self._granted(waiter, granted, priority)
+        record_stage('llm_queue', time.perf_counter() - start)
+        return backend
+
+    async def aacquire(self, priority=INTERACTIVE):
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            backend = self._grant_now(priority)
+            if backend is None:
+                waiter = self._enqueue(priority, loop)
+        if backend is None:
+            try:
+                await asyncio.wait_for(waiter.future, self.deadlines[priority])
+                granted = True
+            except asyncio.TimeoutError:
+                granted = False
+            except asyncio.CancelledError:
+                self._abandon(waiter)
+                raise
+            backend = self._granted(waiter, granted, priority)
+        record_stage('llm_queue', time.perf_counter() - start)
+        return backend
+
+    def release(self, url, seconds=None, failed=False):
+        """Return a slot; `seconds` it was held for feeds the wait estimate (None for a cancelled one)"""
+        with self._lock:
+            backend = self._backends.get(url)
+            if backend is not None:
+                backend.active -= 1
+                if failed:
+                    backend.failures += 1
+                    if len(self._backends) > 1:
+                        backend.down_until = time.monotonic() + self.cooldown
+                        logger.warning(f"LLM backend {url} failed; skipping it for {self.cooldown:.0f}s")
+                elif seconds is not None:
+                    backend.served += 1
+                    backend.down_until = 0.0
+                    self.service_seconds = 0.8 * self.service_seconds + 0.2 * seconds
+            self._dispatch()
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'max_concurrency': self.max_concurrency,
+                'queue_size': self.queue_size,
+                'deadlines': dict(self.deadlines),
+                'in_flight': sum(backend.active for backend in self._backends.values()),
+                'queued': dict(self.queued),
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'service_seconds': self.service_seconds,
+                'backends': [{
+                    'url': backend.url,
+                    'active': backend.active,
+                    'served': backend.served,
+                    'failures': backend.failures,
+                    'healthy': backend.down_until <= now,
+                } for backend in self._backends.values()],
+            }
+
+    # The helpers below run with self._lock held
+
+    def _candidates(self):
+        now = time.monotonic()
+        healthy = [backend for backend in self._backends.values() if backend.down_until <= now]
+        return healthy or list(self._backends.values())
+
+    def _free_backend(self):
+        free = [backend for backend in self._candidates() if backend.active < backend.limit]
+        if not free:
+            return None
+        return min(free, key=lambda backend: backend.active / backend.limit)
+
+    def _ahead(self, priority):
+        rank = PRIORITIES[priority]
+        return sum(count for name, count in self.queued.items() if PRIORITIES[name] <= rank)
+
+    def _estimate_wait(self, priority, count=1):
+        capacity = sum(backend.limit for backend in self._candidates()) or 1
+        return (self._ahead(priority) + count) / capacity * self.service_seconds
+
+    def _admit(self, priority, count=1):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'")
+        if not self._backends:
+            raise RuntimeError("No LLM backends configured")
+        if self._ahead(priority) == 0 and self._free_backend() is not None:
+            return
+        queued = sum(self.queued.values())
+        estimate = self._estimate_wait(priority, count)
+        retry_after = max(1, math.ceil(estimate))
+        if queued + count > self.queue_size:
+            self.rejected['queue_full'] += 1
+            raise LLMOverloaded(
+                f"LLM queue is full ({queued} waiting)", retry_after, status=429, reason='queue_full'
+            )
+        if estimate > self.deadlines[priority]:
+            self.rejected['deadline'] += 1
+            raise LLMOverloaded(
+                f"Estimated LLM wait {estimate:.1f}s exceeds {self.deadlines[priority]:.0f}s", retry_after
+            )
+
+    def _grant_now(self, priority):
+        self._admit(priority)
+        if self._ahead(priority) == 0:
+            backend = self._free_backend()
+            if backend is not None:
+                backend.active += 1
+                self.admitted += 1
+                return backend.url
+        return None
+
+    def _enqueue(self, priority, loop=None):
+        waiter = _Waiter(priority, loop)
+        heapq.heappush(self._queue, (PRIORITIES[priority], next(self._sequence), waiter))
+        self.queued[priority] += 1
+        self.admitted += 1
+        # A backend may have come back from its cooldown since the last release
+        self._dispatch()
+        return waiter
+
+    def _dispatch(self):
+        while self._queue:
+            waiter = self._queue[0][2]
+            if waiter.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            backend = self._free_backend()
+            if backend is None:
+                return
+            heapq.heappop(self._queue)
+            self.queued[waiter.priority] -= 1
+            backend.active += 1
+            waiter.backend = backend.url
+            waiter.wake()
+
+    def _cancel(self, waiter):
+        """Withdraw a waiter; False if it was granted a slot in the meantime"""
+        with self._lock:
+            if waiter.backend is not None:
+                return False
+            if not waiter.cancelled:
+                waiter.cancelled = True
+                self.queued[waiter.priority] -= 1
+            return True
+
+    def _granted(self, waiter, granted, priority):
+        if not granted and self._cancel(waiter):
+            with self._lock:
+                self.rejected['timeout'] += 1
+                retry_after = max(1, math.ceil(self._estimate_wait(priority)))
+            raise LLMOverloaded(
+                f"Timed out after {self.deadlines[priority]:.0f}s waiting for the LLM", retry_after
+            )
+        return waiter.backend
+
+    def _abandon(self, waiter):
+        if not self._cancel(waiter):
+            self.release(waiter.backend)
+
+
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,18 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from model_config.models import ModelConfig
+from rag_engine.registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=ModelConfig)
+@receiver(post_delete, sender=ModelConfig)
+def refresh_on_model_config_change(sender, instance, **kwargs):
+    """Pick up a new active config in this process now; other workers poll for it"""
+    logger.info(f"ModelConfig '{instance.name}' changed, refreshing the model registry")
+    transaction.on_commit(model_registry.refresh)
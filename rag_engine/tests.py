@@ -0,0 +1,364 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from rag_engine.answer_cache import AnswerCache, model_scope
+from rag_engine.coalesce import SingleFlight
+from rag_engine.context import CHUNK_OVERHEAD_TOKENS, ContextPacker, TokenEstimator
+from rag_engine.prompts import ERROR_ANSWER, RAG_PROMPT_TEMPLATE
+from rag_engine.registry import ModelSpec
+from rag_engine.scheduler import BATCH, INTERACTIVE, LLMOverloaded, LLMScheduler
+
+
+class AnswerCacheScopeTests(SimpleTestCase):
+    def test_embedding_models_do_not_share_answers(self):
+        cache = AnswerCache(max_entries=10, threshold=0.9)
+        minilm = ModelSpec('minilm', 'llama3', 'all-MiniLM-L6-v2', 0.7)
+        mpnet = minilm._replace(name='mpnet', embedding_model='all-mpnet-base-v2')
+        minilm_scope = model_scope(minilm, RAG_PROMPT_TEMPLATE, 'dense') + (None, 1)
+        mpnet_scope = model_scope(mpnet, RAG_PROMPT_TEMPLATE, 'dense') + (None, 1)
+        self.assertNotEqual(minilm_scope, mpnet_scope)
+
+        cache.store(minilm_scope, "What is RAG?", np.ones(384), "from minilm", [])
+        # Same question embedded by the other model, with another dimension
+        self.assertIsNone(cache.lookup(mpnet_scope, np.ones(768)))
+
+        cache.store(mpnet_scope, "What is RAG?", np.ones(768), "from mpnet", [])
+        self.assertEqual(cache.lookup(minilm_scope, np.ones(384))['answer'], "from minilm")
+        self.assertEqual(cache.lookup(mpnet_scope, np.ones(768))['answer'], "from mpnet")
+
+
+def words(count, word='lorem'):
+    """`count` three-letter words, which estimate to `count` tokens at 4 characters per token"""
+    return ' '.join([word[:3]] * count)
+
+
+class ContextPackerTests(SimpleTestCase):
+    def packer(self, budget, dedup_threshold=0.95, min_chunk_tokens=5):
+        estimator = TokenEstimator(tokenizer='', chars_per_token=4, max_entries=100)
+        return ContextPacker(budget=budget, dedup_threshold=dedup_threshold, min_chunk_tokens=min_chunk_tokens,
+                             estimator=estimator)
+
+    def results(self, *texts):
+        return [{'id': f"c{i}", 'text': text, 'score': 1.0 - i / 10} for i, text in enumerate(texts)]
+
+    def test_chunks_fill_the_budget_in_score_order(self):
+        chunk_tokens = 10 + CHUNK_OVERHEAD_TOKENS
+        results = self.results(words(10, 'aaa'), words(10, 'bbb'), words(10, 'ccc'), words(10, 'ddd'))
+        packed = self.packer(budget=2 * chunk_tokens + 4).pack(list(reversed(results)), question="q?")
+
+        self.assertEqual([res['id'] for res in packed['chunks']], ['c0', 'c1'])
+        self.assertEqual(packed['text'], f"• {results[0]['text']}\n\n• {results[1]['text']}")
+        report = packed['report']
+        self.assertEqual((report['used'], report['over_budget'], report['truncated']), (2, 2, False))
+        self.assertEqual(report['context_tokens'], 2 * chunk_tokens)
+        self.assertGreater(report['prompt_tokens'], report['context_tokens'])
+
+    def test_chunk_straddling_the_budget_is_truncated(self):
+        results = self.results(words(10, 'aaa'), words(10, 'bbb'), words(10, 'ccc'))
+        packed = self.packer(budget=22).pack(results)
+
+        self.assertEqual([res['id'] for res in packed['chunks']], ['c0', 'c1'])
+        report = packed['report']
+        self.assertTrue(report['truncated'])
+        self.assertEqual(report['over_budget'], 1)
+        self.assertLessEqual(report['context_tokens'], 22)
+        second = packed['text'].split("\n\n")[1]
+        self.assertTrue(results[1]['text'].startswith(second[2:]))
+        self.assertLess(len(second[2:]), len(results[1]['text']))
+
+    def test_top_chunk_is_always_kept(self):
+        packed = self.packer(budget=6).pack(self.results(words(40), words(2, 'bbb')))
+        self.assertEqual([res['id'] for res in packed['chunks']], ['c0'])
+        self.assertTrue(packed['report']['truncated'])
+        self.assertLessEqual(packed['report']['context_tokens'], 6)
+
+    def test_zero_budget_is_unlimited(self):
+        packed = self.packer(budget=0).pack(self.results(*(words(50, f"{i}xx") for i in range(5))))
+        self.assertEqual(packed['report']['used'], 5)
+        self.assertFalse(packed['report']['truncated'])
+
+    def test_duplicate_texts_are_dropped(self):
+        results = self.results("Same  text here.", "Other text.", "Same text\nhere.")
+        packed = self.packer(budget=1000).pack(results)
+        self.assertEqual([res['id'] for res in packed['chunks']], ['c0', 'c1'])
+        self.assertEqual(packed['report']['duplicates'], 1)
+
+    def test_near_duplicate_embeddings_are_dropped(self):
+        results = self.results("First.", "Paraphrase of first.", "Unrelated.")
+        vectors = {
+            'c0': np.array([1.0, 0.0]),
+            'c1': np.array([0.99, np.sqrt(1 - 0.99 ** 2)]),
+            'c2': np.array([0.0, 1.0]),
+        }
+        packed = self.packer(budget=1000).pack(results, vectors=vectors)
+        self.assertEqual([res['id'] for res in packed['chunks']], ['c0', 'c2'])
+
+        packed = self.packer(budget=1000, dedup_threshold=1.0).pack(results, vectors=vectors)
+        self.assertEqual(len(packed['chunks']), 3)
+
+    def test_chunk_token_counts_are_cached(self):
+        packer = self.packer(budget=1000)
+        results = self.results(words(10), words(10, 'bbb'))
+        packer.pack(results)
+        packer.pack(results)
+        stats = packer.stats()
+        self.assertEqual(stats['packed'], 2)
+        self.assertEqual((stats['token_cache']['size'], stats['token_cache']['hits']), (2, 2))
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.flight = SingleFlight(enabled=True)
+        self.gate = threading.Event()
+        self.closed = threading.Event()
+        self.sources = 0
+
+    def source(self, fail=False):
+        def events():
+            self.sources += 1
+            try:
+                yield {'event': 'token', 'token': 'a'}
+                self.assertTrue(self.gate.wait(5))
+                if fail:
+                    raise RuntimeError("LLM went away")
+                yield {'event': 'token', 'token': 'b'}
+                yield {'event': 'done'}
+            finally:
+                self.closed.set()
+        return events
+
+    def test_call_runs_once_for_concurrent_callers(self):
+        started, calls, results = threading.Event(), [], []
+
+        def work():
+            calls.append(1)
+            started.set()
+            self.assertTrue(self.gate.wait(5))
+            return 'answer'
+
+        leader = threading.Thread(target=lambda: results.append(self.flight.call('k', work)))
+        leader.start()
+        self.assertTrue(started.wait(5))
+        followers = [threading.Thread(target=lambda: results.append(self.flight.call('k', work))) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        while self.flight.stats()['coalesced'] < 3:
+            time.sleep(0.001)
+        self.gate.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+        self.assertEqual((len(calls), results), (1, ['answer'] * 4))
+        self.assertEqual(self.flight.stats()['in_flight'], 0)
+        self.assertEqual(self.flight.call('k', lambda: 'fresh'), 'fresh')
+
+    def test_call_shares_errors_and_skips_none_keys(self):
+        def fail():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            self.flight.call('k', fail)
+        self.assertEqual(self.flight.call(None, lambda: 1), 1)
+        self.assertEqual(SingleFlight(enabled=False).call('k', lambda: 2), 2)
+        self.assertEqual(self.flight.stats()['leaders'], 1)
+
+    def test_stream_fans_out_and_replays_to_late_joiners(self):
+        first = self.flight.stream('k', self.source())
+        self.assertEqual(next(first)['token'], 'a')
+        second = self.flight.stream('k', self.source())
+        self.assertEqual(next(second)['token'], 'a')
+        self.gate.set()
+
+        expected = [{'event': 'token', 'token': 'b'}, {'event': 'done'}]
+        self.assertEqual(list(first), expected)
+        self.assertEqual(list(second), expected)
+        self.assertEqual(self.sources, 1)
+        self.assertEqual(self.flight.stats()['coalesced'], 1)
+
+    def test_last_client_leaving_cancels_the_source(self):
+        first = self.flight.stream('k', self.source())
+        second = self.flight.stream('k', self.source())
+        next(first)
+        next(second)
+        first.close()
+        self.assertFalse(self.closed.is_set())
+        self.assertEqual(self.flight.stats()['cancelled'], 0)
+
+        second.close()
+        self.assertEqual(self.flight.stats()['cancelled'], 1)
+        self.gate.set()
+        self.assertTrue(self.closed.wait(5))
+        self.assertEqual(self.flight.stats()['in_flight'], 0)
+        # The next caller starts over instead of joining the cancelled stream
+        self.assertEqual(len(list(self.flight.stream('k', self.source()))), 3)
+        self.assertEqual(self.sources, 2)
+
+    def test_failing_source_ends_every_stream_with_an_error(self):
+        first = self.flight.stream('k', self.source(fail=True))
+        next(first)
+        second = self.flight.stream('k', self.source())
+        next(second)
+        error = {'event': 'error', 'error': ERROR_ANSWER}
+        with self.assertLogs('rag_engine.coalesce', 'ERROR'):
+            self.gate.set()
+            self.assertEqual(list(first), [error])
+        self.assertEqual(list(second), [error])
+        self.assertEqual(self.sources, 1)
+
+    def test_async_stream_fans_out_and_cancels(self):
+        async def source():
+            self.sources += 1
+            try:
+                yield 'a'
+                await asyncio.sleep(0)
+                yield 'b'
+                await asyncio.sleep(3600)
+            finally:
+                self.closed.set()
+
+        async def consume(count):
+            events = self.flight.astream('k', source)
+            try:
+                return [await events.__anext__() for _ in range(count)]
+            finally:
+                await events.aclose()
+
+        async def main():
+            results = await asyncio.gather(consume(2), consume(2))
+            await asyncio.sleep(0)
+            return results
+
+        self.assertEqual(asyncio.run(main()), [['a', 'b'], ['a', 'b']])
+        self.assertEqual(self.sources, 1)
+        self.assertTrue(self.closed.is_set())
+        self.assertEqual(self.flight.stats()['cancelled'], 1)
+
+
+class LLMSchedulerTests(SimpleTestCase):
+    def scheduler(self, urls=('http://llm-a',), **kwargs):
+        options = {'max_concurrency': 1, 'queue_size': 8, 'deadline': 30, 'batch_deadline': 30,
+                   'cooldown': 30, 'initial_service_seconds': 1}
+        scheduler = LLMScheduler(**{**options, **kwargs})
+        scheduler.configure(list(urls))
+        return scheduler
+
+    def waiter(self, scheduler, priority, granted):
+        def wait():
+            backend = scheduler.acquire(priority)
+            granted.append(priority)
+            scheduler.release(backend, 0.0)
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        return thread
+
+    def wait_queued(self, scheduler, count):
+        while sum(scheduler.stats()['queued'].values()) < count:
+            time.sleep(0.001)
+
+    def test_full_queue_is_rejected_with_429(self):
+        scheduler = self.scheduler(queue_size=1)
+        backend = scheduler.acquire()
+        thread = self.waiter(scheduler, INTERACTIVE, [])
+        self.wait_queued(scheduler, 1)
+
+        with self.assertRaises(LLMOverloaded) as raised:
+            scheduler.check()
+        self.assertEqual((raised.exception.status, raised.exception.reason), (429, 'queue_full'))
+        self.assertEqual(scheduler.stats()['rejected']['queue_full'], 1)
+        scheduler.release(backend, 1.0)
+        thread.join(5)
+        scheduler.check()
+
+    def test_wait_estimate_over_the_deadline_is_rejected_with_503(self):
+        scheduler = self.scheduler(max_concurrency=2, deadline=15, batch_deadline=60, initial_service_seconds=10)
+        scheduler.acquire()
+        scheduler.acquire()
+        # Both slots busy: 3 more requests wait about 3 / 2 * 10s = 15s, 4 wait 20s
+        scheduler.check(count=3)
+        with self.assertRaises(LLMOverloaded) as raised:
+            scheduler.check(count=4)
+        self.assertEqual((raised.exception.status, raised.exception.reason), (503, 'deadline'))
+        self.assertEqual(raised.exception.retry_after, 20)
+        scheduler.check(BATCH, count=4)
+
+    def test_admitted_request_times_out_with_503(self):
+        scheduler = self.scheduler(deadline=0.05, initial_service_seconds=0.01)
+        scheduler.acquire()
+        with self.assertRaises(LLMOverloaded) as raised:
+            scheduler.acquire()
+        self.assertEqual(raised.exception.status, 503)
+        stats = scheduler.stats()
+        self.assertEqual((stats['rejected']['timeout'], stats['queued'][INTERACTIVE]), (1, 0))
+
+    def test_interactive_requests_go_before_batch(self):
+        scheduler = self.scheduler()
+        backend = scheduler.acquire()
+        granted = []
+        batch = [self.waiter(scheduler, BATCH, granted) for _ in range(2)]
+        self.wait_queued(scheduler, 2)
+        interactive = self.waiter(scheduler, INTERACTIVE, granted)
+        self.wait_queued(scheduler, 3)
+
+        scheduler.release(backend, 1.0)
+        for thread in [interactive] + batch:
+            thread.join(5)
+        self.assertEqual(granted, [INTERACTIVE, BATCH, BATCH])
+
+    def test_least_loaded_backend_and_failure_cooldown(self):
+        scheduler = self.scheduler(urls=('http://llm-a', 'http://llm-b'), max_concurrency=2)
+        first, second = scheduler.acquire(), scheduler.acquire()
+        self.assertNotEqual(first, second)
+        with self.assertLogs('rag_engine.scheduler', 'WARNING'):
+            scheduler.release(first, failed=True)
+        scheduler.release(second, 1.0)
+        self.assertEqual({scheduler.acquire(), scheduler.acquire()}, {second})
+
+    def test_cancelled_generation_does_not_feed_the_estimate(self):
+        scheduler = self.scheduler(initial_service_seconds=10)
+
+        def generate():
+            with scheduler.slot():
+                yield 'token'
+                yield 'token'
+
+        stream = generate()
+        next(stream)
+        stream.close()
+        stats = scheduler.stats()
+        self.assertEqual((stats['service_seconds'], stats['in_flight']), (10, 0))
+        self.assertEqual(stats['backends'][0]['failures'], 0)
+
+        list(generate())
+        self.assertLess(scheduler.stats()['service_seconds'], 10)
+        self.assertEqual(scheduler.stats()['backends'][0]['served'], 1)
+
+    def test_async_slot_releases_on_cancellation(self):
+        scheduler = self.scheduler(initial_service_seconds=10)
+
+        async def main():
+            started = asyncio.Event()
+
+            async def generate():
+                async with scheduler.aslot() as backend:
+                    started.set()
+                    await asyncio.sleep(3600)
+                    return backend
+
+            task = asyncio.create_task(generate())
+            await started.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            async with scheduler.aslot() as backend:
+                return backend
+
+        self.assertEqual(asyncio.run(main()), 'http://llm-a')
+        stats = scheduler.stats()
+        self.assertEqual((stats['in_flight'], stats['backends'][0]['served']), (0, 1))
+        self.assertLess(stats['service_seconds'], 10)
@@ -0,0 +1,205 @@
+import logging
+import os
+import time
+
+import numpy as np
+
+from vector_db.benchmarks import exact_neighbours, recall, timed
+from vector_db.index import normalize, top_k_indices
+
+logger = logging.getLogger(__name__)
+
+
+def default_nlist(size):
+    """Rule-of-thumb number of coarse lists for a corpus of `size` vectors"""
+    return max(1, min(int(4 * np.sqrt(max(size, 1))), 65536))
+
+
+def train_centroids(vectors, nlist, iterations=10, sample_size=None, seed=0):
+    """Spherical k-means over (a sample of) unit vectors"""
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    nlist = min(nlist, len(vectors))
+    if sample_size is None:
+        sample_size = 256 * nlist
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=nlist)
+
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+def assign(vectors, centroids, batch_size=65536):
+    """Nearest centroid (by inner product) for every row of `vectors`"""
+    out = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        block = vectors[start:start + batch_size]
+        out[start:start + batch_size] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index.
+
+    Vectors are partitioned by their nearest coarse centroid. A query scores
+    the centroids, then exactly scores only the vectors in the `nprobe`
+    closest lists, so cost scales with nprobe / nlist of the corpus. Raising
+    nprobe trades latency for recall; nprobe == nlist is exact search.
+
+    Each list is replaced copy-on-write on insert/remove, so searches can run
+    concurrently with incremental updates.
+    """
+
+    def __init__(self, centroids, nprobe=None):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        if nprobe is None:
+            nprobe = int(os.getenv('VECTOR_ANN_NPROBE', 8))
+        self.nprobe = nprobe
+        dim = self.centroids.shape[1]
+        self._lists = [(np.empty((0, dim), dtype=np.float32), ()) for _ in range(self.nlist)]
+        self._locations = {}
+
+    @classmethod
+    def build(cls, keys, vectors, nlist=None, nprobe=None, iterations=10):
+        """Train centroids on `vectors` and add them all"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if nlist is None:
+            nlist = default_nlist(len(vectors))
+        start = time.time()
+        index = cls(train_centroids(vectors, nlist, iterations=iterations), nprobe=nprobe)
+        index.add(keys, vectors, normalized=True)
+        logger.info(f"Built IVF index: {len(vectors)} vectors, nlist={index.nlist} in {time.time() - start:.2f}s")
+        return index
+
+    @property
+    def nlist(self):
+        return self.centroids.shape[0]
+
+    @property
+    def dimension(self):
+        return self.centroids.shape[1]
+
+    def __len__(self):
+        return len(self._locations)
+
+    def add(self, keys, vectors, normalized=False):
+        """Insert or replace vectors; they are assigned to existing centroids"""
+        keys = list(keys)
+        if not keys:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(keys), -1)
+        if not normalized:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+
+        self.remove([key for key in keys if key in self._locations])
+        assignment = assign(vectors, self.centroids)
+        for list_no in np.unique(assignment):
+            members = np.flatnonzero(assignment == list_no)
+            old_vectors, old_keys = self._lists[list_no]
+            new_keys = old_keys + tuple(keys[i] for i in members)
+            self._lists[list_no] = (np.vstack([old_vectors, vectors[members]]), new_keys)
+            for key in new_keys[len(old_keys):]:
+                self._locations[key] = list_no
+
+    def remove(self, keys):
+        """Drop vectors by key; unknown keys are ignored"""
+        by_list = {}
+        for key in keys:
+            list_no = self._locations.pop(key, None)
+            if list_no is not None:
+                by_list.setdefault(list_no, set()).add(key)
+
+        for list_no, dropped in by_list.items():
+            old_vectors, old_keys = self._lists[list_no]
+            keep = [i for i, key in enumerate(old_keys) if key not in dropped]
+            self._lists[list_no] = (old_vectors[keep], tuple(old_keys[i] for i in keep))
+
+    def search(self, query_embedding, top_k=5, nprobe=None):
+        """Return (keys, scores) of the approximate top_k neighbours"""
+        query = normalize(query_embedding)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probes = top_k_indices(self.centroids @ query, nprobe)
+
+        lists = [self._lists[list_no] for list_no in probes]
+        keys = [key for _, list_keys in lists for key in list_keys]
+        if not keys:
+            return [], np.empty(0, dtype=np.float32)
+        scores = np.concatenate([vectors @ query for vectors, _ in lists])
+        best = top_k_indices(scores, top_k)
+        return [keys[i] for i in best], scores[best]
+
+    def save(self, path):
+        """Persist centroids and inverted lists to an .npz file"""
+        vectors = [vectors for vectors, _ in self._lists]
+        keys = [key for _, list_keys in self._lists for key in list_keys]
+        offsets = np.cumsum([0] + [len(list_keys) for _, list_keys in self._lists])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                vectors=np.vstack(vectors),
+                offsets=offsets,
+                keys=np.array(keys, dtype=object),
+                nprobe=self.nprobe,
+            )
+        os.replace(tmp_path, path)
+        logger.info(f"Saved IVF index to {path}")
+
+    @classmethod
+    def load(cls, path, nprobe=None, with_lists=True):
+        """Load an index saved by `save`; with_lists=False restores centroids only"""
+        data = np.load(path, allow_pickle=True)
+        index = cls(data['centroids'], nprobe=nprobe or int(data['nprobe']))
+        if with_lists:
+            vectors, offsets, keys = data['vectors'], data['offsets'], data['keys'].tolist()
+            for list_no in range(index.nlist):
+                start, end = offsets[list_no], offsets[list_no + 1]
+                index._lists[list_no] = (vectors[start:end], tuple(keys[start:end]))
+                for key in keys[start:end]:
+                    index._locations[key] = list_no
+        return index
+
+
+def evaluate_recall(matrix, index, queries, top_k=10, nprobes=(1, 2, 4, 8, 16, 32)):
+    """
+    Compare an IVF index against exact search over `matrix`.
+
+    `matrix` must hold the same unit vectors as the index, with the index
+    keys being row numbers. Returns one dict per nprobe with recall@k and
+    per-query latency in milliseconds.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    truth, exact_ms = timed(exact_neighbours, matrix, queries, top_k)
+    exact_ms /= len(queries)
+
+    report = []
+    for nprobe in nprobes:
+        if nprobe > index.nlist:
+            break
+        latencies, results = [], []
+        for query in queries:
+            (keys, _), elapsed = timed(index.search, query, top_k=top_k, nprobe=nprobe)
+            latencies.append(elapsed)
+            results.append(keys)
+        report.append({
+            'nprobe': nprobe,
+            'recall': recall(truth, results),
+            'mean_ms': float(np.mean(latencies)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'exact_ms': exact_ms,
+        })
+    return report
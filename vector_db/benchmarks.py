@@ -0,0 +1,155 @@
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from vector_db.index import normalize, top_k_indices
+from vector_db.quantization import encode_embedding
+
+
+def synthetic_corpus(size, dimension, clusters=None, seed=0, block_size=65536):
+    """
+    Unit vectors drawn around random cluster centres, which resembles the
+    neighbourhood structure of real sentence embeddings better than
+    isotropic noise does. Generated in float32 blocks, so multi-million
+    corpora only need the memory of the result.
+    """
+    rng = np.random.default_rng(seed)
+    clusters = clusters or max(1, int(np.sqrt(size)))
+    centres = rng.standard_normal((clusters, dimension), dtype=np.float32)
+    matrix = np.empty((size, dimension), dtype=np.float32)
+    for start in range(0, size, block_size):
+        end = min(start + block_size, size)
+        block = centres[rng.integers(clusters, size=end - start)]
+        block += rng.standard_normal((end - start, dimension), dtype=np.float32) * 0.5
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        matrix[start:end] = block
+    return matrix
+
+
+def sample_queries(matrix, count, noise=0.05, seed=0):
+    """Perturbed copies of random corpus rows, so every query has true neighbours"""
+    rng = np.random.default_rng(seed)
+    sample = matrix[rng.choice(len(matrix), min(count, len(matrix)), replace=False)]
+    return sample + rng.normal(scale=noise, size=sample.shape).astype(np.float32)
+
+
+def exact_neighbours(matrix, queries, top_k):
+    """Ground-truth top_k row sets for each query"""
+    return [set(top_k_indices(matrix @ normalize(query), top_k).tolist()) for query in queries]
+
+
+def recall(truth, results):
+    """Mean fraction of the true neighbours found in each result list"""
+    hits = sum(len(expected.intersection(found)) for expected, found in zip(truth, results))
+    return hits / max(sum(len(expected) for expected in truth), 1)
+
+
+def timed(func, *args, **kwargs):
+    """Run `func` and return (result, elapsed milliseconds)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def latency_stats(samples_ms):
+    """Mean and percentiles of latency samples in milliseconds"""
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    if not len(samples):
+        return {'mean_ms': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {'mean_ms': float(samples.mean()), 'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99)}
+
+
+def resident_memory():
+    """Current resident set size of this process in bytes (0 where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def synthetic_documents(matrix, sources=100, texts=True):
+    """document_chunks-shaped documents for the rows of `matrix`"""
+    updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    for i, vector in enumerate(matrix):
+        yield {
+            '_id': f"synthetic-{i}",
+            'text': f"Synthetic chunk {i} of source {i % sources}." if texts else '',
+            'embedding': encode_embedding(vector),
+            'metadata': {'source': f"source-{i % sources}.txt", 'chunk_index': i // sources},
+            'updated_at': updated_at,
+        }
+
+
+class InMemoryCollection:
+    """
+    Stand-in for the `document_chunks` pymongo collection, holding documents
+    in a dict. It supports only the queries the vector and lexical indexes
+    and MongoDBManager issue: equality, $in, $gte and $exists on top-level
+    or dotted fields, with inclusion projections. Used by the benchmarks to
+    exercise the real load and search paths without a MongoDB server.
+    """
+
+    name = 'document_chunks'
+
+    def __init__(self, documents=()):
+        self.documents = {}
+        self.insert_many(documents)
+
+    def insert_many(self, documents):
+        for doc in documents:
+            self.documents[doc['_id']] = doc
+
+    def find(self, query=None, projection=None, batch_size=None):
+        if query and set(query) == {'_id'} and isinstance(query['_id'], dict) and set(query['_id']) == {'$in'}:
+            docs = (self.documents[doc_id] for doc_id in query['_id']['$in'] if doc_id in self.documents)
+        else:
+            docs = (doc for doc in self.documents.values() if self._matches(doc, query or {}))
+        for doc in docs:
+            yield self._project(doc, projection)
+
+    def find_one(self, query=None, projection=None):
+        return next(self.find(query, projection), None)
+
+    def count_documents(self, query):
+        return sum(1 for _ in self.find(query, {'_id': 1}))
+
+    def estimated_document_count(self):
+        return len(self.documents)
+
+    @staticmethod
+    def _value(doc, field):
+        for part in field.split('.'):
+            if not isinstance(doc, dict):
+                return None
+            doc = doc.get(part)
+        return doc
+
+    def _matches(self, doc, query):
+        for field, condition in query.items():
+            value = self._value(doc, field)
+            values = value if isinstance(value, list) else [value]
+            if not isinstance(condition, dict):
+                if condition not in values:
+                    return False
+                continue
+            for op, argument in condition.items():
+                if op == '$in' and not any(v in argument for v in values):
+                    return False
+                if op == '$gte' and (value is None or value < argument):
+                    return False
+                if op == '$exists' and (value is not None) != argument:
+                    return False
+        return True
+
+    @staticmethod
+    def _project(doc, projection):
+        if not projection:
+            return dict(doc)
+        fields = [field for field, include in projection.items() if include]
+        projected = {'_id': doc['_id']}
+        projected.update((field, doc[field]) for field in fields if field in doc)
+        return projected
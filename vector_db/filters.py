@@ -0,0 +1,128 @@
+FILTER_VALUE_TYPES = (str, int, float, bool)
+
+
+def normalize_filters(filters):
+    """
+    Validate a metadata filter and return its canonical form, or None.
+
+    A filter maps metadata field names to a value or a list of values. A
+    chunk matches when, for every field, its value (or one element of a list
+    value) equals one of the given values.
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("filters must map metadata fields to values")
+
+    canonical = {}
+    for field, values in filters.items():
+        if not isinstance(field, str) or not field or field.startswith('$') or '.' in field:
+            raise ValueError(f"Invalid metadata filter field {field!r}")
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        if not values:
+            raise ValueError(f"Filter on '{field}' has no values")
+        for value in values:
+            if not isinstance(value, FILTER_VALUE_TYPES):
+                raise ValueError(f"Filter values for '{field}' must be strings, numbers or booleans")
+        canonical[field] = tuple(sorted(set(values), key=repr))
+    return dict(sorted(canonical.items()))
+
+
+def filters_key(filters):
+    """Hashable form of a canonical filter, for cache keys"""
+    return tuple(filters.items()) if filters else None
+
+
+def to_mongo(filters):
+    """MongoDB query selecting the chunks that match a canonical filter"""
+    query = {}
+    for field, values in (filters or {}).items():
+        query[f'metadata.{field}'] = values[0] if len(values) == 1 else {'$in': list(values)}
+    return query
+
+
+def _field_values(metadata, field):
+    value = (metadata or {}).get(field)
+    values = value if isinstance(value, list) else [value]
+    return [value for value in values if isinstance(value, FILTER_VALUE_TYPES)]
+
+
+def matches(metadata, filters):
+    """True when chunk metadata satisfies a canonical filter"""
+    return all(
+        any(value in allowed for value in _field_values(metadata, field))
+        for field, allowed in (filters or {}).items()
+    )
+
+
+class MetadataIndex:
+    """
+    Posting lists from metadata (field, value) to chunk ids.
+
+    A field's postings are built the first time a filter uses it, then
+    kept up to date through `update`. Changes are buffered and applied
+    copy-on-write by `publish`, which returns a new read-only view, so
+    searches holding an older view are never affected by a refresh.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self._pending = {}
+
+    def build(self, field, entries):
+        """Index `field` over (id, metadata) pairs and return the new view"""
+        postings = {}
+        for doc_id, metadata in entries:
+            for value in _field_values(metadata, field):
+                postings.setdefault(value, set()).add(doc_id)
+        self.fields = {**self.fields, field: {value: frozenset(ids) for value, ids in postings.items()}}
+        return self.fields
+
+    def update(self, doc_id, old_metadata, new_metadata):
+        """Record that a chunk's metadata changed (None for an insert or delete)"""
+        for field in self.fields:
+            old = set(_field_values(old_metadata, field)) if old_metadata is not None else set()
+            new = set(_field_values(new_metadata, field)) if new_metadata is not None else set()
+            if old == new:
+                continue
+            pending = self._pending.setdefault(field, {})
+            for value in old - new:
+                pending.setdefault(value, {})[doc_id] = False
+            for value in new - old:
+                pending.setdefault(value, {})[doc_id] = True
+
+    def publish(self):
+        """Apply buffered changes and return the current view"""
+        if not self._pending:
+            return self.fields
+        fields = dict(self.fields)
+        for field, changes in self._pending.items():
+            postings = dict(fields[field])
+            for value, changed in changes.items():
+                ids = set(postings.get(value, ()))
+                ids.update(doc_id for doc_id, present in changed.items() if present)
+                ids.difference_update(doc_id for doc_id, present in changed.items() if not present)
+                if ids:
+                    postings[value] = frozenset(ids)
+                else:
+                    postings.pop(value, None)
+            fields[field] = postings
+        self.fields = fields
+        self._pending = {}
+        return fields
+
+    @staticmethod
+    def candidates(view, filters):
+        """Ids matching a canonical filter, smallest field first"""
+        sets = []
+        for field, values in filters.items():
+            postings = view[field]
+            sets.append(set().union(*(postings.get(value, ()) for value in values)))
+        sets.sort(key=len)
+        result = sets[0]
+        for other in sets[1:]:
+            result = result & other
+            if not result:
+                break
+        return result
@@ -0,0 +1,810 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from vector_db import snapshot as snapshots
+from vector_db.filters import MetadataIndex
+from vector_db.quantization import decode_embedding
+
+logger = logging.getLogger(__name__)
+
+PROJECTION = {'embedding': 1, 'metadata': 1, 'updated_at': 1, 'embedding_model': 1}
+
+
+class EmbeddingModelChanged(Exception):
+    """The collection now holds vectors from a different embedding model"""
+
+
+def normalize(vector):
+    """Return a float32 unit vector (zero vectors are left as zeros)"""
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def top_k_indices(scores, top_k):
+    """Indices of the top_k highest scores, best first"""
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < len(scores):
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def batch_top_k(size, block_scores, num_queries, top_k, block_size=65536):
+    """
+    Row-blocked top_k for many queries at once.
+
+    `block_scores(start, end)` returns the (end - start, num_queries) score
+    matrix of rows start..end; only one block is materialized at a time and
+    a running top_k per query is merged after each block. Returns
+    (rows, scores), both (num_queries, <=top_k), best first.
+    """
+    best_rows = np.empty((num_queries, 0), dtype=np.int64)
+    best_scores = np.empty((num_queries, 0), dtype=np.float32)
+    for start in range(0, size, block_size):
+        end = min(size, start + block_size)
+        scores = np.ascontiguousarray(block_scores(start, end).T)
+        rows = np.broadcast_to(np.arange(start, end), scores.shape)
+        scores = np.hstack([best_scores, scores])
+        rows = np.hstack([best_rows, rows])
+        if scores.shape[1] > top_k:
+            keep = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            scores = np.take_along_axis(scores, keep, axis=1)
+            rows = np.take_along_axis(rows, keep, axis=1)
+        best_scores, best_rows = scores, rows
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class _IndexState:
+    """
+    View of the index published to concurrent readers.
+
+    The index keeps writing to the arrays it shares with the view, but never
+    to anything a reader of the view can see: appended delta rows land beyond
+    `size`, an overwritten delta row first copies the matrix and metadata
+    (copy on write, once per publish), deletions compact into fresh storage
+    and `base_live` is copied before a row is masked.
+    """
+
+    __slots__ = ('matrix', 'ids', 'metadata', 'rows', 'size', 'ann', 'base', 'base_live', 'count', 'postings',
+                 'shard_plan')
+
+    def __init__(self, matrix, ids, metadata, rows, size, ann=None, base=None, base_live=None, count=None,
+                 postings=None, shard_plan=None):
+        self.matrix = matrix
+        self.ids = ids
+        self.metadata = metadata
+        self.rows = rows
+        self.size = size
+        self.ann = ann
+        self.base = base
+        self.base_live = base_live
+        self.count = size if count is None else count
+        self.postings = postings or {}
+        self.shard_plan = shard_plan
+
+
+class VectorIndex:
+    """
+    Resident cosine-similarity index over the `document_chunks` collection.
+
+    Embeddings are held as one pre-normalized, contiguous float32 matrix with
+    a parallel id/metadata table, so a query is a single matrix-vector product
+    followed by argpartition. The index is loaded once and then refreshed
+    incrementally: documents whose `updated_at` is newer than the last seen
+    watermark are re-read, and a count mismatch triggers an id-only
+    reconciliation to pick up deletions and untimestamped inserts.
+
+    When `snapshot_dir` (VECTOR_SNAPSHOT_DIR) holds a published snapshot, it
+    is memory-mapped as a read-only base segment instead of reading the
+    collection. Changes made after the export land in the in-memory delta and
+    mask the stale base rows. A newly published snapshot is swapped in on the
+    next refresh; searches already running keep the old mapping. A snapshot
+    stored at reduced precision (float16/int8/binary) yields approximate
+    scores, so callers should over-fetch and rescore (see `quantized`).
+
+    A large snapshot base can be searched in parallel by a process pool
+    (VECTOR_SHARDS, see vector_db.shards) while the delta is scored here.
+
+    With backend='ivf' an IVFIndex is kept in sync with the matrix and
+    answers searches approximately (see vector_db.ann). Its centroids are
+    trained once per embedding model and reused by later reloads. With
+    VECTOR_ANN_PATH they are also saved for restarted workers, and the saved
+    index is rewritten every VECTOR_ANN_SAVE_EVERY incremental changes.
+
+    Searches can be restricted by a metadata filter (see vector_db.filters).
+    Posting lists for a filtered field are built on first use and maintained
+    with every refresh, so only the matching rows are gathered and scored.
+
+    Chunks tagged with an `embedding_model` different from the one already
+    indexed (e.g. after a re-embedding cutover, see vector_db.reembed), or
+    with a different dimension, trigger a full reload instead of being mixed
+    into the matrix. The stored model tag is checked on every refresh, so a
+    cutover is noticed even when it kept the dimension and the chunk
+    timestamps, and a snapshot whose manifest names another model than the
+    collection's is ignored until a new one is exported. Chunks the reload
+    still cannot index (no embedding, or
+    a minority model) are remembered as skipped, so they neither trigger
+    another reload nor a reconciliation on every refresh.
+    """
+
+    def __init__(self, collection, refresh_interval=None, backend=None, snapshot_dir=None, shards=None):
+        self.collection = collection
+        if refresh_interval is None:
+            refresh_interval = float(os.getenv('VECTOR_INDEX_REFRESH_SECONDS', 30))
+        self.refresh_interval = refresh_interval
+        self.backend = backend or os.getenv('VECTOR_INDEX_BACKEND', 'flat')
+        self.snapshot_dir = snapshot_dir or os.getenv('VECTOR_SNAPSHOT_DIR')
+        if shards is None:
+            from vector_db.shards import shard_pool
+
+            shards = shard_pool
+        self.shards = shards if shards.enabled else None
+        self.ann = None
+        self.ann_path = os.getenv('VECTOR_ANN_PATH')
+        self.ann_save_every = int(os.getenv('VECTOR_ANN_SAVE_EVERY', 1000))
+        # (embedding model, centroids) of the last IVF build, kept across reloads
+        self._ann_centroids = None
+        self._ann_unsaved = 0
+        self.version = 0
+        self.embedding_model = None
+        self._rejected_snapshot = None
+
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._last_refresh = 0.0
+        self._reset()
+        self._state = _IndexState(np.empty((0, 0), dtype=np.float32), [], [], {}, 0)
+
+    def __len__(self):
+        return self._state.count
+
+    @property
+    def dimension(self):
+        if self._matrix is not None:
+            return self._matrix.shape[1]
+        return self._base.dimension if self._base is not None else None
+
+    @property
+    def quantized(self):
+        """
+        True when scores come from lossy codes and should be rescored. Searches
+        then return the candidates of both segments (see `_candidates`).
+        """
+        base = self._state.base
+        return base is not None and not base.codec.exact
+
+    def ensure_fresh(self):
+        """Load on first use, then refresh at most once per refresh_interval"""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+            return
+        if time.monotonic() - self._last_refresh >= self.refresh_interval:
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._refresh()
+                finally:
+                    self._lock.release()
+
+    def snapshot(self):
+        """Current (ids, unit-vector matrix) of live rows as seen by searches"""
+        return self._live_entries(self._state)
+
+    def reload(self):
+        """Drop the resident data and load again (from the snapshot if configured)"""
+        with self._lock:
+            self._load()
+
+    def load_matrix(self, ids, matrix, metadata=None, block_size=65536):
+        """
+        Load vectors directly instead of reading the collection (benchmarks
+        and tools). Rows are copied and normalized; later refreshes follow
+        the collection as usual.
+        """
+        with self._lock:
+            self._reset()
+            self._ids = list(ids)
+            if len(self._ids):
+                self._matrix = np.array(matrix, dtype=np.float32)
+                for start in range(0, len(self._matrix), block_size):
+                    block = self._matrix[start:start + block_size]
+                    norms = np.linalg.norm(block, axis=1, keepdims=True)
+                    block /= np.where(norms > 0, norms, 1)
+            self._metadata = list(metadata) if metadata is not None else [{} for _ in self._ids]
+            self._rows = {doc_id: row for row, doc_id in enumerate(self._ids)}
+            self._size = len(self._ids)
+            self._loaded = True
+            self._last_refresh = time.monotonic()
+            self.version += 1
+            self._publish()
+
+    def search(self, query_embedding, top_k=5, nprobe=None, filters=None):
+        """
+        Return [(id, metadata, score)] for the top_k most similar chunks
+        matching `filters` (up to 2 * top_k candidates on a quantized base)
+        """
+        state = self._state
+        if state.count == 0:
+            return []
+        if filters:
+            return self.search_batch([query_embedding], top_k=top_k, filters=filters)[0]
+        query = normalize(query_embedding)
+        dimension = state.matrix.shape[1] if state.size else state.base.dimension
+        if query.shape[0] != dimension:
+            raise ValueError(
+                f"Query dimension {query.shape[0]} does not match "
+                f"index dimension {dimension}"
+            )
+        if state.ann is not None:
+            keys, scores = state.ann.search(query, top_k=top_k, nprobe=nprobe)
+            hits = []
+            for key, score in zip(keys, scores):
+                metadata = self._metadata_of(state, key)
+                if metadata is not None:
+                    hits.append((key, metadata, float(score)))
+            return hits
+        if state.shard_plan is not None:
+            return self.search_batch([query], top_k=top_k)[0]
+
+        hits = []
+        if state.base is not None:
+            scores = state.base.scores(query)
+            if state.base_live is not None:
+                scores = np.where(state.base_live, scores, -np.inf)
+            hits.extend(
+                (state.base.ids[i], state.base.metadata[i], float(scores[i]))
+                for i in top_k_indices(scores, top_k) if np.isfinite(scores[i])
+            )
+        if state.size:
+            scores = state.matrix[:state.size] @ query
+            hits.extend(
+                (state.ids[i], state.metadata[i], float(scores[i]))
+                for i in top_k_indices(scores, top_k)
+            )
+        if state.base is None:
+            return hits
+        return self._candidates(state, hits, top_k)
+
+    def search_batch(self, query_embeddings, top_k=5, nprobe=None, filters=None):
+        """
+        `search` for many queries: one blocked matrix-matrix product per
+        segment with a top_k per query. Returns one hit list per query.
+        """
+        state = self._state
+        queries = np.vstack([normalize(query) for query in query_embeddings])
+        if state.count == 0:
+            return [[] for _ in queries]
+        if filters:
+            return self._search_filtered(queries, top_k, filters)
+        if state.ann is not None:
+            return [self.search(query, top_k=top_k, nprobe=nprobe) for query in queries]
+
+        hits = [[] for _ in queries]
+        sharded = None
+        if state.shard_plan is not None:
+            try:
+                sharded = self.shards.submit(state.shard_plan, queries, top_k)
+            except Exception as e:
+                logger.warning(f"Searching the snapshot in-process, shard pool unavailable: {str(e)}")
+        if state.size:
+            rows, scores = batch_top_k(
+                state.size, lambda start, end: state.matrix[start:end] @ queries.T, len(queries), top_k
+            )
+            for q in range(len(queries)):
+                hits[q].extend(
+                    (state.ids[i], state.metadata[i], float(score)) for i, score in zip(rows[q], scores[q])
+                )
+        if state.base is not None:
+            base = state.base
+            rows = None
+            if sharded is not None:
+                # The shards ran while the delta was scored above
+                try:
+                    rows, scores = sharded.result()
+                except Exception as e:
+                    logger.warning(f"Shard search failed, searching the snapshot in-process: {str(e)}")
+            if rows is None:
+                rows, scores = self._base_top_k(state, queries, top_k)
+            for q in range(len(queries)):
+                hits[q].extend(
+                    (base.ids[i], base.metadata[i], float(score))
+                    for i, score in zip(rows[q], scores[q]) if np.isfinite(score)
+                )
+        return [self._candidates(state, q_hits, top_k) for q_hits in hits]
+
+    @staticmethod
+    def _candidates(state, hits, top_k):
+        """
+        Hits of both segments, best first. Scores of a lossy base are not
+        comparable with the exact delta scores, so on a quantized base the
+        top_k of each segment is kept for the caller to rescore together
+        rather than merged into one top_k here.
+        """
+        hits.sort(key=lambda hit: -hit[2])
+        if state.base is not None and not state.base.codec.exact:
+            return hits
+        return hits[:top_k]
+
+    @staticmethod
+    def _base_top_k(state, queries, top_k):
+        """Blocked top_k over the live snapshot rows in this process"""
+        base = state.base
+
+        def base_scores(start, end):
+            scores = base.codec.score_block(base.matrix[start:end], queries)
+            if state.base_live is not None:
+                scores[~state.base_live[start:end]] = -np.inf
+            return scores
+
+        return batch_top_k(len(base), base_scores, len(queries), top_k)
+
+    def score_ids(self, doc_ids, query_embedding, filters=None):
+        """Return [(id, metadata, score)] for the given live chunks, e.g. lexical candidates"""
+        state = self._state
+        query = normalize(query_embedding)
+        if filters:
+            state = self._with_postings(filters)
+            allowed = MetadataIndex.candidates(state.postings, filters)
+            doc_ids = [doc_id for doc_id in doc_ids if doc_id in allowed]
+
+        base_hits, delta_hits = self._locate(state, doc_ids)
+        hits = []
+        if delta_hits:
+            scores = state.matrix[[row for _, row in delta_hits]] @ query
+            hits.extend((doc_id, state.metadata[row], float(score)) for (doc_id, row), score in zip(delta_hits, scores))
+        if base_hits:
+            base = state.base
+            scores = base.codec.score_block(base.matrix[[row for _, row in base_hits]], query[None])[:, 0]
+            hits.extend((doc_id, base.metadata[row], float(score)) for (doc_id, row), score in zip(base_hits, scores))
+        return hits
+
+    def vectors(self, doc_ids):
+        """Return {id: unit vector} for the given live chunks (decoded approximately from a lossy snapshot)"""
+        state = self._state
+        base_hits, delta_hits = self._locate(state, doc_ids)
+        vectors = {}
+        if delta_hits:
+            matrix = state.matrix[[row for _, row in delta_hits]]
+            vectors.update((doc_id, matrix[i]) for i, (doc_id, _) in enumerate(delta_hits))
+        if base_hits:
+            matrix = state.base.codec.decode(state.base.matrix[[row for _, row in base_hits]])
+            vectors.update((doc_id, normalize(matrix[i])) for i, (doc_id, _) in enumerate(base_hits))
+        return vectors
+
+    @staticmethod
+    def _locate(state, doc_ids):
+        """(base hits, delta hits) as (id, row) pairs for the live chunks among `doc_ids`"""
+        base_hits, delta_hits = [], []
+        for doc_id in doc_ids:
+            row = state.rows.get(doc_id)
+            if row is not None and row < state.size:
+                delta_hits.append((doc_id, row))
+            elif state.base is not None:
+                row = state.base.row_of(doc_id)
+                if row is not None and (state.base_live is None or state.base_live[row]):
+                    base_hits.append((doc_id, row))
+        return base_hits, delta_hits
+
+    def _search_filtered(self, queries, top_k, filters):
+        """Exact search over only the rows whose metadata matches `filters`"""
+        state = self._with_postings(filters)
+        base_rows, delta_rows = self._filtered_rows(state, filters)
+
+        hits = [[] for _ in queries]
+        if len(base_rows):
+            base = state.base
+            scores = base.codec.score_block(base.matrix[base_rows], queries)
+            for q in range(len(queries)):
+                hits[q].extend(
+                    (base.ids[base_rows[i]], base.metadata[base_rows[i]], float(scores[i, q]))
+                    for i in top_k_indices(scores[:, q], top_k)
+                )
+        if len(delta_rows):
+            scores = state.matrix[delta_rows] @ queries.T
+            for q in range(len(queries)):
+                hits[q].extend(
+                    (state.ids[delta_rows[i]], state.metadata[delta_rows[i]], float(scores[i, q]))
+                    for i in top_k_indices(scores[:, q], top_k)
+                )
+        return [self._candidates(state, q_hits, top_k) for q_hits in hits]
+
+    def _with_postings(self, filters):
+        """Published state with posting lists for every filtered field, building missing ones"""
+        state = self._state
+        missing = [field for field in filters if field not in state.postings]
+        if not missing:
+            return state
+        with self._lock:
+            for field in missing:
+                if field not in self._filter_index.fields:
+                    start = time.time()
+                    self._filter_index.build(field, self._live_metadata())
+                    logger.info(f"Built metadata postings for '{field}' in {time.time() - start:.2f}s")
+            self._publish()
+            return self._state
+
+    def _live_metadata(self):
+        """(id, metadata) of every live chunk; call with the lock held"""
+        if self._base is not None:
+            for row in range(len(self._base)):
+                if self._is_base_live(row):
+                    yield self._base.ids[row], self._base.metadata[row]
+        for row in range(self._size):
+            yield self._ids[row], self._metadata[row]
+
+    @staticmethod
+    def _filtered_rows(state, filters):
+        """Sorted (base rows, delta rows) of live chunks matching `filters`"""
+        base_rows, delta_rows = [], []
+        for doc_id in MetadataIndex.candidates(state.postings, filters):
+            row = state.rows.get(doc_id)
+            if row is not None and row < state.size:
+                delta_rows.append(row)
+                continue
+            if state.base is not None:
+                row = state.base.row_of(doc_id)
+                if row is not None and (state.base_live is None or state.base_live[row]):
+                    base_rows.append(row)
+        return np.sort(np.array(base_rows, dtype=np.int64)), np.sort(np.array(delta_rows, dtype=np.int64))
+
+    def _reset(self):
+        self._matrix = None
+        self._ids, self._metadata, self._rows = [], [], {}
+        self._size = 0
+        self._base = None
+        self._base_live = None
+        self._base_live_shared = False
+        self._delta_shared = False
+        self._watermark = None
+        self._skipped = set()
+        self.embedding_model = None
+        self._filter_index = MetadataIndex()
+        self.ann = None
+        self._ann_added, self._ann_removed = {}, set()
+
+    def _load(self):
+        start = time.time()
+        self._reset()
+
+        base = snapshots.open_current(self.snapshot_dir) if self.snapshot_dir else None
+        if base is not None and base.version != self._rejected_snapshot:
+            try:
+                self._base = base
+                self._watermark = base.watermark
+                self.embedding_model = base.embedding_model
+                self._catch_up()
+                source = f"snapshot {base.version}"
+            except EmbeddingModelChanged as e:
+                # The snapshot predates a re-embedding; ignore it until a new one is exported
+                logger.warning(f"Ignoring snapshot {base.version}: {str(e)}")
+                self._rejected_snapshot = base.version
+                base = None
+                self._reset()
+        else:
+            base = None
+        if base is None:
+            for doc in self.collection.find({}, PROJECTION):
+                self._upsert(doc, strict=False)
+            source = "collection"
+
+        self._loaded = True
+        self._last_refresh = time.monotonic()
+        self.version += 1
+        self._publish()
+        logger.info(f"Loaded vector index from {source}: {len(self)} chunks in {time.time() - start:.2f}s")
+
+    def _refresh(self):
+        if self.snapshot_dir:
+            version = snapshots.current_version(self.snapshot_dir)
+            if version is not None and version != self._rejected_snapshot and (
+                    self._base is None or version != self._base.version):
+                self._load()
+                return
+
+        try:
+            changed = self._catch_up()
+        except EmbeddingModelChanged as e:
+            logger.info(f"Reloading vector index: {str(e)}")
+            self._load()
+            return
+        self._last_refresh = time.monotonic()
+        if changed:
+            self.version += 1
+            self._publish()
+            logger.info(f"Vector index refreshed: {changed} changes, {len(self)} chunks")
+
+    def _catch_up(self):
+        """Apply changes made since the watermark; returns the number applied"""
+        corpus_model = self._corpus_model()
+        if corpus_model is not None and self.embedding_model is not None and corpus_model != self.embedding_model:
+            # A cutover replaces every chunk, whether or not it was rewritten after the watermark
+            raise EmbeddingModelChanged(f"collection embedded with {corpus_model}, index has {self.embedding_model}")
+        changed = 0
+        if self._watermark is not None:
+            cursor = self.collection.find({'updated_at': {'$gte': self._watermark}}, PROJECTION)
+            for doc in cursor:
+                changed += self._upsert(doc)
+
+        if self.collection.estimated_document_count() != self._live_count() + len(self._skipped):
+            changed += self._reconcile()
+        return changed
+
+    def _corpus_model(self):
+        """Model tag of the stored chunks (None if untagged)"""
+        doc = self.collection.find_one({'embedding_model': {'$exists': True}}, {'embedding_model': 1})
+        return doc['embedding_model'] if doc else None
+
+    def _live_count(self):
+        if self._base is None:
+            return self._size
+        dead = 0 if self._base_live is None else len(self._base) - int(self._base_live.sum())
+        return len(self._base) - dead + self._size
+
+    def _reconcile(self):
+        """Sync the id set with the collection without reading embeddings"""
+        live_ids = {doc['_id'] for doc in self.collection.find({}, {'_id': 1})}
+        indexed = set(self._rows)
+        if self._base is not None:
+            indexed.update(
+                doc_id for row, doc_id in enumerate(self._base.ids) if self._is_base_live(row)
+            )
+        removed = [doc_id for doc_id in indexed if doc_id not in live_ids]
+        added = [doc_id for doc_id in live_ids if doc_id not in indexed and doc_id not in self._skipped]
+        self._skipped &= live_ids
+
+        self._delete(removed)
+        for doc in self.collection.find({'_id': {'$in': added}}, PROJECTION) if added else []:
+            self._upsert(doc)
+        return len(removed) + len(added)
+
+    def _is_base_live(self, row):
+        return self._base_live is None or bool(self._base_live[row])
+
+    def _kill_base_row(self, row):
+        """Mask a base row; the mask is copied once per publish for readers"""
+        if self._base_live is None:
+            self._base_live = np.ones(len(self._base), dtype=bool)
+        elif self._base_live_shared:
+            self._base_live = self._base_live.copy()
+        self._base_live_shared = False
+        self._base_live[row] = False
+
+    def _upsert(self, doc, strict=True):
+        """
+        Apply one document; with strict, a model or dimension change raises
+        EmbeddingModelChanged unless the chunk was already skipped for it.
+        """
+        embedding = doc.get('embedding')
+        if embedding is None:
+            self._skip(doc['_id'])
+            return 0
+        vector = normalize(decode_embedding(embedding))
+
+        model = doc.get('embedding_model')
+        if model is not None and self.embedding_model is not None and model != self.embedding_model:
+            return self._skip(doc['_id'], strict, f"embedded with {model}, index has {self.embedding_model}")
+        dimension = self.dimension
+        if dimension is not None and vector.shape[0] != dimension:
+            return self._skip(doc['_id'], strict, f"has dimension {vector.shape[0]}, index has {dimension}")
+        self._skipped.discard(doc['_id'])
+        if model is not None and self.embedding_model is None:
+            self.embedding_model = model
+        if self._matrix is None:
+            self._matrix = np.zeros((1024, vector.shape[0]), dtype=np.float32)
+
+        updated_at = doc.get('updated_at')
+        if updated_at is not None and (self._watermark is None or updated_at > self._watermark):
+            self._watermark = updated_at
+
+        metadata = doc.get('metadata', {})
+        row = self._rows.get(doc['_id'])
+        if row is not None and np.array_equal(self._matrix[row], vector) and self._metadata[row] == metadata:
+            # Re-read at the watermark boundary without any change
+            return 0
+
+        old_metadata = self._metadata[row] if row is not None else None
+        if row is None and self._base is not None:
+            base_row = self._base.row_of(doc['_id'])
+            if base_row is not None and self._is_base_live(base_row):
+                tolerance = self._base.codec.tolerance
+                if tolerance is not None and self._base.metadata[base_row] == metadata and np.allclose(
+                        self._base.vectors([base_row])[0], vector, atol=tolerance):
+                    return 0
+                if self._filter_index.fields:
+                    old_metadata = self._base.metadata[base_row]
+                self._kill_base_row(base_row)
+        self._filter_index.update(doc['_id'], old_metadata, metadata)
+
+        if self.ann is not None:
+            self._ann_added[doc['_id']] = vector
+            self._ann_removed.discard(doc['_id'])
+
+        if row is not None:
+            self._own_delta()
+            self._matrix[row] = vector
+            self._metadata[row] = metadata
+            return 1
+
+        if self._size == self._matrix.shape[0]:
+            grown = np.zeros((self._size * 2, self._matrix.shape[1]), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+
+        self._matrix[self._size] = vector
+        self._ids.append(doc['_id'])
+        self._metadata.append(metadata)
+        self._rows[doc['_id']] = self._size
+        self._size += 1
+        return 1
+
+    def _skip(self, doc_id, strict=False, reason=None):
+        """Leave a chunk out of the index, counting it so the next refresh does not reconcile for it"""
+        if reason is not None and doc_id not in self._skipped:
+            if strict:
+                raise EmbeddingModelChanged(f"chunk {doc_id} {reason}")
+            logger.warning(f"Skipping chunk {doc_id}: {reason}")
+        if doc_id not in self._rows:
+            row = self._base.row_of(doc_id) if self._base is not None else None
+            if row is None or not self._is_base_live(row):
+                self._skipped.add(doc_id)
+        return 0
+
+    def _delete(self, doc_ids):
+        if not doc_ids:
+            return
+        if self.ann is not None:
+            for doc_id in doc_ids:
+                self._ann_added.pop(doc_id, None)
+                self._ann_removed.add(doc_id)
+
+        delta_ids = []
+        for doc_id in doc_ids:
+            if doc_id in self._rows:
+                delta_ids.append(doc_id)
+                self._filter_index.update(doc_id, self._metadata[self._rows[doc_id]], None)
+            else:
+                base_row = self._base.row_of(doc_id)
+                if self._filter_index.fields:
+                    self._filter_index.update(doc_id, self._base.metadata[base_row], None)
+                self._kill_base_row(base_row)
+        if not delta_ids:
+            return
+
+        drop = np.array([self._rows[doc_id] for doc_id in delta_ids])
+        keep = np.setdiff1d(np.arange(self._size), drop, assume_unique=True)
+
+        # Compact into fresh storage so readers holding the old state are unaffected
+        matrix = np.zeros((max(len(keep) * 2, 1024), self._matrix.shape[1]), dtype=np.float32)
+        matrix[:len(keep)] = self._matrix[keep]
+        self._matrix = matrix
+        self._ids = [self._ids[i] for i in keep]
+        self._metadata = [self._metadata[i] for i in keep]
+        self._rows = {doc_id: row for row, doc_id in enumerate(self._ids)}
+        self._size = len(keep)
+        self._delta_shared = False
+
+    def _own_delta(self):
+        """Copy the published delta rows before one is overwritten in place"""
+        if self._delta_shared:
+            self._matrix = self._matrix.copy()
+            self._metadata = list(self._metadata)
+            self._delta_shared = False
+
+    def _publish(self):
+        if self.backend == 'ivf':
+            self._sync_ann()
+        matrix = self._matrix if self._matrix is not None else np.empty((0, 0), dtype=np.float32)
+        self._base_live_shared = True
+        self._delta_shared = True
+        self._state = _IndexState(
+            matrix, self._ids, self._metadata, self._rows, self._size, self.ann,
+            base=self._base, base_live=self._base_live, count=self._live_count(),
+            postings=self._filter_index.publish(), shard_plan=self._plan_shards(),
+        )
+
+    def _plan_shards(self):
+        """Shard plan for the base, re-cut only when the snapshot or its row mask changed"""
+        if self.shards is None or self._base is None or self.ann is not None:
+            return None
+        previous = self._state
+        if previous.base is self._base and previous.base_live is self._base_live:
+            return previous.shard_plan
+        return self.shards.plan(self._base, self._base_live)
+
+    @staticmethod
+    def _metadata_of(state, key):
+        row = state.rows.get(key)
+        if row is not None and row < state.size:
+            return state.metadata[row]
+        if state.base is not None:
+            row = state.base.row_of(key)
+            if row is not None and (state.base_live is None or state.base_live[row]):
+                return state.base.metadata[row]
+        return None
+
+    @staticmethod
+    def _live_entries(state):
+        ids = state.ids[:state.size]
+        matrix = state.matrix[:state.size] if state.matrix is not None else None
+        if state.base is None:
+            return ids, matrix
+        rows = np.arange(len(state.base))
+        if state.base_live is not None:
+            rows = rows[state.base_live]
+        base_ids = [state.base.ids[i] for i in rows]
+        base_matrix = state.base.vectors(rows)
+        if not state.size:
+            return base_ids, base_matrix
+        return base_ids + ids, np.vstack([base_matrix, matrix])
+
+    def _sync_ann(self):
+        """Build the IVF index on first publish, then apply pending changes"""
+        if self.ann is None:
+            if self._live_count():
+                self.ann = self._build_ann()
+            return
+        self.ann.remove(self._ann_removed)
+        if self._ann_added:
+            self.ann.add(list(self._ann_added), np.vstack(list(self._ann_added.values())), normalized=True)
+        self._ann_unsaved += len(self._ann_added) + len(self._ann_removed)
+        self._ann_added, self._ann_removed = {}, set()
+        if self.ann_path and self._ann_unsaved >= self.ann_save_every:
+            self._save_ann()
+
+    def _build_ann(self):
+        """
+        Reuse the centroids of an earlier build for this embedding model, or
+        those persisted at VECTOR_ANN_PATH, else train. The vectors are
+        always assigned afresh, so saved lists are never served stale.
+        """
+        from vector_db.ann import IVFIndex
+
+        ids, matrix = self._live_entries(_IndexState(
+            self._matrix, self._ids, self._metadata, self._rows, self._size,
+            base=self._base, base_live=self._base_live,
+        ))
+        centroids = self._reusable_centroids(matrix.shape[1])
+        if centroids is not None:
+            ann = IVFIndex(centroids)
+            ann.add(ids, matrix, normalized=True)
+        else:
+            ann = IVFIndex.build(ids, matrix)
+        self._ann_centroids = (self.embedding_model, ann.centroids)
+        self.ann = ann
+        if self.ann_path:
+            self._save_ann()
+        return ann
+
+    def _reusable_centroids(self, dimension):
+        from vector_db.ann import IVFIndex
+
+        if self._ann_centroids is not None:
+            model, centroids = self._ann_centroids
+            if model == self.embedding_model and centroids.shape[1] == dimension:
+                return centroids
+        if self.ann_path and os.path.exists(self.ann_path):
+            try:
+                saved = IVFIndex.load(self.ann_path, with_lists=False)
+                if saved.dimension == dimension:
+                    logger.info(f"Loaded IVF centroids from {self.ann_path} (nlist={saved.nlist})")
+                    return saved.centroids
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable IVF artifact {self.ann_path}: {str(e)}")
+        return None
+
+    def _save_ann(self):
+        try:
+            self.ann.save(self.ann_path)
+            self._ann_unsaved = 0
+        except Exception as e:
+            logger.error(f"Failed to save IVF index to {self.ann_path}: {str(e)}")
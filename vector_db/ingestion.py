@@ -0,0 +1,301 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+
+from pymongo import DeleteMany, UpdateOne
+
+from vector_db.quantization import encode_embedding
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXTENSIONS = ('.txt', '.md', '.rst')
+
+
+def embedding_tag(model_name, version=None):
+    """Fields recording which model (and model version) produced a stored embedding"""
+    if version is None:
+        version = os.getenv('EMBEDDING_MODEL_VERSION', '1')
+    return {'embedding_model': model_name, 'embedding_version': str(version)}
+
+
+def content_hash(model_name, text):
+    """Identity of an embedded chunk: the same text under the same model is never re-encoded"""
+    return hashlib.sha256(f"{model_name}\0{text}".encode('utf-8')).hexdigest()
+
+
+def iter_files(paths, extensions=DEFAULT_EXTENSIONS):
+    """Yield files under `paths` in a stable order, so checkpoints line up across runs"""
+    for path in paths:
+        if os.path.isfile(path):
+            yield os.path.abspath(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(tuple(extensions)):
+                    yield os.path.abspath(os.path.join(root, name))
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def chunk_text(text, chunk_size=1000, overlap=200):
+    """Split text into ~chunk_size character windows, breaking on whitespace where possible"""
+    text = text.strip()
+    chunks, start = [], 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            cut = max(text.rfind(' ', start + chunk_size // 2, end), text.rfind('\n', start + chunk_size // 2, end))
+            if cut > start:
+                end = cut
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def parse_file(path, model_name, chunk_size, overlap):
+    """Read and chunk one file; runs in a worker process"""
+    try:
+        # Fingerprint before reading, so a file edited mid-run is picked up next time
+        fingerprint = file_fingerprint(path)
+        with open(path, encoding='utf-8', errors='replace') as f:
+            text = f.read()
+    except OSError as e:
+        return path, None, None, str(e)
+    chunks = [
+        (text_chunk, content_hash(model_name, text_chunk))
+        for text_chunk in chunk_text(text, chunk_size=chunk_size, overlap=overlap)
+    ]
+    return path, fingerprint, chunks, None
+
+
+def _ordered_map(executor, fn, items, window):
+    """executor.map with at most `window` tasks in flight, so input is consumed lazily"""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Checkpoint:
+    """
+    Record of files fully written to MongoDB, keyed by path with their size
+    and mtime. A file is only recorded once every one of its chunks has been
+    written, so an interrupted run resumes at the first incomplete file.
+    """
+
+    def __init__(self, path, model_name):
+        self.path = path
+        self.model_name = model_name
+        self.files = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            # A different embedding model invalidates everything recorded
+            if data.get('model') == model_name:
+                self.files = data.get('files', {})
+
+    def is_done(self, path, fingerprint):
+        return self.files.get(path) == fingerprint
+
+    def mark_done(self, entries):
+        for path, fingerprint in entries:
+            self.files[path] = fingerprint
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'model': self.model_name, 'files': self.files}, f)
+        os.replace(tmp_path, self.path)
+
+
+class DocumentIngestor:
+    """
+    Streams files into `document_chunks`.
+
+    Files are read and chunked in a process pool, chunks are grouped into
+    batches, each batch is checked against the stored content hashes so
+    unchanged chunks are never re-encoded, the rest are embedded with one
+    `encode` call, and the batch is written with one `bulk_write`. Writes run
+    on a background thread so the next batch encodes while the previous one
+    is being written.
+
+    Chunk ids are `<path>#<chunk_index>`; chunks left over from a longer
+    previous version of a file are deleted.
+    """
+
+    def __init__(self, collection, model, model_name, chunk_size=None, overlap=None,
+                 batch_size=None, encode_batch_size=None, workers=None, checkpoint_path=None,
+                 progress_seconds=10):
+        self.collection = collection
+        self.model = model
+        self.model_name = model_name
+        self.chunk_size = chunk_size or int(os.getenv('INGEST_CHUNK_SIZE', 1000))
+        self.overlap = overlap if overlap is not None else int(os.getenv('INGEST_CHUNK_OVERLAP', 200))
+        self.batch_size = batch_size or int(os.getenv('INGEST_BATCH_SIZE', 256))
+        self.encode_batch_size = encode_batch_size or int(os.getenv('INGEST_ENCODE_BATCH_SIZE', 64))
+        self.workers = workers or int(os.getenv('INGEST_WORKERS', os.cpu_count() or 1))
+        self.tag = embedding_tag(model_name)
+        self.checkpoint = Checkpoint(checkpoint_path, model_name)
+        self.progress_seconds = progress_seconds
+        self.stats = {}
+
+    def run(self, paths, extensions=DEFAULT_EXTENSIONS):
+        """Ingest every file under `paths`; returns throughput statistics"""
+        self.stats = {
+            'files': 0, 'files_skipped': 0, 'files_failed': 0,
+            'chunks': 0, 'chunks_unchanged': 0, 'chunks_written': 0, 'chunks_deleted': 0,
+        }
+        self._start = self._last_report = time.time()
+        # Stale-chunk deletes look chunks up by source
+        self.collection.create_index([('metadata.source', 1), ('metadata.chunk_index', 1)])
+
+        files = (path for path in iter_files(paths, extensions) if not self._skip(path))
+        parse = partial(parse_file, model_name=self.model_name, chunk_size=self.chunk_size, overlap=self.overlap)
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool, ThreadPoolExecutor(max_workers=1) as writer:
+            parsed = _ordered_map(pool, parse, files, window=self.workers * 4)
+            write = None
+            for batch in _batched(self._chunks(parsed), self.batch_size):
+                operations, completed = self._prepare(batch)
+                if write is not None:
+                    self._finish(write.result())
+                write = writer.submit(self._write, operations, completed)
+                self._report()
+            if write is not None:
+                self._finish(write.result())
+
+        return self._summary()
+
+    def _skip(self, path):
+        try:
+            fingerprint = file_fingerprint(path)
+        except OSError as e:
+            # Removed or made unreadable since it was listed
+            logger.warning(f"Skipping {path}: {str(e)}")
+            self.stats['files_failed'] += 1
+            return True
+        if self.checkpoint.is_done(path, fingerprint):
+            self.stats['files_skipped'] += 1
+            return True
+        return False
+
+    def _chunks(self, parsed):
+        """Flatten parsed files into (path, fingerprint, index, text, hash, is_last) records"""
+        for path, fingerprint, chunks, error in parsed:
+            if chunks is None:
+                logger.error(f"Failed to read {path}: {error}")
+                self.stats['files_failed'] += 1
+                continue
+            self.stats['files'] += 1
+            if not chunks:
+                yield path, fingerprint, -1, None, None, True
+                continue
+            for i, (text, digest) in enumerate(chunks):
+                yield path, fingerprint, i, text, digest, i == len(chunks) - 1
+
+    def _prepare(self, batch):
+        """Embed the changed chunks of a batch and build its bulk operations"""
+        records = [record for record in batch if record[3] is not None]
+        ids = [f"{path}#{i}" for path, _, i, _, _, _ in records]
+        stored = {
+            doc['_id']: doc.get('content_hash')
+            for doc in self.collection.find({'_id': {'$in': ids}}, {'content_hash': 1})
+        } if ids else {}
+
+        changed = [
+            (doc_id, record) for doc_id, record in zip(ids, records)
+            if stored.get(doc_id) != record[4]
+        ]
+        self.stats['chunks'] += len(records)
+        self.stats['chunks_unchanged'] += len(records) - len(changed)
+
+        operations = []
+        if changed:
+            embeddings = self.model.encode(
+                [record[3] for _, record in changed],
+                batch_size=self.encode_batch_size,
+                show_progress_bar=False
+            )
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            for (doc_id, (path, _, i, text, digest, _)), embedding in zip(changed, embeddings):
+                operations.append(UpdateOne({'_id': doc_id}, {'$set': {
+                    'text': text,
+                    'embedding': encode_embedding(embedding),
+                    'metadata': {'source': path, 'chunk_index': i},
+                    'content_hash': digest,
+                    'updated_at': now,
+                    **self.tag,
+                }}, upsert=True))
+
+        completed = []
+        for path, fingerprint, i, _, _, is_last in batch:
+            if is_last:
+                # Drop chunks beyond the end of the file's current version
+                operations.append(DeleteMany({'metadata.source': path, 'metadata.chunk_index': {'$gt': i}}))
+                completed.append((path, fingerprint))
+        return operations, completed
+
+    def _write(self, operations, completed):
+        result = self.collection.bulk_write(operations, ordered=False) if operations else None
+        return result, completed
+
+    def _finish(self, written):
+        result, completed = written
+        if result is not None:
+            self.stats['chunks_written'] += result.upserted_count + result.modified_count
+            self.stats['chunks_deleted'] += result.deleted_count
+        if completed:
+            self.checkpoint.mark_done(completed)
+
+    def _report(self):
+        now = time.time()
+        if now - self._last_report >= self.progress_seconds:
+            self._last_report = now
+            elapsed = now - self._start
+            logger.info(
+                f"Ingested {self.stats['chunks']} chunks from {self.stats['files']} files "
+                f"({self.stats['chunks'] / elapsed:.1f} chunks/sec)"
+            )
+
+    def _summary(self):
+        elapsed = time.time() - self._start
+        summary = dict(self.stats)
+        summary['seconds'] = elapsed
+        summary['chunks_per_sec'] = self.stats['chunks'] / elapsed if elapsed else 0.0
+        logger.info(
+            f"Ingestion finished: {summary['chunks']} chunks ({summary['chunks_written']} written, "
+            f"{summary['chunks_unchanged']} unchanged) in {elapsed:.2f}s, "
+            f"{summary['chunks_per_sec']:.1f} chunks/sec"
+        )
+        return summary
@@ -0,0 +1,355 @@
+import logging
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from array import array
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+from vector_db.index import top_k_indices
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'he', 'in', 'is', 'it',
+    'its', 'of', 'on', 'or', 'that', 'the', 'to', 'was', 'were', 'will', 'with', 'this', 'what',
+    'which', 'who', 'how', 'do', 'does', 'i', 'you', 'we', 'they', 'can',
+))
+
+
+def tokenize(text):
+    """Lower-cased word tokens without stopwords"""
+    return [token for token in TOKEN_RE.findall((text or '').lower()) if token not in STOPWORDS]
+
+
+class _LexicalState:
+    """
+    View of the index published to concurrent searches.
+
+    Postings are numpy arrays that are never written after publication;
+    a refresh replaces the arrays of the terms it touched and publishes a new
+    dict. `live` is a copy, and rows of `ids` and `lengths` below `size`
+    never change until a compaction, which builds new ones.
+    """
+
+    __slots__ = ('ids', 'postings', 'live', 'lengths', 'size', 'live_count', 'total_length')
+
+    def __init__(self, ids, postings, live, lengths, size, live_count, total_length):
+        self.ids = ids
+        self.postings = postings
+        self.live = live
+        self.lengths = lengths
+        self.size = size
+        self.live_count = live_count
+        self.total_length = total_length
+
+
+_EMPTY = np.empty(0, dtype=np.int32)
+
+
+class LexicalIndex:
+    """
+    In-process BM25 inverted index over `document_chunks.text`.
+
+    Every term maps to arrays of (document number, term frequency). A query
+    only touches the postings of its own terms, so it is much cheaper than
+    scoring every embedding and serves as a first-stage candidate generator
+    for hybrid retrieval.
+
+    Like VectorIndex, it loads on first use and then follows the collection
+    through `updated_at` and a count-triggered id reconciliation. A changed
+    chunk is tombstoned and re-added under a new number; tombstones are
+    compacted away once they outnumber the live chunks. With `path`
+    (LEXICAL_INDEX_PATH) the index is saved as an .npz file after loading
+    and after larger refreshes, and a restarted worker resumes from it
+    instead of re-reading every chunk. Searches read the last published
+    state without locking; one thread refreshes at a time while the others
+    keep searching the previous state.
+    """
+
+    def __init__(self, collection, path=None, refresh_interval=None, k1=None, b=None, save_every=None):
+        self.collection = collection
+        self.path = path or os.getenv('LEXICAL_INDEX_PATH')
+        if refresh_interval is None:
+            refresh_interval = float(os.getenv('VECTOR_INDEX_REFRESH_SECONDS', 30))
+        self.refresh_interval = refresh_interval
+        self.k1 = k1 if k1 is not None else float(os.getenv('BM25_K1', 1.2))
+        self.b = b if b is not None else float(os.getenv('BM25_B', 0.75))
+        self.save_every = save_every if save_every is not None else int(os.getenv('LEXICAL_SAVE_EVERY', 1000))
+
+        # Held by loads, refreshes and saves only; searches never take it
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._last_refresh = 0.0
+        self._reset()
+        self._publish()
+
+    def __len__(self):
+        return self._state.live_count
+
+    def ensure_fresh(self):
+        """Load on first use, then refresh at most once per refresh_interval"""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+            return
+        if time.monotonic() - self._last_refresh >= self.refresh_interval:
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._refresh()
+                finally:
+                    self._lock.release()
+
+    def reload(self):
+        """Rebuild from the collection, ignoring any saved index"""
+        with self._lock:
+            self._reset()
+            self._build()
+
+    def search(self, query, top_k=100):
+        """Return [(id, bm25 score)] for the top_k chunks sharing terms with `query`"""
+        terms = set(tokenize(query))
+        state = self._state
+        if not terms or not state.live_count:
+            return []
+        avgdl = state.total_length / state.live_count
+        scores = np.zeros(state.size, dtype=np.float32)
+        for term in terms:
+            postings = state.postings.get(term)
+            if postings is None:
+                continue
+            docs, tfs = postings
+            keep = state.live[docs]
+            docs, tfs = docs[keep], tfs[keep].astype(np.float32)
+            if not len(docs):
+                continue
+            idf = math.log(1 + (state.live_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * state.lengths[docs] / avgdl)
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        best = [i for i in top_k_indices(scores, top_k) if scores[i] > 0]
+        return [(state.ids[i], float(scores[i])) for i in best]
+
+    def save(self, path=None):
+        """Persist the index (compacted) to an .npz file"""
+        path = path or self.path
+        with self._lock:
+            self._compact()
+            self._publish()
+            terms = list(self._postings)
+            offsets = np.cumsum([0] + [len(self._postings[term][0]) for term in terms])
+            docs = np.concatenate([self._postings[t][0] for t in terms]) if terms else _EMPTY
+            tfs = np.concatenate([self._postings[t][1] for t in terms]) if terms else _EMPTY
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    ids=np.array(self._ids, dtype=object),
+                    lengths=self._lengths[:self._size],
+                    checksums=self._checksums[:self._size],
+                    terms=np.array(terms, dtype=object),
+                    offsets=offsets,
+                    docs=docs,
+                    tfs=tfs,
+                    watermark=np.array(self._watermark.isoformat() if self._watermark else ''),
+                )
+            os.replace(tmp_path, path)
+            self._unsaved = 0
+        logger.info(f"Saved lexical index ({self._live_count} chunks, {len(terms)} terms) to {path}")
+
+    def _reset(self):
+        self._ids = []
+        self._docnums = {}
+        self._postings = {}
+        self._pending = {}
+        self._size = 0
+        self._lengths = np.zeros(1024, dtype=np.float32)
+        self._checksums = np.zeros(1024, dtype=np.uint32)
+        self._live = np.zeros(1024, dtype=bool)
+        self._live_count = 0
+        self._total_length = 0.0
+        self._watermark = None
+        self._unsaved = 0
+
+    def _publish(self):
+        """Merge the postings added since the last publish and hand searches a new state"""
+        if self._pending:
+            postings = dict(self._postings)
+            for term, (docs, tfs) in self._pending.items():
+                old = postings.get(term)
+                docs, tfs = np.frombuffer(docs, dtype=np.int32), np.frombuffer(tfs, dtype=np.int32)
+                postings[term] = (docs.copy(), tfs.copy()) if old is None else (
+                    np.concatenate([old[0], docs]), np.concatenate([old[1], tfs])
+                )
+            self._postings = postings
+            self._pending = {}
+        self._state = _LexicalState(
+            self._ids, self._postings, self._live[:self._size].copy(), self._lengths[:self._size],
+            self._size, self._live_count, self._total_length,
+        )
+
+    def _load(self):
+        start = time.time()
+        if self.path and os.path.exists(self.path):
+            try:
+                self._read(self.path)
+                changed = self._catch_up()
+                source = f"{self.path} (+{changed} changes)"
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable lexical index {self.path}: {str(e)}")
+                self._reset()
+                self._build()
+                source = "collection"
+        else:
+            self._build()
+            source = "collection"
+        self._publish()
+        self._loaded = True
+        self._last_refresh = time.monotonic()
+        logger.info(f"Loaded lexical index from {source}: {self._live_count} chunks in {time.time() - start:.2f}s")
+
+    def _build(self):
+        for doc in self.collection.find({}, {'text': 1, 'updated_at': 1}):
+            self._upsert(doc)
+        self._publish()
+        if self.path:
+            self.save()
+
+    def _refresh(self):
+        changed = self._catch_up()
+        self._last_refresh = time.monotonic()
+        if changed:
+            logger.info(f"Lexical index refreshed: {changed} changes, {self._live_count} chunks")
+            if self._live_count < self._size - self._live_count:
+                self._compact()
+            self._publish()
+            if self.path and self._unsaved >= self.save_every:
+                self.save()
+
+    def _catch_up(self):
+        changed = 0
+        if self._watermark is not None:
+            for doc in self.collection.find({'updated_at': {'$gte': self._watermark}}, {'text': 1, 'updated_at': 1}):
+                changed += self._upsert(doc)
+        if self.collection.estimated_document_count() != self._live_count:
+            changed += self._reconcile()
+        self._unsaved += changed
+        return changed
+
+    def _reconcile(self):
+        live_ids = {doc['_id'] for doc in self.collection.find({}, {'_id': 1})}
+        removed = [doc_id for doc_id in self._docnums if doc_id not in live_ids]
+        added = [doc_id for doc_id in live_ids if doc_id not in self._docnums]
+        for doc_id in removed:
+            self._remove(doc_id)
+        for doc in self.collection.find({'_id': {'$in': added}}, {'text': 1, 'updated_at': 1}) if added else []:
+            self._upsert(doc)
+        return len(removed) + len(added)
+
+    def _upsert(self, doc):
+        updated_at = doc.get('updated_at')
+        if updated_at is not None and (self._watermark is None or updated_at > self._watermark):
+            self._watermark = updated_at
+
+        text = doc.get('text') or ''
+        checksum = zlib.crc32(text.encode('utf-8'))
+        docnum = self._docnums.get(doc['_id'])
+        if docnum is not None:
+            if self._checksums[docnum] == checksum:
+                return 0
+            self._remove(doc['_id'])
+
+        if self._size == len(self._live):
+            self._lengths = np.concatenate([self._lengths, np.zeros_like(self._lengths)])
+            self._checksums = np.concatenate([self._checksums, np.zeros_like(self._checksums)])
+            self._live = np.concatenate([self._live, np.zeros_like(self._live)])
+
+        docnum = self._size
+        tokens = tokenize(text)
+        for term, tf in Counter(tokens).items():
+            pending = self._pending.get(term)
+            if pending is None:
+                pending = self._pending[term] = (array('i'), array('i'))
+            pending[0].append(docnum)
+            pending[1].append(tf)
+        self._ids.append(doc['_id'])
+        self._docnums[doc['_id']] = docnum
+        self._lengths[docnum] = len(tokens)
+        self._checksums[docnum] = checksum
+        self._live[docnum] = True
+        self._size += 1
+        self._live_count += 1
+        self._total_length += len(tokens)
+        return 1
+
+    def _remove(self, doc_id):
+        docnum = self._docnums.pop(doc_id)
+        self._live[docnum] = False
+        self._live_count -= 1
+        self._total_length -= float(self._lengths[docnum])
+
+    def _compact(self):
+        """Drop tombstoned chunks and renumber the live ones into fresh storage"""
+        if self._live_count == self._size:
+            return
+        self._publish()
+        keep = np.flatnonzero(self._live[:self._size])
+        renumber = np.full(self._size, -1, dtype=np.int32)
+        renumber[keep] = np.arange(len(keep), dtype=np.int32)
+
+        postings = {}
+        for term, (docs, tfs) in self._postings.items():
+            mask = self._live[docs]
+            if mask.any():
+                postings[term] = (renumber[docs[mask]], tfs[mask])
+        self._postings = postings
+        self._ids = [self._ids[i] for i in keep]
+        self._docnums = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        capacity = max(len(keep) * 2, 1024)
+        for name in ('_lengths', '_checksums', '_live'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(keep)] = old[keep]
+            setattr(self, name, new)
+        self._size = len(keep)
+
+    def _read(self, path):
+        data = np.load(path, allow_pickle=True)
+        self._reset()
+        self._ids = data['ids'].tolist()
+        self._size = len(self._ids)
+        self._docnums = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        capacity = max(self._size * 2, 1024)
+        self._lengths = np.zeros(capacity, dtype=np.float32)
+        self._lengths[:self._size] = data['lengths']
+        self._checksums = np.zeros(capacity, dtype=np.uint32)
+        self._checksums[:self._size] = data['checksums']
+        self._live = np.zeros(capacity, dtype=bool)
+        self._live[:self._size] = True
+        self._live_count = self._size
+        self._total_length = float(self._lengths[:self._size].sum())
+
+        offsets = data['offsets']
+        docs, tfs = data['docs'].astype(np.int32, copy=False), data['tfs'].astype(np.int32, copy=False)
+        self._postings = {
+            term: (docs[offsets[i]:offsets[i + 1]], tfs[offsets[i]:offsets[i + 1]])
+            for i, term in enumerate(data['terms'].tolist())
+        }
+        watermark = str(data['watermark'])
+        self._watermark = datetime.fromisoformat(watermark) if watermark else None
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked id lists: score(id) = sum of 1 / (k + rank) over the lists it appears in"""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
@@ -0,0 +1,51 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vector_db.ann import IVFIndex, evaluate_recall
+from vector_db.benchmarks import sample_queries
+from vector_db.index import VectorIndex
+from vector_db.mongodb_manager import MongoDBManager
+
+
+class Command(BaseCommand):
+    help = "Report IVF recall@k and latency against exact search over document_chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=10, help="Neighbours per query")
+        parser.add_argument('--queries', type=int, default=200, help="Number of sampled queries")
+        parser.add_argument('--nprobe', default='1,2,4,8,16,32,64', help="Comma-separated nprobe values")
+        parser.add_argument('--nlist', type=int, default=None, help="Coarse lists when training (default: 4*sqrt(n))")
+        parser.add_argument('--artifact', default=os.getenv('VECTOR_ANN_PATH'),
+                            help="Reuse centroids from this IVF artifact instead of training")
+        parser.add_argument('--noise', type=float, default=0.05,
+                            help="Gaussian noise added to sampled corpus vectors to form queries")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        manager = MongoDBManager()
+        index = VectorIndex(manager.collection, backend='flat')
+        index.reload()
+        if not len(index):
+            raise CommandError("document_chunks is empty")
+
+        _, matrix = index.snapshot()
+        keys = list(range(len(matrix)))
+        artifact = options['artifact']
+        if artifact and os.path.exists(artifact):
+            ivf = IVFIndex(IVFIndex.load(artifact, with_lists=False).centroids)
+            ivf.add(keys, matrix, normalized=True)
+            self.stdout.write(f"Using centroids from {artifact}")
+        else:
+            ivf = IVFIndex.build(keys, matrix, nlist=options['nlist'])
+
+        queries = sample_queries(matrix, options['queries'], noise=options['noise'], seed=options['seed'])
+        nprobes = [int(value) for value in options['nprobe'].split(',')]
+
+        self.stdout.write(f"corpus={len(matrix)} dim={matrix.shape[1]} nlist={ivf.nlist} k={options['k']}")
+        self.stdout.write(f"{'nprobe':>8} {'recall':>8} {'mean_ms':>9} {'p95_ms':>9} {'exact_ms':>9}")
+        for row in evaluate_recall(matrix, ivf, queries, top_k=options['k'], nprobes=nprobes):
+            self.stdout.write(
+                f"{row['nprobe']:>8} {row['recall']:>8.3f} {row['mean_ms']:>9.3f} "
+                f"{row['p95_ms']:>9.3f} {row['exact_ms']:>9.3f}"
+            )
@@ -0,0 +1,107 @@
+import json
+import os
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from vector_db.benchmarks import timed
+from vector_db.index import VectorIndex
+from vector_db.lexical import TOKEN_RE
+from vector_db.mongodb_manager import MongoDBManager
+
+
+class Command(BaseCommand):
+    help = "Compare latency and retrieved-source overlap of hybrid (BM25 + vector) and dense retrieval"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=5, help="Chunks retrieved per query")
+        parser.add_argument('--queries', type=int, default=200, help="Number of sampled queries")
+        parser.add_argument('--query-words', type=int, default=8,
+                            help="Words taken from a random chunk to form each query")
+        parser.add_argument('--candidates', type=int, default=None,
+                            help="BM25 candidates per query (default: HYBRID_CANDIDATES)")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_path', default=None, help="Also write results to this file")
+
+    def handle(self, *args, **options):
+        from sentence_transformers import SentenceTransformer
+
+        manager = MongoDBManager()
+        if manager.index is None:
+            manager.index = VectorIndex(manager.collection)
+        _, dense_load_ms = timed(manager.index.ensure_fresh)
+        _, lexical_load_ms = timed(manager.lexical.ensure_fresh)
+        if not len(manager.index):
+            raise CommandError("document_chunks is empty")
+
+        rng = np.random.default_rng(options['seed'])
+        samples = list(manager.collection.aggregate([
+            {'$sample': {'size': options['queries']}},
+            {'$project': {'text': 1}},
+        ]))
+        queries, origins = [], []
+        for doc in samples:
+            words = TOKEN_RE.findall(doc.get('text') or '')
+            if not words:
+                continue
+            start = int(rng.integers(max(len(words) - options['query_words'], 0) + 1))
+            queries.append(' '.join(words[start:start + options['query_words']]))
+            origins.append(doc['_id'])
+
+        model = SentenceTransformer(os.getenv('EMBEDDING_MODEL_NAME'), device='cpu')
+        embeddings = model.encode(queries)
+
+        top_k = options['k']
+        dense_ms, hybrid_ms, overlap, fallbacks = [], [], [], 0
+        dense_found = hybrid_found = 0
+        for origin, query, embedding in zip(origins, queries, embeddings):
+            dense, elapsed = timed(manager.index.search, embedding, top_k=top_k)
+            dense_ms.append(elapsed)
+            hybrid, elapsed = timed(
+                manager.hybrid_hits, query, embedding, top_k=top_k, candidates=options['candidates']
+            )
+            hybrid_ms.append(elapsed)
+            if hybrid is None:
+                fallbacks += 1
+                hybrid = dense
+            dense_ids = [doc_id for doc_id, _, _ in dense]
+            hybrid_ids = [doc_id for doc_id, _, _ in hybrid]
+            overlap.append(len(set(dense_ids) & set(hybrid_ids)) / top_k)
+            dense_found += origin in dense_ids
+            hybrid_found += origin in hybrid_ids
+
+        report = {
+            'chunks': len(manager.index),
+            'queries': len(queries),
+            'k': top_k,
+            'candidates': options['candidates'] or manager.hybrid_candidates,
+            'dense_load_ms': dense_load_ms,
+            'lexical_load_ms': lexical_load_ms,
+            'dense_mean_ms': float(np.mean(dense_ms)),
+            'dense_p95_ms': float(np.percentile(dense_ms, 95)),
+            'hybrid_mean_ms': float(np.mean(hybrid_ms)),
+            'hybrid_p95_ms': float(np.percentile(hybrid_ms, 95)),
+            'source_overlap': float(np.mean(overlap)),
+            'dense_origin_hit_rate': dense_found / len(queries),
+            'hybrid_origin_hit_rate': hybrid_found / len(queries),
+            'hybrid_fallbacks': fallbacks,
+        }
+
+        self.stdout.write(
+            f"chunks={report['chunks']} queries={report['queries']} k={top_k} candidates={report['candidates']}"
+        )
+        self.stdout.write(f"{'mode':>8} {'mean_ms':>9} {'p95_ms':>9} {'origin@k':>9}")
+        self.stdout.write(
+            f"{'dense':>8} {report['dense_mean_ms']:>9.3f} {report['dense_p95_ms']:>9.3f} "
+            f"{report['dense_origin_hit_rate']:>9.3f}"
+        )
+        self.stdout.write(
+            f"{'hybrid':>8} {report['hybrid_mean_ms']:>9.3f} {report['hybrid_p95_ms']:>9.3f} "
+            f"{report['hybrid_origin_hit_rate']:>9.3f}"
+        )
+        self.stdout.write(
+            f"overlap@{top_k}={report['source_overlap']:.3f} fallbacks={fallbacks}"
+        )
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
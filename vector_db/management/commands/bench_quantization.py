@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from vector_db.benchmarks import exact_neighbours, recall, sample_queries, synthetic_corpus, timed
+from vector_db.index import VectorIndex, top_k_indices
+from vector_db.mongodb_manager import MongoDBManager
+from vector_db.quantization import CODECS, get_codec
+
+
+class Command(BaseCommand):
+    help = "Compare memory, latency and recall of the vector storage precisions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, default=None,
+                            help="Use a synthetic corpus of this many vectors instead of document_chunks")
+        parser.add_argument('--dim', type=int, default=384, help="Dimension of the synthetic corpus")
+        parser.add_argument('--k', type=int, default=10, help="Neighbours per query")
+        parser.add_argument('--queries', type=int, default=100, help="Number of sampled queries")
+        parser.add_argument('--rescore-factor', type=int, default=4,
+                            help="Candidates per result that are rescored at full precision")
+        parser.add_argument('--modes', default=','.join(CODECS), help="Comma-separated precisions")
+        parser.add_argument('--json', dest='json_path', default=None, help="Also write results to this file")
+
+    def handle(self, *args, **options):
+        if options['synthetic']:
+            matrix = synthetic_corpus(options['synthetic'], options['dim'])
+        else:
+            index = VectorIndex(MongoDBManager().collection, backend='flat')
+            index.reload()
+            _, matrix = index.snapshot()
+            matrix = np.ascontiguousarray(matrix)
+        if not len(matrix):
+            raise CommandError("Corpus is empty")
+
+        top_k = options['k']
+        candidates = top_k * options['rescore_factor']
+        queries = sample_queries(matrix, options['queries'])
+        truth = exact_neighbours(matrix, queries, top_k)
+
+        report = []
+        for mode in options['modes'].split(','):
+            codec = get_codec(mode)
+            codes, encode_ms = timed(lambda: codec.fit(matrix).encode(matrix))
+            approx, rescored, latencies = [], [], []
+            for query in queries:
+                query = query / np.linalg.norm(query)
+                hits, elapsed = timed(self._search, codec, codes, matrix, query, top_k, candidates)
+                approx.append(hits[0])
+                rescored.append(hits[1])
+                latencies.append(elapsed)
+            report.append({
+                'mode': mode,
+                'bytes': int(codes.nbytes),
+                'bytes_per_vector': codec.bytes_per_vector(matrix.shape[1]),
+                'encode_ms': encode_ms,
+                'mean_ms': float(np.mean(latencies)),
+                'p95_ms': float(np.percentile(latencies, 95)),
+                'recall': recall(truth, approx),
+                'recall_rescored': recall(truth, rescored),
+            })
+
+        self.stdout.write(f"corpus={len(matrix)} dim={matrix.shape[1]} k={top_k} candidates={candidates}")
+        self.stdout.write(
+            f"{'mode':>8} {'MiB':>9} {'mean_ms':>9} {'p95_ms':>9} {'recall':>8} {'rescored':>9}"
+        )
+        for row in report:
+            self.stdout.write(
+                f"{row['mode']:>8} {row['bytes'] / 2 ** 20:>9.1f} {row['mean_ms']:>9.3f} "
+                f"{row['p95_ms']:>9.3f} {row['recall']:>8.3f} {row['recall_rescored']:>9.3f}"
+            )
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    @staticmethod
+    def _search(codec, codes, matrix, query, top_k, candidates):
+        """Approximate top_k, and top_k after rescoring `candidates` at float32"""
+        scores = codec.scores(codes, query)
+        shortlist = top_k_indices(scores, candidates)
+        exact = matrix[shortlist] @ query
+        return shortlist[:top_k].tolist(), shortlist[top_k_indices(exact, top_k)].tolist()
@@ -0,0 +1,249 @@
+import gc
+import json
+import os
+import platform
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from vector_db.benchmarks import (
+    InMemoryCollection, exact_neighbours, latency_stats, recall, resident_memory, sample_queries,
+    synthetic_corpus, synthetic_documents, timed,
+)
+from vector_db.index import VectorIndex
+from vector_db.mongodb_manager import MongoDBManager
+
+SOURCES = ('matrix', 'standin')
+
+
+class Command(BaseCommand):
+    help = "Benchmark index build time, memory, query latency and recall on synthetic corpora"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000',
+                            help="Comma-separated corpus sizes (e.g. 10000,1000000,5000000)")
+        parser.add_argument('--dim', type=int, default=384, help="Embedding dimension")
+        parser.add_argument('--sources', default=','.join(SOURCES),
+                            help="'matrix' loads vectors straight into VectorIndex; 'standin' loads "
+                                 "them from an in-memory document_chunks stand-in through the real "
+                                 "load and MongoDBManager search paths")
+        parser.add_argument('--backends', default='flat', help="Comma-separated VectorIndex backends (flat, ivf)")
+        parser.add_argument('--k', type=int, default=5, help="Chunks retrieved per query")
+        parser.add_argument('--queries', type=int, default=200, help="Number of sampled queries")
+        parser.add_argument('--batch-sizes', default='1,8,32,128', help="Comma-separated search_batch sizes")
+        parser.add_argument('--embed', action='store_true',
+                            help="Also time EMBEDDING_MODEL_NAME encoding, single, batched and with concurrent "
+                                 "callers with and without the micro-batching embedding service")
+        parser.add_argument('--concurrency', default='1,8,32,64',
+                            help="Comma-separated concurrent caller counts for --embed")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_path', default=None, help="Write the results to this file")
+        parser.add_argument('--baseline', default=None, help="Print changes against an earlier --json file")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        sources = options['sources'].split(',')
+        unknown = set(sources) - set(SOURCES)
+        if unknown:
+            raise CommandError(f"Unknown sources: {', '.join(sorted(unknown))}")
+        batch_sizes = [int(size) for size in options['batch_sizes'].split(',')]
+        top_k = options['k']
+
+        results = []
+        for size in sizes:
+            matrix, corpus_ms = timed(synthetic_corpus, size, options['dim'], seed=options['seed'])
+            queries = sample_queries(matrix, options['queries'], seed=options['seed'])
+            ids = [f"synthetic-{i}" for i in range(size)]
+            truth = [{ids[row] for row in rows} for rows in exact_neighbours(matrix, queries, top_k)]
+            self.stdout.write(f"corpus={size} dim={options['dim']} generated in {corpus_ms:.0f}ms")
+            for source in sources:
+                for backend in options['backends'].split(','):
+                    row = self._run(source, backend, matrix, ids, queries, truth, top_k, batch_sizes)
+                    results.append(row)
+                    self._print_row(row)
+            del matrix
+            gc.collect()
+        if options['embed']:
+            concurrency = [int(count) for count in options['concurrency'].split(',')]
+            row = self._embedding(options['queries'], batch_sizes, concurrency)
+            results.append(row)
+            self._print_embedding(row)
+
+        report = {'meta': self._meta(options), 'results': results}
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                self._compare(json.load(f), report)
+
+    def _run(self, source, backend, matrix, ids, queries, truth, top_k, batch_sizes):
+        gc.collect()
+        manager = collection = None
+        if source == 'matrix':
+            rss_before = resident_memory()
+            index = VectorIndex(None, refresh_interval=float('inf'), backend=backend)
+            _, build_ms = timed(index.load_matrix, ids, matrix)
+        else:
+            collection = InMemoryCollection(synthetic_documents(matrix))
+            rss_before = resident_memory()
+            index = VectorIndex(collection, refresh_interval=float('inf'), backend=backend)
+            _, build_ms = timed(index.reload)
+            manager = MongoDBManager(collection=collection)
+            manager.index = index
+        rss_delta = resident_memory() - rss_before
+
+        index.search(queries[0], top_k=top_k)
+        found, latencies = [], []
+        for query in queries:
+            hits, elapsed = timed(index.search, query, top_k=top_k)
+            found.append({doc_id for doc_id, _, _ in hits})
+            latencies.append(elapsed)
+
+        row = {
+            'source': source,
+            'backend': backend,
+            'size': len(ids),
+            'dim': int(matrix.shape[1]),
+            'k': top_k,
+            'queries': len(queries),
+            'build_ms': build_ms,
+            'matrix_bytes': int(index.snapshot()[1].nbytes),
+            'rss_delta_bytes': int(rss_delta),
+            'single': latency_stats(latencies),
+            'recall': recall(truth, found),
+            'batched': [],
+        }
+        if manager is not None:
+            latencies = [timed(manager.cosine_similarity_search, query, top_k=top_k)[1] for query in queries]
+            row['end_to_end'] = latency_stats(latencies)
+
+        for batch_size in batch_sizes:
+            batch_found, total_ms = [], 0.0
+            for start in range(0, len(queries), batch_size):
+                hits, elapsed = timed(index.search_batch, queries[start:start + batch_size], top_k=top_k)
+                batch_found.extend({doc_id for doc_id, _, _ in q_hits} for q_hits in hits)
+                total_ms += elapsed
+            row['batched'].append({
+                'batch_size': batch_size,
+                'per_query_ms': total_ms / len(queries),
+                'qps': len(queries) / (total_ms / 1000) if total_ms else 0.0,
+                'recall': recall(truth, batch_found),
+            })
+        del index, manager, collection
+        return row
+
+    @staticmethod
+    def _embedding(count, batch_sizes, concurrency=()):
+        from rag_engine.embedding import EmbeddingService
+        from rag_engine.registry import load_sentence_transformer
+
+        model_name = os.getenv('EMBEDDING_MODEL_NAME')
+        model = load_sentence_transformer(model_name)
+        texts = [f"How do I configure option {i} for the service in region {i % 7}?" for i in range(count)]
+        model.encode(texts[0])
+        latencies = [timed(model.encode, text)[1] for text in texts]
+        batched = []
+        for batch_size in batch_sizes:
+            _, elapsed = timed(model.encode, texts, batch_size=batch_size)
+            batched.append({
+                'batch_size': batch_size,
+                'per_query_ms': elapsed / count,
+                'qps': count / (elapsed / 1000) if elapsed else 0.0,
+            })
+        concurrent = []
+        for callers in concurrency:
+            service = EmbeddingService(enabled=True)
+            row = {'concurrency': callers}
+            for mode, encode in (('direct', model.encode), ('service', lambda text: service.encode(model, text))):
+                with ThreadPoolExecutor(max_workers=callers) as pool:
+                    start = time.perf_counter()
+                    list(pool.map(encode, texts))
+                    elapsed = time.perf_counter() - start
+                row[f"{mode}_qps"] = count / elapsed if elapsed else 0.0
+            row['mean_batch'] = service.stats()['mean_batch']
+            concurrent.append(row)
+        return {'source': 'embedding', 'model': model_name, 'backend': os.getenv('EMBEDDING_BACKEND', 'torch'),
+                'queries': count, 'single': latency_stats(latencies), 'batched': batched, 'concurrent': concurrent}
+
+    @staticmethod
+    def _meta(options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, timeout=5
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+        return {
+            'commit': commit,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'seed': options['seed'],
+        }
+
+    def _print_row(self, row):
+        single = row['single']
+        self.stdout.write(
+            f"  {row['source']:>8} {row['backend']:>5} build={row['build_ms']:.0f}ms "
+            f"matrix={row['matrix_bytes'] / 2 ** 20:.1f}MiB rss+={row['rss_delta_bytes'] / 2 ** 20:.1f}MiB "
+            f"p50={single['p50_ms']:.3f}ms p95={single['p95_ms']:.3f}ms p99={single['p99_ms']:.3f}ms "
+            f"recall@{row['k']}={row['recall']:.3f}"
+        )
+        if 'end_to_end' in row:
+            self.stdout.write(
+                f"  {'':>14} end-to-end p50={row['end_to_end']['p50_ms']:.3f}ms "
+                f"p95={row['end_to_end']['p95_ms']:.3f}ms"
+            )
+        for batch in row['batched']:
+            self.stdout.write(
+                f"  {'':>14} batch={batch['batch_size']:<4} {batch['per_query_ms']:.3f}ms/query "
+                f"{batch['qps']:.0f} q/s recall={batch['recall']:.3f}"
+            )
+
+    def _print_embedding(self, row):
+        self.stdout.write(
+            f"embedding {row['model']}: p50={row['single']['p50_ms']:.2f}ms p95={row['single']['p95_ms']:.2f}ms"
+        )
+        for batch in row['batched']:
+            self.stdout.write(
+                f"  batch={batch['batch_size']:<4} {batch['per_query_ms']:.2f}ms/query {batch['qps']:.0f} q/s"
+            )
+        for result in row.get('concurrent', []):
+            self.stdout.write(
+                f"  callers={result['concurrency']:<4} direct {result['direct_qps']:.0f} q/s, "
+                f"batching service {result['service_qps']:.0f} q/s (mean batch {result['mean_batch']:.1f})"
+            )
+
+    def _compare(self, baseline, report):
+        def key(row):
+            return (row['source'], row.get('backend'), row.get('size'), row.get('dim'), row.get('k'))
+
+        def change(new, old):
+            return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+        previous = {key(row): row for row in baseline.get('results', [])}
+        self.stdout.write(f"Compared with {baseline.get('meta', {}).get('commit') or 'baseline'}:")
+        for row in report['results']:
+            old = previous.get(key(row))
+            if old is None:
+                continue
+            label = ' '.join(str(part) for part in key(row)[:3] if part is not None)
+            line = (
+                f"  {label}: p50 {change(row['single']['p50_ms'], old['single']['p50_ms'])} "
+                f"p95 {change(row['single']['p95_ms'], old['single']['p95_ms'])}"
+            )
+            if 'build_ms' in row:
+                line += (
+                    f" build {change(row['build_ms'], old['build_ms'])}"
+                    f" recall {row['recall'] - old['recall']:+.3f}"
+                )
+            self.stdout.write(line)
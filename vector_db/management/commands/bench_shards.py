@@ -0,0 +1,126 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from vector_db.benchmarks import (
+    InMemoryCollection, exact_neighbours, latency_stats, recall, sample_queries, synthetic_corpus,
+    synthetic_documents, timed,
+)
+from vector_db.index import VectorIndex
+from vector_db.shards import ShardPool
+from vector_db.snapshot import SNAPSHOT_DTYPES, export_snapshot
+
+
+class Command(BaseCommand):
+    help = "Measure how sharded snapshot search scales with the number of worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1000000, help="Synthetic corpus size")
+        parser.add_argument('--dim', type=int, default=384, help="Embedding dimension")
+        parser.add_argument('--dtype', default='float32', choices=SNAPSHOT_DTYPES,
+                            help="Storage precision of the snapshot")
+        parser.add_argument('--workers', default=None,
+                            help="Comma-separated worker counts; 1 searches in-process (default: 1,2,4,... "
+                                 "up to the CPU count)")
+        parser.add_argument('--deleted', type=float, default=0.0,
+                            help="Fraction of chunks deleted after the export, all from the start of the "
+                                 "snapshot, to exercise rebalancing")
+        parser.add_argument('--k', type=int, default=10, help="Chunks retrieved per query")
+        parser.add_argument('--queries', type=int, default=100, help="Number of sampled queries")
+        parser.add_argument('--batch-sizes', default='1,32', help="Comma-separated search_batch sizes")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_path', default=None, help="Write the results to this file")
+
+    def handle(self, *args, **options):
+        cpus = os.cpu_count() or 1
+        if options['workers']:
+            workers = [int(count) for count in options['workers'].split(',')]
+        else:
+            workers = [2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus]
+            if workers[-1] != cpus:
+                workers.append(cpus)
+        batch_sizes = [int(size) for size in options['batch_sizes'].split(',')]
+        top_k = options['k']
+
+        matrix = synthetic_corpus(options['size'], options['dim'], seed=options['seed'])
+        queries = sample_queries(matrix, options['queries'], seed=options['seed'])
+        collection = InMemoryCollection(synthetic_documents(matrix, texts=False))
+        deleted = int(len(matrix) * options['deleted'])
+        live = np.arange(deleted, len(matrix))
+        truth = [
+            {f"synthetic-{live[row]}" for row in rows}
+            for rows in exact_neighbours(matrix[deleted:], queries, top_k)
+        ]
+        del matrix
+
+        with tempfile.TemporaryDirectory() as root:
+            _, export_ms = timed(export_snapshot, collection, root, dtype=options['dtype'])
+            for i in range(deleted):
+                del collection.documents[f"synthetic-{i}"]
+            self.stdout.write(
+                f"corpus={options['size']} dim={options['dim']} dtype={options['dtype']} "
+                f"deleted={deleted} exported in {export_ms:.0f}ms, cpus={cpus}"
+            )
+            results = [self._run(collection, root, count, queries, truth, top_k, batch_sizes) for count in workers]
+
+        baseline = results[0]
+        for row in results:
+            for batch, first in zip(row['batched'], baseline['batched']):
+                batch['speedup'] = batch['qps'] / first['qps'] if first['qps'] else 0.0
+            self._print_row(row)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({'cpus': cpus, 'options': {k: options[k] for k in ('size', 'dim', 'dtype', 'deleted', 'k')},
+                           'results': results}, f, indent=2)
+
+    @staticmethod
+    def _run(collection, root, workers, queries, truth, top_k, batch_sizes):
+        pool = ShardPool(shards=workers, min_rows=1)
+        index = VectorIndex(collection, refresh_interval=float('inf'), snapshot_dir=root, shards=pool)
+        try:
+            # Loading masks the chunks deleted after the export and cuts the shards around them
+            _, load_ms = timed(index.reload)
+            index.search_batch(queries[:max(batch_sizes)], top_k=top_k)
+
+            found, latencies = [], []
+            for query in queries:
+                hits, elapsed = timed(index.search, query, top_k=top_k)
+                found.append({doc_id for doc_id, _, _ in hits[:top_k]})
+                latencies.append(elapsed)
+            row = {
+                'workers': workers,
+                'shard_rows': pool.stats()['live_rows'] or [len(index)],
+                'load_ms': load_ms,
+                'single': latency_stats(latencies),
+                'recall': recall(truth, found),
+                'batched': [],
+            }
+            for batch_size in batch_sizes:
+                total_ms = 0.0
+                for start in range(0, len(queries), batch_size):
+                    total_ms += timed(index.search_batch, queries[start:start + batch_size], top_k=top_k)[1]
+                row['batched'].append({
+                    'batch_size': batch_size,
+                    'per_query_ms': total_ms / len(queries),
+                    'qps': len(queries) / (total_ms / 1000) if total_ms else 0.0,
+                })
+            return row
+        finally:
+            pool.shutdown()
+
+    def _print_row(self, row):
+        single = row['single']
+        shard_rows = row['shard_rows']
+        self.stdout.write(
+            f"  workers={row['workers']:<3} shards={len(shard_rows)} "
+            f"live rows/shard {min(shard_rows)}..{max(shard_rows)} "
+            f"p50={single['p50_ms']:.2f}ms p95={single['p95_ms']:.2f}ms recall={row['recall']:.3f}"
+        )
+        for batch in row['batched']:
+            self.stdout.write(
+                f"  {'':>11} batch={batch['batch_size']:<4} {batch['per_query_ms']:.3f}ms/query "
+                f"{batch['qps']:.0f} q/s x{batch['speedup']:.2f}"
+            )
@@ -0,0 +1,22 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vector_db.lexical import LexicalIndex
+from vector_db.mongodb_manager import MongoDBManager
+
+
+class Command(BaseCommand):
+    help = "Build the BM25 index over document_chunks.text and save it for the API workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=os.getenv('LEXICAL_INDEX_PATH'),
+                            help="Output .npz file (default: LEXICAL_INDEX_PATH)")
+
+    def handle(self, *args, **options):
+        if not options['path']:
+            raise CommandError("No output path: pass --path or set LEXICAL_INDEX_PATH")
+
+        index = LexicalIndex(MongoDBManager().collection, path=options['path'])
+        index.reload()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {len(index)} chunks into {options['path']}"))
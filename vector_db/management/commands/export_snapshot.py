@@ -0,0 +1,32 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vector_db.mongodb_manager import MongoDBManager
+from vector_db.snapshot import SNAPSHOT_DTYPES, export_snapshot
+
+
+class Command(BaseCommand):
+    help = "Export document_chunks embeddings to a memory-mappable snapshot and publish it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=os.getenv('VECTOR_SNAPSHOT_DIR'),
+                            help="Snapshot root directory (default: VECTOR_SNAPSHOT_DIR)")
+        parser.add_argument('--dtype', default='float32', choices=SNAPSHOT_DTYPES,
+                            help="Storage precision of the embedding matrix")
+        parser.add_argument('--keep', type=int, default=2, help="Number of versions to retain")
+        parser.add_argument('--batch-size', type=int, default=1000, help="MongoDB cursor batch size")
+
+    def handle(self, *args, **options):
+        if not options['dir']:
+            raise CommandError("No snapshot directory: pass --dir or set VECTOR_SNAPSHOT_DIR")
+
+        manager = MongoDBManager()
+        path = export_snapshot(
+            manager.collection,
+            options['dir'],
+            dtype=options['dtype'],
+            keep=options['keep'],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Published snapshot {path}"))
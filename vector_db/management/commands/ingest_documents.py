@@ -0,0 +1,62 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_engine.registry import embedding_models, model_registry
+from vector_db.ingestion import DEFAULT_EXTENSIONS, DocumentIngestor
+from vector_db.mongodb_manager import MongoDBManager
+
+
+class Command(BaseCommand):
+    help = "Chunk, embed and upsert text files into document_chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Files or directories to ingest")
+        parser.add_argument('--ext', default=','.join(DEFAULT_EXTENSIONS),
+                            help="Comma-separated file extensions to pick up in directories")
+        parser.add_argument('--chunk-size', type=int, default=None, help="Characters per chunk")
+        parser.add_argument('--overlap', type=int, default=None, help="Characters shared by adjacent chunks")
+        parser.add_argument('--batch-size', type=int, default=None, help="Chunks per encode/bulk write")
+        parser.add_argument('--encode-batch-size', type=int, default=None,
+                            help="Batch size passed to SentenceTransformer.encode")
+        parser.add_argument('--workers', type=int, default=None, help="Processes used for reading and chunking")
+        parser.add_argument('--checkpoint', default=None,
+                            help="Checkpoint file; completed files are skipped when it is reused")
+
+    def handle(self, *args, **options):
+        for path in options['paths']:
+            if not os.path.exists(path):
+                raise CommandError(f"No such file or directory: {path}")
+
+        # The model queries are embedded with, so new chunks are searchable by them
+        model_name = model_registry.active().embedding_model
+        if not model_name:
+            raise CommandError("No embedding model: activate a ModelConfig or set EMBEDDING_MODEL_NAME")
+        manager = MongoDBManager()
+        corpus_model = manager.corpus_embedding_model()
+        if corpus_model is not None and corpus_model != model_name:
+            raise CommandError(
+                f"document_chunks is embedded with {corpus_model}, but the active model is {model_name}; "
+                f"run reembed_documents --model {model_name} first"
+            )
+
+        ingestor = DocumentIngestor(
+            manager.collection,
+            embedding_models.get(model_name),
+            model_name,
+            chunk_size=options['chunk_size'],
+            overlap=options['overlap'],
+            batch_size=options['batch_size'],
+            encode_batch_size=options['encode_batch_size'],
+            workers=options['workers'],
+            checkpoint_path=options['checkpoint'],
+        )
+        extensions = tuple(ext if ext.startswith('.') else f'.{ext}' for ext in options['ext'].split(','))
+        stats = ingestor.run(options['paths'], extensions=extensions)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Ingested {stats['files']} files ({stats['files_skipped']} skipped by checkpoint, "
+            f"{stats['files_failed']} failed): {stats['chunks']} chunks, {stats['chunks_written']} written, "
+            f"{stats['chunks_unchanged']} unchanged, {stats['chunks_deleted']} stale deleted "
+            f"in {stats['seconds']:.1f}s ({stats['chunks_per_sec']:.1f} chunks/sec)"
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from vector_db.mongodb_manager import MongoDBManager
+from vector_db.quantization import encode_embedding
+
+
+class Command(BaseCommand):
+    help = "Rewrite document_chunks embeddings stored as BSON arrays as packed float32 binary"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Documents per bulk write")
+
+    def handle(self, *args, **options):
+        manager = MongoDBManager()
+        collection = manager.collection
+        # Embeddings that are already packed are skipped
+        cursor = collection.find({'embedding': {'$type': 'array'}}, {'embedding': 1})
+
+        batch, packed = [], 0
+        for doc in cursor:
+            batch.append(UpdateOne(
+                {'_id': doc['_id'], 'embedding': {'$type': 'array'}},
+                {'$set': {'embedding': encode_embedding(doc['embedding'])}},
+            ))
+            if len(batch) >= options['batch_size']:
+                packed += collection.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            packed += collection.bulk_write(batch, ordered=False).modified_count
+
+        self.stdout.write(self.style.SUCCESS(f"Packed {packed} embeddings"))
@@ -0,0 +1,84 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_engine.registry import model_registry
+from vector_db.mongodb_manager import MongoDBManager
+from vector_db.reembed import ReembedJob
+
+
+class Command(BaseCommand):
+    help = "Re-embed document_chunks with a new model into a shadow collection and cut over atomically"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=None,
+                            help="Target embedding model (default: active ModelConfig, else EMBEDDING_MODEL_NAME)")
+        parser.add_argument('--version', default=None,
+                            help="Version recorded with the embeddings (default: EMBEDDING_MODEL_VERSION or 1)")
+        parser.add_argument('--batch-size', type=int, default=None, help="Chunks per encode call and bulk write")
+        parser.add_argument('--no-cutover', action='store_true',
+                            help="Stop after copying; run again with --cutover-only to switch")
+        parser.add_argument('--cutover-only', action='store_true', help="Catch up and cut over a finished copy")
+        parser.add_argument('--status', action='store_true', help="Print job progress and ETA, then exit")
+        parser.add_argument('--force', action='store_true',
+                            help="Start over even if this model and version were already re-embedded")
+
+    def handle(self, *args, **options):
+        model_name = options['model'] or self._configured_model()
+        if not model_name:
+            raise CommandError("No embedding model: pass --model, activate a ModelConfig or set EMBEDDING_MODEL_NAME")
+
+        manager = MongoDBManager()
+        if options['status']:
+            job = ReembedJob(manager.db, None, model_name, version=options['version'])
+            self.stdout.write(json.dumps(job.status(), indent=2, default=str))
+            return
+
+        from sentence_transformers import SentenceTransformer
+
+        job = ReembedJob(
+            manager.db,
+            SentenceTransformer(model_name, device='cpu'),
+            model_name,
+            version=options['version'],
+            batch_size=options['batch_size'],
+        )
+        try:
+            if options['cutover_only']:
+                job.cutover()
+                status = job.status()
+            else:
+                status = job.run(cutover=not options['no_cutover'], force=options['force'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if status['state'] == 'complete':
+            self._switch_model_configs(model_name)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-embedded {status['done']}/{status['total']} chunks with {model_name} "
+            f"({status['state']}) in {status['elapsed_seconds']:.1f}s"
+        ))
+
+    def _configured_model(self):
+        return model_registry.active().embedding_model
+
+    def _switch_model_configs(self, model_name):
+        """
+        Point every active ModelConfig at the model the corpus now holds.
+        Workers pick the change up within MODEL_CONFIG_REFRESH_SECONDS and
+        refuse queries until their query model and index agree again.
+        """
+        from model_config.models import ModelConfig
+
+        # Oldest first, so the most recently updated config (the default one) stays the newest
+        configs = ModelConfig.objects.filter(is_active=True).exclude(embedding_model=model_name).order_by('updated_at')
+        for config in configs:
+            # save() rather than update() so post_save refreshes the registry
+            config.embedding_model = model_name
+            config.save()
+            self.stdout.write(f"Model config '{config.name}' now embeds queries with {model_name}")
+        if model_registry.active().name == 'env' and model_registry.active().embedding_model != model_name:
+            self.stdout.write(self.style.WARNING(
+                f"No active ModelConfig: set EMBEDDING_MODEL_NAME={model_name} and restart the workers; "
+                f"they refuse queries until then"
+            ))
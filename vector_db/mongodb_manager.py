@@ -1,41 +1,264 @@
 import os
 from pymongo import MongoClient
+from core.metrics import stage
 from sklearn.metrics.pairwise import cosine_similarity
+from vector_db.filters import normalize_filters, to_mongo
+from vector_db.index import VectorIndex, normalize, top_k_indices
+from vector_db.lexical import LexicalIndex, reciprocal_rank_fusion
+from vector_db.quantization import decode_embedding
 import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
 
 class MongoDBManager:
-    def __init__(self):
+    def __init__(self, collection=None):
         self.uri = os.getenv('MONGODB_URI')
         self.db_name = os.getenv('MONGODB_DB_NAME')
+        if collection is None:
+            self._connect()
+        else:
+            # Pre-built collection (e.g. benchmarks.InMemoryCollection); no client is opened
+            self.client = self.db = None
+            self.collection = collection
+
+        # Resident index, loaded lazily on the first search
+        self.index = None
+        self.rescore_factor = int(os.getenv('VECTOR_RESCORE_FACTOR', 4))
+        if os.getenv('VECTOR_INDEX_ENABLED', 'true').lower() in ('1', 'true', 'yes'):
+            self.index = VectorIndex(self.collection)
+
+        # BM25 index for hybrid retrieval, also loaded lazily
+        self.lexical = LexicalIndex(self.collection)
+        self.hybrid_candidates = int(os.getenv('HYBRID_CANDIDATES', 100))
+        self.rrf_k = int(os.getenv('HYBRID_RRF_K', 60))
+
+    def _connect(self):
         self.client = MongoClient(self.uri)
         self.db = self.client[self.db_name]
         self.collection = self.db['document_chunks']
         logger.info(f"Connected to MongoDB: {self.db_name}")
 
-    def cosine_similarity_search(self, query_embedding, top_k=5):
+    def reconnect(self):
+        """Open a fresh client (e.g. after fork) while keeping the resident index"""
+        self._connect()
+        if self.index is not None:
+            self.index.collection = self.collection
+        self.lexical.collection = self.collection
+
+    def corpus_version(self):
+        """Counter that changes whenever the indexed chunks change (None without an index)"""
+        if self.index is None:
+            return None
+        self.index.ensure_fresh()
+        return self.index.version
+
+    def corpus_embedding_model(self):
+        """Model that produced the stored embeddings, from their tag (None if untagged)"""
+        doc = self.collection.find_one({'embedding_model': {'$exists': True}}, {'embedding_model': 1})
+        return doc['embedding_model'] if doc else None
+
+    def serving_embedding_model(self):
+        """Model of the embeddings searches run against: the resident index's, else the stored tag"""
+        if self.index is None:
+            return self.corpus_embedding_model()
+        with stage('index_refresh'):
+            self.index.ensure_fresh()
+        return self.index.embedding_model
+
+    def cosine_similarity_search(self, query_embedding, top_k=5, filters=None):
+        """Top_k chunks most similar to the query, restricted to chunks whose metadata matches `filters`"""
+        try:
+            filters = normalize_filters(filters)
+            if self.index is None:
+                return self._scan_similarity_search(query_embedding, top_k=top_k, filters=filters)
+
+            with stage('index_refresh'):
+                self.index.ensure_fresh()
+            if self.index.quantized:
+                with stage('similarity'):
+                    hits = self.index.search(query_embedding, top_k=top_k * self.rescore_factor, filters=filters)
+                return self._rescore_hits(hits, query_embedding, top_k)
+            with stage('similarity'):
+                hits = self.index.search(query_embedding, top_k=top_k, filters=filters)
+            return self._fetch_hits(hits)
+        except Exception as e:
+            logger.error(f"Vector search failed: {str(e)}")
+            raise
+
+    def hybrid_search(self, query, query_embedding, top_k=5, filters=None):
+        """
+        Top_k chunks from BM25 candidates re-ranked by reciprocal rank fusion
+        of their lexical and vector ranks. Only the candidates are scored
+        against the query embedding. Falls back to dense search when no
+        chunk shares a term with the query.
+        """
+        try:
+            filters = normalize_filters(filters)
+            hits = self.hybrid_hits(query, query_embedding, top_k=top_k, filters=filters)
+            if hits is None:
+                return self.cosine_similarity_search(query_embedding, top_k=top_k, filters=filters)
+            return self._fetch_hits(hits)
+        except Exception as e:
+            logger.error(f"Hybrid search failed: {str(e)}")
+            raise
+
+    def hybrid_hits(self, query, query_embedding, top_k=5, filters=None, candidates=None):
+        """Fused [(id, metadata, rrf score)] without chunk text, or None without lexical candidates"""
+        with stage('index_refresh'):
+            self.lexical.ensure_fresh()
+        with stage('lexical'):
+            lexical = self.lexical.search(query, top_k=candidates or self.hybrid_candidates)
+        if not lexical:
+            return None
+
+        ids = [doc_id for doc_id, _ in lexical]
+        dense = None
+        if self.index is not None:
+            with stage('index_refresh'):
+                self.index.ensure_fresh()
+            if not self.index.quantized:
+                with stage('similarity'):
+                    dense = self.index.score_ids(ids, query_embedding, filters=filters)
+        if dense is None:
+            # No index, or a lossy snapshot: score the candidates with their full-precision embeddings
+            with stage('mongo_fetch'):
+                docs = list(self.collection.find(
+                    {'_id': {'$in': ids}, **to_mongo(filters)}, {'embedding': 1, 'metadata': 1}
+                ))
+            query_vector = normalize(query_embedding)
+            with stage('similarity'):
+                dense = [
+                    (doc['_id'], doc.get('metadata', {}),
+                     float(normalize(decode_embedding(doc['embedding'])) @ query_vector))
+                    for doc in docs
+                ]
+        if not dense:
+            return None
+
+        metadata = {doc_id: meta for doc_id, meta, _ in dense}
+        dense_ranking = [doc_id for doc_id, _, _ in sorted(dense, key=lambda hit: -hit[2])]
+        lexical_ranking = [doc_id for doc_id in ids if doc_id in metadata]
+        fused = reciprocal_rank_fusion([lexical_ranking, dense_ranking], k=self.rrf_k)
+        return [(doc_id, metadata[doc_id], score) for doc_id, score in fused[:top_k]]
+
+    def batch_similarity_search(self, query_embeddings, top_k=5, filters=None):
+        """Top_k chunks for each query, with one index pass and one payload fetch"""
         try:
-            # Get all chunks with embeddings
-            chunks = list(self.collection.find({}, {'embedding': 1, 'text': 1, 'metadata': 1}))
-            
-            if not chunks:
-                return []
-            
-            # Extract embeddings and calculate similarities
-            embeddings = [np.array(chunk['embedding']) for chunk in chunks]
+            filters = normalize_filters(filters)
+            if self.index is None:
+                return self._scan_batch_similarity_search(query_embeddings, top_k=top_k, filters=filters)
+
+            with stage('index_refresh'):
+                self.index.ensure_fresh()
+            if self.index.quantized:
+                with stage('similarity'):
+                    batch_hits = self.index.search_batch(
+                        query_embeddings, top_k=top_k * self.rescore_factor, filters=filters
+                    )
+                docs = self._load_docs(batch_hits, {'text': 1, 'embedding': 1})
+                return [
+                    self._rescore_hits(hits, query_embedding, top_k, docs=docs)
+                    for hits, query_embedding in zip(batch_hits, query_embeddings)
+                ]
+            with stage('similarity'):
+                batch_hits = self.index.search_batch(query_embeddings, top_k=top_k, filters=filters)
+            docs = self._load_docs(batch_hits, {'text': 1})
+            return [self._fetch_hits(hits, docs=docs) for hits in batch_hits]
+        except Exception as e:
+            logger.error(f"Batch vector search failed: {str(e)}")
+            raise
+
+    def chunk_vectors(self, doc_ids):
+        """Unit-length embeddings of the given chunks as {id: vector}, from the resident index when loaded"""
+        if self.index is not None and len(self.index):
+            return self.index.vectors(doc_ids)
+        return {
+            doc['_id']: normalize(decode_embedding(doc['embedding']))
+            for doc in self.collection.find({'_id': {'$in': list(doc_ids)}}, {'embedding': 1})
+        }
+
+    def _load_docs(self, batch_hits, projection):
+        ids = list({doc_id for hits in batch_hits for doc_id, _, _ in hits})
+        if not ids:
+            return {}
+        with stage('mongo_fetch'):
+            return {doc['_id']: doc for doc in self.collection.find({'_id': {'$in': ids}}, projection)}
+
+    def _fetch_hits(self, hits, docs=None):
+        """Load text for index hits, preserving score order"""
+        if not hits:
+            return []
+        if docs is None:
+            docs = self._load_docs([hits], {'text': 1})
+        return [{
+            'id': doc_id,
+            'text': docs[doc_id]['text'],
+            'metadata': metadata,
+            'score': score
+        } for doc_id, metadata, score in hits if doc_id in docs]
+
+    def _rescore_hits(self, hits, query_embedding, top_k, docs=None):
+        """Re-rank approximate candidates with their full-precision embeddings"""
+        if not hits:
+            return []
+        if docs is None:
+            docs = self._load_docs([hits], {'text': 1, 'embedding': 1})
+        hits = [hit for hit in hits if hit[0] in docs]
+        if not hits:
+            return []
+        with stage('similarity'):
+            query = normalize(query_embedding)
+            matrix = np.vstack([normalize(decode_embedding(docs[doc_id]['embedding'])) for doc_id, _, _ in hits])
+            scores = matrix @ query
+        return [{
+            'id': hits[i][0],
+            'text': docs[hits[i][0]]['text'],
+            'metadata': hits[i][1],
+            'score': float(scores[i])
+        } for i in top_k_indices(scores, top_k)]
+
+    def _scan_similarity_search(self, query_embedding, top_k=5, filters=None):
+        # Get all chunks with embeddings, filtered by MongoDB
+        with stage('mongo_fetch'):
+            chunks = list(self.collection.find(to_mongo(filters), {'embedding': 1, 'text': 1, 'metadata': 1}))
+
+        if not chunks:
+            return []
+
+        # Extract embeddings and calculate similarities
+        with stage('similarity'):
+            embeddings = [decode_embedding(chunk['embedding']) for chunk in chunks]
             similarities = cosine_similarity([query_embedding], embeddings)[0]
-            
-            # Get top K results
-            top_indices = np.argsort(similarities)[-top_k:][::-1]
-            results = [{
+
+        # Get top K results
+        top_indices = np.argsort(similarities)[-top_k:][::-1]
+        results = [{
+            'id': chunks[i]['_id'],
+            'text': chunks[i]['text'],
+            'metadata': chunks[i].get('metadata', {}),
+            'score': float(similarities[i])
+        } for i in top_indices]
+
+        return results
+
+    def _scan_batch_similarity_search(self, query_embeddings, top_k=5, filters=None):
+        with stage('mongo_fetch'):
+            chunks = list(self.collection.find(to_mongo(filters), {'embedding': 1, 'text': 1, 'metadata': 1}))
+
+        if not chunks:
+            return [[] for _ in query_embeddings]
+
+        with stage('similarity'):
+            embeddings = [decode_embedding(chunk['embedding']) for chunk in chunks]
+            similarities = cosine_similarity(query_embeddings, embeddings)
+
+        results = []
+        for row in similarities:
+            results.append([{
+                'id': chunks[i]['_id'],
                 'text': chunks[i]['text'],
                 'metadata': chunks[i].get('metadata', {}),
-                'score': float(similarities[i])
-            } for i in top_indices]
-            
-            return results
-        except Exception as e:
-            logger.error(f"Vector search failed: {str(e)}")
-            raise
\ No newline at end of file
+                'score': float(row[i])
+            } for i in top_k_indices(row, top_k)])
+        return results
@@ -0,0 +1,192 @@
+import numpy as np
+from bson.binary import Binary
+
+BLOCK_SIZE = 65536
+
+# Number of set bits in every byte value, used for Hamming distances
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def encode_embedding(vector):
+    """Pack an embedding as little-endian float32 bytes for storage in MongoDB"""
+    return Binary(np.asarray(vector, dtype='<f4').tobytes())
+
+
+def decode_embedding(value):
+    """Read an embedding stored either as packed bytes or as a BSON array"""
+    if isinstance(value, (bytes, bytearray)):
+        return np.frombuffer(value, dtype='<f4').astype(np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+class Codec:
+    """
+    Storage format for unit vectors.
+
+    `encode` turns float32 rows into codes, `scores` estimates the inner
+    product of every code row with a float32 query (higher is more similar)
+    without materializing the whole matrix as float32, and `decode` returns
+    an approximate float32 reconstruction. Every search path scores code
+    rows through `score_block`, so single, batched, sharded and filtered
+    searches rank a snapshot identically.
+    """
+
+    name = None
+    exact = False
+    # Max per-component reconstruction error, None when decode is lossy beyond comparison
+    tolerance = None
+
+    def fit(self, vectors):
+        return self
+
+    def encode(self, vectors):
+        raise NotImplementedError
+
+    def decode(self, codes):
+        raise NotImplementedError
+
+    def scores(self, codes, query):
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), BLOCK_SIZE):
+            out[start:start + BLOCK_SIZE] = self.score_block(codes[start:start + BLOCK_SIZE], query[None])[:, 0]
+        return out
+
+    def score_block(self, block, queries):
+        """Estimated inner products of code rows with each query row, (len(block), len(queries))"""
+        return self.decode(block) @ queries.T
+
+    def bytes_per_vector(self, dimension):
+        raise NotImplementedError
+
+    def params(self):
+        """Arrays needed to rebuild the codec, for persistence"""
+        return {}
+
+    @classmethod
+    def from_params(cls, params):
+        return cls()
+
+
+class Float32Codec(Codec):
+    name = 'float32'
+    exact = True
+    tolerance = 1e-6
+
+    def encode(self, vectors):
+        return np.asarray(vectors, dtype=np.float32)
+
+    def decode(self, codes):
+        return np.asarray(codes, dtype=np.float32)
+
+    def scores(self, codes, query):
+        return codes @ query
+
+    def score_block(self, block, queries):
+        return np.asarray(block, dtype=np.float32) @ queries.T
+
+    def bytes_per_vector(self, dimension):
+        return 4 * dimension
+
+
+class Float16Codec(Codec):
+    name = 'float16'
+    tolerance = 1e-3
+
+    def encode(self, vectors):
+        return np.asarray(vectors, dtype=np.float16)
+
+    def decode(self, codes):
+        return np.asarray(codes, dtype=np.float32)
+
+    def bytes_per_vector(self, dimension):
+        return 2 * dimension
+
+
+class Int8Codec(Codec):
+    """Symmetric scalar quantization with one scale per dimension"""
+
+    name = 'int8'
+
+    def __init__(self, scales=None):
+        self.scales = scales
+
+    def fit(self, vectors):
+        peak = None
+        for start in range(0, len(vectors), BLOCK_SIZE):
+            block_peak = np.abs(np.asarray(vectors[start:start + BLOCK_SIZE], dtype=np.float32)).max(axis=0)
+            peak = block_peak if peak is None else np.maximum(peak, block_peak)
+        self.scales = (np.maximum(peak, 1e-12) / 127).astype(np.float32)
+        return self
+
+    def encode(self, vectors):
+        codes = np.rint(np.asarray(vectors, dtype=np.float32) / self.scales)
+        return np.clip(codes, -127, 127).astype(np.int8)
+
+    def decode(self, codes):
+        return codes.astype(np.float32) * self.scales
+
+    def score_block(self, block, queries):
+        # (codes * scales) @ q == codes @ (scales * q)
+        return block.astype(np.float32) @ (queries * self.scales).T
+
+    def bytes_per_vector(self, dimension):
+        return dimension
+
+    def params(self):
+        return {'scales': self.scales}
+
+    @classmethod
+    def from_params(cls, params):
+        return cls(scales=np.asarray(params['scales'], dtype=np.float32))
+
+
+class BinaryCodec(Codec):
+    """
+    One sign bit per dimension. Scores are derived from the Hamming distance
+    to the query's sign bits, which is only good for pre-screening a candidate
+    set that is then rescored at full precision.
+    """
+
+    name = 'binary'
+
+    def __init__(self, dimension=None):
+        self.dimension = dimension
+
+    def fit(self, vectors):
+        self.dimension = vectors.shape[1]
+        return self
+
+    def encode(self, vectors):
+        return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+    def decode(self, codes):
+        signs = np.unpackbits(codes, axis=1, count=self.dimension).astype(np.float32) * 2 - 1
+        return signs / np.sqrt(self.dimension)
+
+    def score_block(self, block, queries):
+        scores = np.empty((len(block), len(queries)), dtype=np.float32)
+        for q, query_bits in enumerate(np.packbits(queries > 0, axis=1)):
+            hamming = POPCOUNT[np.bitwise_xor(block, query_bits)].sum(axis=1, dtype=np.int32)
+            scores[:, q] = (self.dimension - 2 * hamming) / self.dimension
+        return scores
+
+    def bytes_per_vector(self, dimension):
+        return (dimension + 7) // 8
+
+    def params(self):
+        return {'dimension': np.array(self.dimension)}
+
+    @classmethod
+    def from_params(cls, params):
+        return cls(dimension=int(params['dimension']))
+
+
+CODECS = {codec.name: codec for codec in (Float32Codec, Float16Codec, Int8Codec, BinaryCodec)}
+
+
+def get_codec(name):
+    """Instantiate an (unfitted) codec by name"""
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown vector precision '{name}', expected one of {tuple(CODECS)}")
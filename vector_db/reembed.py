@@ -0,0 +1,212 @@
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from pymongo import DeleteMany, ReplaceOne
+
+from vector_db.ingestion import content_hash, embedding_tag
+from vector_db.quantization import encode_embedding
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = 'reembed_jobs'
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class ReembedJob:
+    """
+    Re-embeds a chunk collection with a new model into a shadow collection.
+
+    The live collection keeps serving queries while the job copies every
+    chunk, with a fresh embedding and tag, into `<source>__reembed` in
+    `_id` order and in large batches. Progress (last copied `_id`, counts,
+    start time) is stored in the `reembed_jobs` collection after every batch,
+    so a restarted job resumes where it stopped.
+
+    Once the copy is complete, catch-up passes re-embed chunks written to
+    the live collection since the job started and drop chunks deleted from
+    it. The shadow collection then replaces the live one with a single
+    renameCollection(dropTarget=True), which is atomic for readers. Writes
+    landing between the last catch-up pass and the rename are lost, so
+    ingestion should be paused for the cutover.
+
+    Running a job again for the model and version of a completed one does
+    nothing unless `force` is passed.
+    """
+
+    def __init__(self, db, model, model_name, version=None, source='document_chunks',
+                 batch_size=None, progress_seconds=10):
+        self.db = db
+        self.model = model
+        self.tag = embedding_tag(model_name, version)
+        self.source = db[source]
+        self.shadow = db[f"{source}__reembed"]
+        self.jobs = db[JOBS_COLLECTION]
+        self.batch_size = batch_size or int(os.getenv('REEMBED_BATCH_SIZE', 1024))
+        self.progress_seconds = progress_seconds
+        self._last_report = 0.0
+
+    def status(self):
+        """Stored job state plus rate and ETA, or None when no job exists"""
+        job = self.jobs.find_one({'_id': self.source.name})
+        if job is None:
+            return None
+        elapsed = (_now() - job['started_at']).total_seconds()
+        # Rate over this job's lifetime; `resumed_done` excludes work from before a restart
+        copied = job['done'] - job.get('resumed_done', 0)
+        elapsed_run = (_now() - job.get('resumed_at', job['started_at'])).total_seconds()
+        rate = copied / elapsed_run if elapsed_run > 0 else 0.0
+        remaining = max(job['total'] - job['done'], 0)
+        job.update({
+            'elapsed_seconds': elapsed,
+            'chunks_per_sec': rate,
+            'eta_seconds': remaining / rate if rate else None,
+            'percent': 100.0 * job['done'] / job['total'] if job['total'] else 100.0,
+        })
+        return job
+
+    def run(self, cutover=True, force=False):
+        """Copy (or resume copying) the corpus, catch up, and optionally cut over"""
+        job = self._start(force)
+        if job['state'] == 'copying':
+            self._copy(job)
+            self.jobs.update_one({'_id': job['_id']}, {'$set': {'state': 'copied'}})
+        if cutover:
+            self.cutover(job['started_at'])
+        return self.status()
+
+    def cutover(self, since=None):
+        """Catch up with writes since `since`, then atomically replace the live collection"""
+        job = self.jobs.find_one({'_id': self.source.name})
+        if job is None or job['state'] not in ('copied', 'complete'):
+            raise ValueError(f"No finished re-embedding of {self.source.name} to cut over to")
+        if job['state'] == 'complete':
+            return
+        since = since or job['started_at']
+
+        # Repeat until a pass is small, so the final pass before the rename is short
+        while True:
+            pass_start = _now()
+            changed = self._catch_up(since)
+            since = pass_start
+            if changed <= self.batch_size:
+                break
+        self._catch_up(since)
+
+        for name, spec in self.source.index_information().items():
+            if name != '_id_':
+                options = {k: v for k, v in spec.items() if k not in ('key', 'v', 'ns')}
+                self.shadow.create_index(spec['key'], name=name, **options)
+
+        self.shadow.rename(self.source.name, dropTarget=True)
+        self.jobs.update_one({'_id': job['_id']}, {'$set': {'state': 'complete', 'cutover_at': _now()}})
+        logger.info(f"Cut over {self.source.name} to {self.tag['embedding_model']} (version {self.tag['embedding_version']})")
+
+    def _start(self, force=False):
+        job = self.jobs.find_one({'_id': self.source.name})
+        if job is not None and job['tag'] == self.tag and job['state'] == 'complete' and not force:
+            logger.info(f"{self.source.name} was already re-embedded with {self.tag['embedding_model']}")
+            return job
+        if job is not None and job['tag'] == self.tag and job['state'] != 'complete':
+            logger.info(f"Resuming re-embedding of {self.source.name} after {job['done']} chunks")
+            self.jobs.update_one({'_id': job['_id']}, {'$set': {
+                'resumed_at': _now(), 'resumed_done': job['done'],
+            }})
+            return job
+
+        # A new target model (or a forced rerun) starts over with an empty shadow
+        self.shadow.drop()
+        job = {
+            '_id': self.source.name,
+            'tag': self.tag,
+            'state': 'copying',
+            'last_id': None,
+            'done': 0,
+            'total': self.source.estimated_document_count(),
+            'started_at': _now(),
+        }
+        self.jobs.replace_one({'_id': job['_id']}, job, upsert=True)
+        logger.info(f"Re-embedding {job['total']} chunks of {self.source.name} with {self.tag['embedding_model']}")
+        return job
+
+    def _copy(self, job):
+        query = {} if job['last_id'] is None else {'_id': {'$gt': job['last_id']}}
+        cursor = self.source.find(query, {'embedding': 0}).sort('_id', 1).batch_size(self.batch_size)
+
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                self._copy_batch(job, batch)
+                batch = []
+        if batch:
+            self._copy_batch(job, batch)
+
+    def _copy_batch(self, job, docs):
+        self.shadow.bulk_write(self._reembed(docs), ordered=False)
+        job['last_id'] = docs[-1]['_id']
+        job['done'] += len(docs)
+        self.jobs.update_one({'_id': job['_id']}, {'$set': {
+            'last_id': job['last_id'], 'done': job['done'], 'updated_at': _now(),
+        }})
+        self._report()
+
+    def _reembed(self, docs):
+        embeddings = self.model.encode([doc.get('text', '') for doc in docs], show_progress_bar=False)
+        now = _now()
+        operations = []
+        for doc, embedding in zip(docs, embeddings):
+            doc.update(self.tag)
+            doc['embedding'] = encode_embedding(embedding)
+            doc['updated_at'] = now
+            # Ingestion content hashes include the model name, so they change too
+            if 'content_hash' in doc:
+                doc['content_hash'] = content_hash(self.tag['embedding_model'], doc.get('text', ''))
+            operations.append(ReplaceOne({'_id': doc['_id']}, doc, upsert=True))
+        return operations
+
+    def _catch_up(self, since):
+        """Mirror live-collection changes made at or after `since`; returns the number applied"""
+        changed = self._reembed_query({'updated_at': {'$gte': since}})
+
+        # Untimestamped inserts and deletions are found by comparing id sets
+        live_ids = {doc['_id'] for doc in self.source.find({}, {'_id': 1})}
+        shadow_ids = {doc['_id'] for doc in self.shadow.find({}, {'_id': 1})}
+        missing = list(live_ids - shadow_ids)
+        if missing:
+            changed += self._reembed_query({'_id': {'$in': missing}})
+        stale = list(shadow_ids - live_ids)
+        if stale:
+            self.shadow.bulk_write([DeleteMany({'_id': {'$in': stale}})])
+            changed += len(stale)
+        logger.info(f"Re-embedding catch-up applied {changed} changes")
+        return changed
+
+    def _reembed_query(self, query):
+        count, batch = 0, []
+        for doc in self.source.find(query, {'embedding': 0}):
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                self.shadow.bulk_write(self._reembed(batch), ordered=False)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.shadow.bulk_write(self._reembed(batch), ordered=False)
+            count += len(batch)
+        return count
+
+    def _report(self):
+        now = time.monotonic()
+        if now - self._last_report < self.progress_seconds:
+            return
+        self._last_report = now
+        status = self.status()
+        eta = f"{status['eta_seconds']:.0f}s" if status['eta_seconds'] is not None else "unknown"
+        logger.info(
+            f"Re-embedded {status['done']}/{status['total']} chunks ({status['percent']:.1f}%), "
+            f"{status['chunks_per_sec']:.1f} chunks/sec, ETA {eta}"
+        )
@@ -0,0 +1,224 @@
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from vector_db.index import batch_top_k
+from vector_db.snapshot import Snapshot
+
+logger = logging.getLogger(__name__)
+
+# Snapshots mapped by this worker process; two versions overlap during a swap
+_snapshots = OrderedDict()
+
+
+def _open(path):
+    snapshot = _snapshots.get(path)
+    if snapshot is None:
+        while len(_snapshots) >= 2:
+            _snapshots.popitem(last=False)
+        snapshot = _snapshots[path] = Snapshot(path)
+    return snapshot
+
+
+def _ready():
+    return os.getpid()
+
+
+def shard_top_k(path, start, end, dead, queries, top_k):
+    """
+    Top_k of snapshot rows start..end for each query, skipping the sorted
+    global row numbers in `dead`. Runs in a pool worker, which maps the
+    snapshot once; the rows are read from the shared page cache, not copied.
+    Returns global (rows, scores), both (num_queries, <=top_k).
+    """
+    snapshot = _open(path)
+
+    def block_scores(block_start, block_end):
+        first, last = start + block_start, start + block_end
+        scores = snapshot.codec.score_block(snapshot.matrix[first:last], queries)
+        if len(dead):
+            lo, hi = np.searchsorted(dead, (first, last))
+            scores[dead[lo:hi] - first] = -np.inf
+        return scores
+
+    rows, scores = batch_top_k(end - start, block_scores, len(queries), top_k)
+    return rows + start, scores
+
+
+def merge_top_k(results, top_k):
+    """Global (rows, scores) from per-shard (rows, scores) results, best first"""
+    rows = np.hstack([shard_rows for shard_rows, _ in results])
+    scores = np.hstack([shard_scores for _, shard_scores in results])
+    if scores.shape[1] > top_k:
+        keep = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        rows = np.take_along_axis(rows, keep, axis=1)
+        scores = np.take_along_axis(scores, keep, axis=1)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return np.take_along_axis(rows, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+class ShardPlan(namedtuple('ShardPlan', ('path', 'bounds', 'dead'))):
+    """
+    Row ranges of one snapshot: shard i covers rows bounds[i]..bounds[i + 1]
+    and skips the masked rows dead[i].
+    """
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    def live_rows(self):
+        return [int(end - start - len(dead)) for start, end, dead in zip(self.bounds, self.bounds[1:], self.dead)]
+
+
+class _PendingSearch:
+    """Shard searches in flight; `result` merges them"""
+
+    def __init__(self, pool, futures, top_k):
+        self._pool = pool
+        self._futures = futures
+        self._top_k = top_k
+
+    def result(self):
+        try:
+            return merge_top_k([future.result() for future in self._futures], self._top_k)
+        except BrokenProcessPool:
+            self._pool._failed()
+            raise
+
+
+class ShardPool:
+    """
+    Process pool that searches a memory-mapped snapshot in parallel.
+
+    The snapshot's rows are split into `shards` (VECTOR_SHARDS) contiguous
+    ranges, each holding the same number of live rows. A search sends the
+    query block to one worker process per shard; every worker maps the same
+    snapshot files, so the matrix is shared through the page cache rather
+    than copied, computes a local top_k over its range with the rows masked
+    by later changes skipped, and the caller merges the local results into
+    the global top_k. Plans are cut again whenever the index publishes a new
+    snapshot or masks more rows, so shards stay balanced as ingestion
+    replaces and deletes chunks.
+
+    A snapshot smaller than two shards of `min_rows` (VECTOR_SHARD_MIN_ROWS)
+    is searched in-process, where the fan-out would cost more than it saves.
+    Workers are spawned rather than forked, so they do not inherit the
+    server's threads and locks.
+    """
+
+    def __init__(self, shards=None, min_rows=None):
+        self.shards = int(os.getenv('VECTOR_SHARDS', 0)) if shards is None else shards
+        self.min_rows = min_rows or int(os.getenv('VECTOR_SHARD_MIN_ROWS', 50000))
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.searches = 0
+        self.failures = 0
+        self.rebalances = 0
+        self.last_plan = None
+
+    @property
+    def enabled(self):
+        return self.shards > 1
+
+    def plan(self, snapshot, live=None):
+        """
+        ShardPlan over the rows of `snapshot` with `live` as the row mask
+        (None: every row is live), or None if it is too small to shard.
+        """
+        rows = len(snapshot)
+        count = min(self.shards, rows // self.min_rows) if self.enabled else 0
+        if count < 2:
+            return None
+        if live is None:
+            bounds = np.linspace(0, rows, count + 1).astype(np.int64)
+            dead = np.empty(0, dtype=np.int64)
+        else:
+            live_through = np.cumsum(live)
+            targets = live_through[-1] * np.arange(1, count) / count
+            cuts = np.searchsorted(live_through, targets, side='left') + 1
+            bounds = np.concatenate(([0], cuts, [rows])).astype(np.int64)
+            dead = np.flatnonzero(~live).astype(np.int64)
+        splits = np.searchsorted(dead, bounds)
+        plan = ShardPlan(snapshot.path, bounds, [dead[lo:hi] for lo, hi in zip(splits, splits[1:])])
+        with self._lock:
+            self.rebalances += 1
+            self.last_plan = plan
+        self.start()
+        return plan
+
+    def start(self):
+        """Spawn the workers now (they import numpy and map snapshots on first use)"""
+        executor = self._executor_for_process()
+        for _ in range(self.shards):
+            executor.submit(_ready)
+
+    def submit(self, plan, queries, top_k):
+        """Start searching every shard of `plan`; returns a handle whose `result()` is (rows, scores)"""
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        try:
+            futures = self._submit_shards(plan, queries, top_k)
+        except BrokenProcessPool:
+            self._failed()
+            futures = self._submit_shards(plan, queries, top_k)
+        with self._lock:
+            self.searches += 1
+        return _PendingSearch(self, futures, top_k)
+
+    def search(self, plan, queries, top_k):
+        return self.submit(plan, queries, top_k).result()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            plan = self.last_plan
+            return {
+                'enabled': self.enabled,
+                'shards': self.shards,
+                'min_rows': self.min_rows,
+                'running': self._executor is not None and self._pid == os.getpid(),
+                'searches': self.searches,
+                'failures': self.failures,
+                'rebalances': self.rebalances,
+                'live_rows': plan.live_rows() if plan is not None else [],
+            }
+
+    def _submit_shards(self, plan, queries, top_k):
+        executor = self._executor_for_process()
+        return [
+            executor.submit(shard_top_k, plan.path, int(start), int(end), dead, queries, top_k)
+            for start, end, dead in zip(plan.bounds, plan.bounds[1:], plan.dead)
+        ]
+
+    def _executor_for_process(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # A forked server worker must not use its parent's pool
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.shards, mp_context=multiprocessing.get_context('spawn')
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _failed(self):
+        """Drop a pool that lost a worker; the next search spawns a new one"""
+        logger.warning("A shard worker died; restarting the shard pool")
+        with self._lock:
+            self.failures += 1
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+shard_pool = ShardPool()
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, timezone
+
+import numpy as np
+from bson import json_util
+
+from vector_db.quantization import CODECS, BLOCK_SIZE, decode_embedding, get_codec
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+SNAPSHOT_DTYPES = tuple(CODECS)
+
+
+def _id_hash(data):
+    """64-bit hash of an encoded id record"""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+class _Records:
+    """Memory-mapped sequence of JSON records, decoded only when accessed"""
+
+    def __init__(self, data_path, offsets_path):
+        self._offsets = np.load(offsets_path, mmap_mode='r')
+        if os.path.getsize(data_path):
+            self._data = np.memmap(data_path, dtype=np.uint8, mode='r')
+        else:
+            self._data = np.empty(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return json_util.loads(self._data[start:end].tobytes())
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class _RecordWriter:
+    def __init__(self, data_path, hashed=False):
+        self._file = open(data_path, 'wb')
+        self._offsets = [0]
+        self.hashes = [] if hashed else None
+
+    def write(self, value):
+        data = json_util.dumps(value).encode('utf-8')
+        self._file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+        if self.hashes is not None:
+            self.hashes.append(_id_hash(data))
+
+    def close(self, offsets_path):
+        self._file.close()
+        np.save(offsets_path, np.array(self._offsets, dtype=np.int64))
+
+
+class Snapshot:
+    """
+    Read-only, memory-mapped export of `document_chunks`.
+
+    The embedding matrix, ids and chunk metadata are mapped rather than read,
+    so every worker process opening the same snapshot shares one copy in the
+    page cache and opening it costs milliseconds regardless of corpus size.
+
+    The matrix holds codes of the snapshot's codec (see
+    vector_db.quantization); `scores` and `vectors` go through it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        self.version = self.manifest['version']
+        self.watermark = datetime.fromisoformat(self.manifest['watermark'])
+        self.matrix = np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r')
+        codec_cls = CODECS[self.manifest['dtype']]
+        codec_path = os.path.join(path, 'codec.npz')
+        self.codec = codec_cls.from_params(np.load(codec_path)) if os.path.exists(codec_path) else codec_cls()
+        self.ids = _Records(os.path.join(path, 'ids.bin'), os.path.join(path, 'ids_offsets.npy'))
+        self.metadata = _Records(os.path.join(path, 'metadata.bin'), os.path.join(path, 'metadata_offsets.npy'))
+        hashes_path = os.path.join(path, 'id_hashes.npy')
+        if os.path.exists(hashes_path):
+            self._id_hashes = np.load(hashes_path, mmap_mode='r')
+            self._id_rows = np.load(os.path.join(path, 'id_rows.npy'), mmap_mode='r')
+        else:
+            self._id_hashes = self._id_rows = None
+        self._rows = None
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def dimension(self):
+        return self.manifest['dimension'] or None
+
+    @property
+    def embedding_model(self):
+        """Model that produced the exported vectors (None if untagged or exported without it)"""
+        return self.manifest.get('embedding_model')
+
+    def row_of(self, doc_id):
+        """Row number of `doc_id`, or None, by binary search of the sorted id hashes"""
+        if self._id_hashes is None:
+            # Exported before the id hashes were stored: decode the id table once
+            if self._rows is None:
+                self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+            return self._rows.get(doc_id)
+        key = np.uint64(_id_hash(json_util.dumps(doc_id).encode('utf-8')))
+        first = int(np.searchsorted(self._id_hashes, key, side='left'))
+        last = int(np.searchsorted(self._id_hashes, key, side='right'))
+        for i in range(first, last):
+            row = int(self._id_rows[i])
+            if self.ids[row] == doc_id:
+                return row
+        return None
+
+    def scores(self, query):
+        """Estimated inner products of every row with `query`"""
+        return self.codec.scores(self.matrix, query)
+
+    def vectors(self, rows):
+        """Approximate float32 vectors for `rows`"""
+        return self.codec.decode(self.matrix[rows])
+
+
+def current_version(root):
+    """Name of the snapshot version CURRENT points to, or None"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def open_current(root):
+    """Open the snapshot CURRENT points to, or return None if there is none"""
+    version = current_version(root)
+    if version is None:
+        return None
+    return Snapshot(os.path.join(root, version))
+
+
+def export_snapshot(collection, root, dtype='float32', keep=2, batch_size=1000):
+    """
+    Write `collection` to a new snapshot version under `root` and publish it.
+
+    Vectors are normalized, staged as float32, then encoded with the `dtype`
+    codec (fitting it on the whole corpus first). The new version becomes
+    visible through an atomic rename of CURRENT once every file is complete,
+    so readers never observe a partially written snapshot. Older versions
+    beyond `keep` are pruned; processes that still map them keep working
+    because unlinked files stay readable until unmapped.
+    """
+    if dtype not in SNAPSHOT_DTYPES:
+        raise ValueError(f"Unsupported snapshot dtype '{dtype}', expected one of {SNAPSHOT_DTYPES}")
+
+    started = datetime.now(timezone.utc).replace(tzinfo=None)
+    version = started.strftime('%Y%m%dT%H%M%S%f')
+    path = os.path.join(root, version)
+    os.makedirs(path)
+
+    query = {'embedding': {'$exists': True}}
+    expected = collection.count_documents(query)
+    ids = _RecordWriter(os.path.join(path, 'ids.bin'), hashed=True)
+    metadata = _RecordWriter(os.path.join(path, 'metadata.bin'))
+    staging_path = os.path.join(path, 'staging.npy')
+    staging = None
+    model = None
+    count = 0
+
+    cursor = collection.find(query, {'embedding': 1, 'metadata': 1, 'embedding_model': 1}, batch_size=batch_size)
+    for doc in cursor:
+        if count == expected:
+            # Inserted during the export; picked up by the readers' refresh
+            break
+        vector = decode_embedding(doc['embedding'])
+        doc_model = doc.get('embedding_model')
+        if model is None:
+            model = doc_model
+        elif doc_model is not None and doc_model != model:
+            logger.warning(f"Skipping chunk {doc['_id']}: embedded with {doc_model}, snapshot has {model}")
+            continue
+        if staging is None:
+            staging = np.lib.format.open_memmap(
+                staging_path, mode='w+', dtype=np.float32, shape=(expected, vector.shape[0])
+            )
+        elif vector.shape[0] != staging.shape[1]:
+            logger.warning(f"Skipping chunk {doc['_id']}: embedding dimension {vector.shape[0]}")
+            continue
+        norm = np.linalg.norm(vector)
+        staging[count] = vector / norm if norm > 0 else vector
+        ids.write(doc['_id'])
+        metadata.write(doc.get('metadata', {}))
+        count += 1
+
+    ids.close(os.path.join(path, 'ids_offsets.npy'))
+    # Sorted id hashes with their rows, so readers look ids up without decoding the id table
+    hashes = np.array(ids.hashes, dtype=np.uint64)
+    order = np.argsort(hashes, kind='stable')
+    np.save(os.path.join(path, 'id_hashes.npy'), hashes[order])
+    np.save(os.path.join(path, 'id_rows.npy'), order.astype(np.int64))
+    metadata.close(os.path.join(path, 'metadata_offsets.npy'))
+    codec = get_codec(dtype)
+    if staging is not None and count:
+        dimension = staging.shape[1]
+        vectors = staging[:count]
+        codec.fit(vectors)
+        first = codec.encode(vectors[:1])
+        matrix = np.lib.format.open_memmap(
+            os.path.join(path, 'embeddings.npy'), mode='w+',
+            dtype=first.dtype, shape=(count, first.shape[1])
+        )
+        for start in range(0, count, BLOCK_SIZE):
+            matrix[start:start + BLOCK_SIZE] = codec.encode(vectors[start:start + BLOCK_SIZE])
+        matrix.flush()
+        del matrix, vectors
+    else:
+        dimension = 0
+        np.save(os.path.join(path, 'embeddings.npy'), np.empty((0, 0), dtype=np.float32))
+    del staging
+    if os.path.exists(staging_path):
+        os.remove(staging_path)
+    if codec.params():
+        np.savez(os.path.join(path, 'codec.npz'), **codec.params())
+
+    manifest = {
+        'version': version,
+        'count': count,
+        'dimension': dimension,
+        'dtype': dtype,
+        'embedding_model': model,
+        'collection': collection.name,
+        'created_at': started.isoformat(),
+        # Chunks written after the export started are re-read by readers
+        'watermark': started.isoformat(),
+    }
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    tmp_current = os.path.join(root, f"{CURRENT_FILE}.tmp")
+    with open(tmp_current, 'w') as f:
+        f.write(version)
+    os.replace(tmp_current, os.path.join(root, CURRENT_FILE))
+    logger.info(f"Published snapshot {version}: {count} chunks, dim={dimension}, dtype={dtype}")
+
+    prune_snapshots(root, keep=keep)
+    return path
+
+
+def prune_snapshots(root, keep=2):
+    """Delete all but the newest `keep` versions, never the current one"""
+    current = current_version(root)
+    versions = sorted(
+        name for name in os.listdir(root)
+        if os.path.isfile(os.path.join(root, name, MANIFEST_FILE))
+    )
+    for name in versions[:-keep] if keep else versions:
+        if name != current:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+            logger.info(f"Pruned snapshot {name}")
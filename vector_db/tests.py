@@ -0,0 +1,551 @@
+import math
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from vector_db.ann import IVFIndex, evaluate_recall
+from vector_db.benchmarks import (
+    InMemoryCollection, exact_neighbours, recall, sample_queries, synthetic_corpus, synthetic_documents
+)
+from vector_db.filters import matches, normalize_filters, to_mongo
+from vector_db.index import VectorIndex
+from vector_db.lexical import LexicalIndex, reciprocal_rank_fusion, tokenize
+from vector_db.mongodb_manager import MongoDBManager
+from vector_db.shards import ShardPool, merge_top_k, shard_top_k
+from vector_db.snapshot import export_snapshot, open_current
+
+
+def tagged_chunks(model, seed, count=50, dimension=16):
+    """Chunks embedded by `model`; every model yields the same ids and dimension"""
+    vectors = np.random.default_rng(seed).normal(size=(count, dimension)).astype(np.float32)
+    return [{
+        '_id': f"chunk-{i}",
+        'embedding': vectors[i].tolist(),
+        'embedding_model': model,
+        'metadata': {},
+        'updated_at': datetime(2024, 1, 1),
+    } for i in range(count)]
+
+
+class SnapshotEmbeddingModelTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        export_snapshot(InMemoryCollection(tagged_chunks('model-a', seed=1)), self.root)
+
+    def index(self, collection):
+        return VectorIndex(collection, refresh_interval=0, snapshot_dir=self.root, shards=ShardPool(shards=0))
+
+    def test_manifest_records_model(self):
+        self.assertEqual(open_current(self.root).embedding_model, 'model-a')
+
+    def test_snapshot_of_same_model_is_used(self):
+        index = self.index(InMemoryCollection(tagged_chunks('model-a', seed=1)))
+        index.reload()
+        self.assertIsNotNone(index._state.base)
+        self.assertEqual(index.embedding_model, 'model-a')
+
+    def test_snapshot_of_other_model_with_same_dimension_is_rejected(self):
+        # Cut over to a model of the same dimension, keeping the chunk timestamps
+        chunks = tagged_chunks('model-b', seed=2)
+        index = self.index(InMemoryCollection(chunks))
+        index.reload()
+
+        self.assertIsNone(index._state.base)
+        self.assertEqual(index.embedding_model, 'model-b')
+        doc_id, _, score = index.search(chunks[7]['embedding'], top_k=1)[0]
+        self.assertEqual(doc_id, 'chunk-7')
+        self.assertAlmostEqual(score, 1.0, places=5)
+
+    def test_refresh_notices_cutover_with_same_dimension(self):
+        collection = InMemoryCollection(tagged_chunks('model-a', seed=1))
+        index = self.index(collection)
+        index.reload()
+        collection.insert_many(tagged_chunks('model-b', seed=2))
+
+        index.ensure_fresh()
+        self.assertIsNone(index._state.base)
+        self.assertEqual(index.embedding_model, 'model-b')
+
+
+class VectorIndexRefreshTests(SimpleTestCase):
+    def setUp(self):
+        self.chunks = tagged_chunks('model-a', seed=1, count=20)
+        for i, chunk in enumerate(self.chunks):
+            chunk['metadata'] = {'topic': 'even' if i % 2 == 0 else 'odd'}
+        self.collection = InMemoryCollection(self.chunks)
+        self.index = VectorIndex(self.collection, refresh_interval=0, shards=ShardPool(shards=0))
+        self.index.ensure_fresh()
+
+    def changed(self, i, **fields):
+        return dict(self.chunks[i], updated_at=datetime(2024, 1, 2), **fields)
+
+    def top_ids(self, embedding, top_k=1, filters=None):
+        return [doc_id for doc_id, _, _ in self.index.search(embedding, top_k=top_k, filters=filters)]
+
+    def test_new_chunk_is_searchable_after_refresh(self):
+        embedding = (-np.asarray(self.chunks[0]['embedding'])).tolist()
+        self.collection.insert_many([self.changed(0, _id='chunk-new', embedding=embedding)])
+        self.index.ensure_fresh()
+        self.assertEqual(len(self.index), 21)
+        self.assertEqual(self.top_ids(embedding), ['chunk-new'])
+
+    def test_changed_embedding_replaces_the_old_one(self):
+        embedding = self.chunks[5]['embedding']
+        self.collection.insert_many([self.changed(3, embedding=embedding)])
+        self.index.ensure_fresh()
+        self.assertEqual(len(self.index), 20)
+        self.assertEqual(set(self.top_ids(embedding, top_k=2)), {'chunk-3', 'chunk-5'})
+        self.assertNotIn('chunk-3', self.top_ids(self.chunks[3]['embedding'], top_k=1))
+
+    def test_deleted_chunk_is_dropped(self):
+        del self.collection.documents['chunk-7']
+        self.index.ensure_fresh()
+        self.assertEqual(len(self.index), 19)
+        self.assertNotIn('chunk-7', self.top_ids(self.chunks[7]['embedding'], top_k=20))
+
+    def test_changed_metadata_moves_chunk_between_filters(self):
+        even, odd = normalize_filters({'topic': 'even'}), normalize_filters({'topic': 'odd'})
+        embedding = self.chunks[4]['embedding']
+        self.assertEqual(self.top_ids(embedding, filters=even), ['chunk-4'])
+
+        self.collection.insert_many([self.changed(4, metadata={'topic': 'odd'})])
+        self.index.ensure_fresh()
+        self.assertEqual(self.top_ids(embedding, filters=odd), ['chunk-4'])
+        self.assertNotIn('chunk-4', self.top_ids(embedding, top_k=20, filters=even))
+
+
+class IVFIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.matrix = synthetic_corpus(2000, 32, clusters=40, seed=3)
+        self.queries = sample_queries(self.matrix, 50, seed=4)
+        self.ivf = IVFIndex.build(range(len(self.matrix)), self.matrix, nlist=32, nprobe=8)
+
+    def test_recall_against_exact_search(self):
+        report = {row['nprobe']: row['recall'] for row in evaluate_recall(
+            self.matrix, self.ivf, self.queries, top_k=10, nprobes=(1, 8, 32)
+        )}
+        self.assertEqual(report[32], 1.0)
+        self.assertGreaterEqual(report[8], 0.9)
+        self.assertLessEqual(report[1], report[8])
+
+    def test_incremental_insert_and_remove(self):
+        self.ivf.remove(range(100))
+        self.ivf.add(['new'], self.matrix[:1], normalized=True)
+        keys, scores = self.ivf.search(self.matrix[0], top_k=1)
+        self.assertEqual(keys, ['new'])
+        self.assertAlmostEqual(float(scores[0]), 1.0, places=5)
+        keys, _ = self.ivf.search(self.matrix[1], top_k=10, nprobe=32)
+        self.assertFalse(set(keys) & set(range(100)))
+
+    def test_saved_index_answers_the_same(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        path = os.path.join(root, 'ivf.npz')
+        self.ivf.save(path)
+        loaded = IVFIndex.load(path)
+        truth = exact_neighbours(self.matrix, self.queries, 10)
+        results = [loaded.search(query, top_k=10, nprobe=8)[0] for query in self.queries]
+        self.assertEqual(results, [self.ivf.search(query, top_k=10, nprobe=8)[0] for query in self.queries])
+        self.assertGreaterEqual(recall(truth, results), 0.9)
+
+    def test_vector_index_reuses_centroids_across_reloads(self):
+        chunks = tagged_chunks('model-a', seed=5, count=300)
+        index = VectorIndex(InMemoryCollection(chunks), refresh_interval=0, backend='ivf', shards=ShardPool(shards=0))
+        index.ensure_fresh()
+        centroids = index.ann.centroids
+        index.reload()
+        self.assertIs(index.ann.centroids, centroids)
+        self.assertEqual(len(index.ann), 300)
+        doc_id, _, score = index.search(chunks[9]['embedding'], top_k=1, nprobe=index.ann.nlist)[0]
+        self.assertEqual(doc_id, 'chunk-9')
+
+
+class SnapshotDeltaTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.chunks = tagged_chunks('model-a', seed=6, count=40)
+        self.collection = InMemoryCollection(self.chunks)
+        export_snapshot(self.collection, self.root)
+        self.index = VectorIndex(self.collection, refresh_interval=0, snapshot_dir=self.root, shards=ShardPool(shards=0))
+        self.index.ensure_fresh()
+
+    def after_export(self, i, **fields):
+        # Newer than the snapshot watermark, so it lands in the delta
+        return dict(self.chunks[i], updated_at=datetime(2100, 1, 1), **fields)
+
+    def test_base_serves_searches(self):
+        self.assertIsNotNone(self.index._state.base)
+        self.assertEqual(self.index._state.size, 0)
+        self.assertEqual(len(self.index), 40)
+        doc_id, _, score = self.index.search(self.chunks[12]['embedding'], top_k=1)[0]
+        self.assertEqual(doc_id, 'chunk-12')
+        self.assertAlmostEqual(score, 1.0, places=5)
+
+    def test_row_lookup(self):
+        base = self.index._state.base
+        self.assertEqual(base.ids[base.row_of('chunk-17')], 'chunk-17')
+        self.assertIsNone(base.row_of('chunk-missing'))
+
+    def test_delta_overrides_base_row(self):
+        embedding = (-np.asarray(self.chunks[3]['embedding'])).tolist()
+        self.collection.insert_many([self.after_export(3, embedding=embedding, metadata={'v': 2})])
+        self.index.ensure_fresh()
+
+        self.assertEqual(len(self.index), 40)
+        hits = self.index.search(embedding, top_k=1)
+        self.assertEqual(hits[0][:2], ('chunk-3', {'v': 2}))
+        ids = [doc_id for doc_id, _, _ in self.index.search(self.chunks[3]['embedding'], top_k=40)]
+        self.assertEqual(ids.count('chunk-3'), 1)
+        self.assertNotEqual(ids[0], 'chunk-3')
+
+    def test_deleted_base_row_is_masked(self):
+        del self.collection.documents['chunk-8']
+        self.index.ensure_fresh()
+        self.assertEqual(len(self.index), 39)
+        ids = [doc_id for doc_id, _, _ in self.index.search(self.chunks[8]['embedding'], top_k=40)]
+        self.assertNotIn('chunk-8', ids)
+
+    def test_new_snapshot_is_swapped_in(self):
+        self.collection.insert_many([self.after_export(5, metadata={'v': 3})])
+        self.index.ensure_fresh()
+        self.assertEqual(self.index._state.size, 1)
+
+        export_snapshot(self.collection, self.root)
+        self.index.ensure_fresh()
+        self.assertEqual(self.index._state.size, 0)
+        self.assertEqual(self.index.search(self.chunks[5]['embedding'], top_k=1)[0][:2], ('chunk-5', {'v': 3}))
+
+
+class QuantizedRescoreTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.matrix = synthetic_corpus(1000, 32, clusters=20, seed=5)
+        cls.queries = sample_queries(cls.matrix, 20, seed=1)
+        cls.truth = exact_neighbours(cls.matrix, cls.queries, 5)
+
+    def manager(self, dtype, rescore_factor=4):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        collection = InMemoryCollection(synthetic_documents(self.matrix))
+        export_snapshot(collection, root, dtype=dtype)
+        manager = MongoDBManager(collection=collection)
+        manager.index = VectorIndex(collection, refresh_interval=0, snapshot_dir=root, shards=ShardPool(shards=0))
+        manager.rescore_factor = rescore_factor
+        return manager
+
+    def rows(self, results):
+        return {int(result['id'].rsplit('-', 1)[1]) for result in results}
+
+    def assert_exact(self, manager, batch):
+        if batch:
+            results = manager.batch_similarity_search([query.tolist() for query in self.queries], top_k=5)
+        else:
+            results = [manager.cosine_similarity_search(query.tolist(), top_k=5) for query in self.queries]
+        self.assertEqual(recall(self.truth, [self.rows(hits) for hits in results]), 1.0)
+        for query, hits in zip(self.queries, results):
+            expected = self.matrix[sorted(self.rows(hits))] @ (query / np.linalg.norm(query))
+            self.assertTrue(np.allclose(sorted(hit['score'] for hit in hits), np.sort(expected), atol=1e-5))
+            self.assertEqual([hit['score'] for hit in hits], sorted((hit['score'] for hit in hits), reverse=True))
+
+    def test_only_lossy_codecs_are_rescored(self):
+        for dtype in ('float32', 'float16', 'int8', 'binary'):
+            index = self.manager(dtype).index
+            index.ensure_fresh()
+            self.assertIsNotNone(index._state.base)
+            self.assertEqual(index.quantized, dtype != 'float32', dtype)
+
+    def test_rescored_results_match_exact_search(self):
+        for dtype in ('float16', 'int8'):
+            for batch in (False, True):
+                with self.subTest(dtype=dtype, batch=batch):
+                    self.assert_exact(self.manager(dtype), batch)
+
+    def test_binary_needs_a_wider_candidate_set(self):
+        for batch in (False, True):
+            with self.subTest(batch=batch):
+                self.assert_exact(self.manager('binary', rescore_factor=20), batch)
+
+
+class MetadataFilterTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.chunks = tagged_chunks('model-a', seed=9, count=60)
+        for i, chunk in enumerate(self.chunks):
+            chunk['metadata'] = {'source': f"doc-{i % 3}.txt", 'tags': ['even' if i % 2 == 0 else 'odd', f"t{i % 5}"]}
+        self.collection = InMemoryCollection(self.chunks)
+
+    def test_normalize_canonicalizes(self):
+        self.assertIsNone(normalize_filters({}))
+        self.assertEqual(
+            normalize_filters({'tags': ['b', 'a', 'b'], 'source': 'x.txt'}),
+            {'source': ('x.txt',), 'tags': ('a', 'b')}
+        )
+
+    def test_normalize_rejects_invalid_filters(self):
+        for filters in (['source'], {'$where': 'x'}, {'meta.source': 'x'}, {'source': []}, {'source': {'$ne': 1}}):
+            with self.subTest(filters=filters):
+                with self.assertRaises(ValueError):
+                    normalize_filters(filters)
+
+    def test_matches_list_values(self):
+        filters = normalize_filters({'tags': ['even', 't9']})
+        self.assertTrue(matches({'tags': ['even', 't1']}, filters))
+        self.assertTrue(matches({'tags': 'even'}, filters))
+        self.assertFalse(matches({'tags': ['odd']}, filters))
+        self.assertFalse(matches({}, filters))
+        self.assertEqual(
+            to_mongo(normalize_filters({'source': 'a', 'tags': ['x', 'y']})),
+            {'metadata.source': 'a', 'metadata.tags': {'$in': ['x', 'y']}}
+        )
+
+    def assert_filtered_search(self, index):
+        query = np.random.default_rng(0).normal(size=16).astype(np.float32)
+        vectors = np.array([chunk['embedding'] for chunk in self.chunks], dtype=np.float32)
+        scores = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)) @ (query / np.linalg.norm(query))
+        for raw in ({'source': 'doc-1.txt'}, {'tags': 'odd', 'source': ['doc-0.txt', 'doc-2.txt']}, {'tags': 'none'}):
+            with self.subTest(filters=raw):
+                filters = normalize_filters(raw)
+                allowed = [i for i, chunk in enumerate(self.chunks) if matches(chunk['metadata'], filters)]
+                expected = [f"chunk-{i}" for i in sorted(allowed, key=lambda i: -scores[i])[:5]]
+                hits = index.search(query.tolist(), top_k=5, filters=filters)
+                self.assertEqual([doc_id for doc_id, _, _ in hits], expected)
+                self.assertTrue(all(matches(metadata, filters) for _, metadata, _ in hits))
+
+    def test_filtered_search_on_resident_rows(self):
+        index = VectorIndex(self.collection, refresh_interval=0, shards=ShardPool(shards=0))
+        index.ensure_fresh()
+        self.assert_filtered_search(index)
+
+    def test_filtered_search_on_snapshot_base(self):
+        export_snapshot(self.collection, self.root)
+        index = VectorIndex(self.collection, refresh_interval=0, snapshot_dir=self.root, shards=ShardPool(shards=0))
+        index.ensure_fresh()
+        self.assertIsNotNone(index._state.base)
+        self.assert_filtered_search(index)
+
+    def test_refresh_updates_postings(self):
+        index = VectorIndex(self.collection, refresh_interval=0, shards=ShardPool(shards=0))
+        index.ensure_fresh()
+        filters = normalize_filters({'source': 'doc-new.txt'})
+        self.assertEqual(index.search(self.chunks[4]['embedding'], top_k=5, filters=filters), [])
+
+        moved = dict(self.chunks[4], metadata={'source': 'doc-new.txt'}, updated_at=datetime(2100, 1, 1))
+        self.collection.insert_many([moved])
+        index.ensure_fresh()
+        hits = index.search(self.chunks[4]['embedding'], top_k=5, filters=filters)
+        self.assertEqual([doc_id for doc_id, _, _ in hits], ['chunk-4'])
+        hits = index.search(self.chunks[4]['embedding'], top_k=60, filters=normalize_filters({'source': 'doc-1.txt'}))
+        self.assertNotIn('chunk-4', [doc_id for doc_id, _, _ in hits])
+
+
+TEXTS = [
+    "The cat sat on the mat.",
+    "A dog chased the cat around the garden.",
+    "Quantum computing uses qubits.",
+    "The mat was red and the cat was grey, a cat of some age.",
+    "Gardens need water and sunlight.",
+]
+
+
+def text_chunks(texts, dimension=8, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(len(texts), dimension)).astype(np.float32)
+    return [{
+        '_id': f"text-{i}",
+        'text': text,
+        'embedding': vectors[i].tolist(),
+        'metadata': {'source': f"doc-{i % 2}.txt"},
+        'updated_at': datetime(2024, 1, 1),
+    } for i, text in enumerate(texts)]
+
+
+def bm25(texts, query, k1=1.2, b=0.75):
+    """Reference BM25 scores, straight from the formula"""
+    docs = [tokenize(text) for text in texts]
+    avgdl = sum(len(doc) for doc in docs) / len(docs)
+    scores = [0.0] * len(docs)
+    for term in set(tokenize(query)):
+        df = sum(term in doc for doc in docs)
+        if not df:
+            continue
+        idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+        for i, doc in enumerate(docs):
+            tf = doc.count(term)
+            scores[i] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(doc) / avgdl))
+    return scores
+
+
+class LexicalIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.collection = InMemoryCollection(text_chunks(TEXTS))
+        self.index = LexicalIndex(self.collection, refresh_interval=0)
+        self.index.ensure_fresh()
+
+    def assert_ranking(self, texts, query, hits):
+        expected = bm25(texts, query)
+        ranked = sorted((i for i in range(len(texts)) if expected[i] > 0), key=lambda i: -expected[i])
+        self.assertEqual([doc_id for doc_id, _ in hits], [f"text-{i}" for i in ranked])
+        for doc_id, score in hits:
+            self.assertAlmostEqual(score, expected[int(doc_id.split('-')[1])], places=4)
+
+    def test_bm25_ranking(self):
+        for query in ("cat mat", "garden cat", "qubits", "the cat"):
+            with self.subTest(query=query):
+                self.assert_ranking(TEXTS, query, self.index.search(query))
+        self.assertEqual(self.index.search("the and of"), [])
+        self.assertEqual(self.index.search("unicorn"), [])
+
+    def test_refresh_follows_updates_and_deletes(self):
+        texts = list(TEXTS)
+        texts[2] = "A cat on a quantum mat."
+        changed = text_chunks(texts)[2]
+        self.collection.insert_many([dict(changed, updated_at=datetime(2100, 1, 1))])
+        del self.collection.documents['text-4']
+        self.index.ensure_fresh()
+
+        self.assertEqual(len(self.index), 4)
+        self.assert_ranking(texts[:4], "cat mat quantum", self.index.search("cat mat quantum"))
+        self.assertEqual(self.index.search("qubits"), [])
+        self.assertEqual(self.index.search("sunlight"), [])
+
+    def test_saved_index_resumes(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        path = os.path.join(root, 'lexical.npz')
+        LexicalIndex(self.collection, path=path, refresh_interval=0).ensure_fresh()
+        self.assertTrue(os.path.exists(path))
+
+        texts = TEXTS + ["Another cat."]
+        self.collection.insert_many([dict(text_chunks(texts)[5], updated_at=datetime(2100, 1, 1))])
+        resumed = LexicalIndex(self.collection, path=path, refresh_interval=3600)
+        resumed.ensure_fresh()
+        self.assertEqual(len(resumed), 6)
+        self.assert_ranking(texts, "cat mat", resumed.search("cat mat"))
+
+    def test_searches_do_not_wait_for_a_refresh(self):
+        held, release = threading.Event(), threading.Event()
+
+        def hold():
+            with self.index._lock:
+                held.set()
+                release.wait(5)
+
+        worker = threading.Thread(target=hold)
+        worker.start()
+        self.addCleanup(worker.join)
+        self.addCleanup(release.set)
+        held.wait(5)
+        self.index.ensure_fresh()
+        self.assertEqual(self.index.search("qubits")[0][0], 'text-2')
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['c', 'a']], k=60)
+        self.assertEqual([doc_id for doc_id, _ in fused], ['a', 'c', 'b'])
+        self.assertAlmostEqual(fused[0][1], 1 / 61 + 1 / 62)
+        self.assertAlmostEqual(fused[2][1], 1 / 62)
+
+    def test_hybrid_hits_fuse_lexical_and_dense_ranks(self):
+        manager = MongoDBManager(collection=self.collection)
+        manager.index = VectorIndex(self.collection, refresh_interval=0, shards=ShardPool(shards=0))
+        query_embedding = self.collection.documents['text-1']['embedding']
+
+        hits = manager.hybrid_hits("cat mat", query_embedding, top_k=3)
+        lexical = [doc_id for doc_id, _ in self.index.search("cat mat")]
+        vectors = {doc_id: np.asarray(doc['embedding']) for doc_id, doc in self.collection.documents.items()}
+        query = np.asarray(query_embedding) / np.linalg.norm(query_embedding)
+        dense = sorted(lexical, key=lambda doc_id: -(vectors[doc_id] / np.linalg.norm(vectors[doc_id])) @ query)
+        expected = reciprocal_rank_fusion([lexical, dense], k=manager.rrf_k)[:3]
+        self.assertEqual([(doc_id, score) for doc_id, _, score in hits], expected)
+
+        filtered = manager.hybrid_hits("cat mat", query_embedding, top_k=3, filters=normalize_filters({'source': 'doc-1.txt'}))
+        self.assertEqual({doc_id for doc_id, _, _ in filtered}, {'text-1', 'text-3'})
+        self.assertIsNone(manager.hybrid_hits("unicorn", query_embedding))
+        self.assertEqual(
+            [hit['id'] for hit in manager.hybrid_search("unicorn", query_embedding, top_k=1)], ['text-1']
+        )
+
+
+class ShardedSearchTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.mkdtemp()
+        cls.matrix = synthetic_corpus(1200, 32, clusters=30, seed=8)
+        cls.collection = InMemoryCollection(synthetic_documents(cls.matrix))
+        export_snapshot(cls.collection, cls.root)
+        cls.pool = ShardPool(shards=3, min_rows=100)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.shutdown()
+        shutil.rmtree(cls.root, ignore_errors=True)
+        super().tearDownClass()
+
+    def index(self, shards):
+        index = VectorIndex(self.collection, refresh_interval=0, snapshot_dir=self.root, shards=shards)
+        index.ensure_fresh()
+        return index
+
+    def assert_same_hits(self, hits, expected):
+        self.assertEqual([hit[:2] for hit in hits], [hit[:2] for hit in expected])
+        self.assertTrue(np.allclose([hit[2] for hit in hits], [hit[2] for hit in expected], atol=1e-6))
+
+    def test_merge_equals_global_top_k(self):
+        scores = np.random.default_rng(1).normal(size=(4, 300)).astype(np.float32)
+        bounds = [0, 70, 71, 200, 300]
+        results = []
+        for start, end in zip(bounds, bounds[1:]):
+            local = np.argsort(-scores[:, start:end], axis=1)[:, :10]
+            results.append((local + start, np.take_along_axis(scores[:, start:end], local, axis=1)))
+        rows, merged = merge_top_k(results, 10)
+        expected = np.argsort(-scores, axis=1)[:, :10]
+        self.assertTrue(np.array_equal(rows, expected))
+        self.assertTrue(np.array_equal(merged, np.take_along_axis(scores, expected, axis=1)))
+
+    def test_shard_skips_dead_rows(self):
+        path = open_current(self.root).path
+        queries = sample_queries(self.matrix, 5, seed=2)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        dead = np.arange(100, 400, 3)
+        rows, _ = shard_top_k(path, 100, 400, dead, queries, 5)
+        scores = self.matrix[100:400] @ queries.T
+        scores[dead - 100] = -np.inf
+        self.assertTrue(np.array_equal(rows, np.argsort(-scores, axis=0)[:5].T + 100))
+
+    def test_plan_balances_live_rows(self):
+        snapshot = open_current(self.root)
+        live = np.ones(len(snapshot), dtype=bool)
+        live[:600:2] = False
+        plan = self.pool.plan(snapshot, live)
+        self.assertEqual(len(plan), 3)
+        self.assertEqual(sum(plan.live_rows()), 900)
+        self.assertLessEqual(max(plan.live_rows()) - min(plan.live_rows()), 1)
+        self.assertIsNone(ShardPool(shards=3, min_rows=1000).plan(snapshot))
+
+    def test_sharded_search_matches_single_process(self):
+        sharded, single = self.index(self.pool), self.index(ShardPool(shards=0))
+        self.assertIsNotNone(sharded._state.shard_plan)
+        changed = dict(self.collection.documents['synthetic-7'], updated_at=datetime(2100, 1, 1))
+        self.collection.insert_many([changed])
+        self.addCleanup(self.collection.insert_many, [dict(changed, updated_at=datetime(2024, 1, 1))])
+        removed = self.collection.documents.pop('synthetic-11')
+        self.addCleanup(self.collection.insert_many, [removed])
+        for index in (sharded, single):
+            index.ensure_fresh()
+
+        queries = sample_queries(self.matrix, 20, seed=4)
+        queries[0] = self.matrix[11]
+        expected = single.search_batch(queries.tolist(), top_k=10)
+        for hits, truth in zip(sharded.search_batch(queries.tolist(), top_k=10), expected):
+            self.assert_same_hits(hits, truth)
+        self.assert_same_hits(sharded.search(queries[3].tolist(), top_k=10), expected[3])
+        self.assertNotIn('synthetic-11', [doc_id for doc_id, _, _ in expected[0]])
+        self.assertGreater(self.pool.stats()['searches'], 0)